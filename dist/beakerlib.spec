@@ -45,7 +45,6 @@ Requires:   dnf-utils
 Requires:   yum-utils
 %endif
 Requires:   /usr/bin/bc
-Requires:   /usr/bin/time
 %if 0%{?rhel} < 8
 %else
 Recommends: beakerlib-redhat
@@ -137,6 +137,20 @@ Journal in XML format, requires python. This dependency can be avoided if the te
 
 XML journal can be transformed through XSLT template. Which template is used is configurable by setting BEAKERLIB_JOURNAL variable. Value can be either filename in which case beakerlib will try to use $INSTALL_DIR/xslt-template/$filename (e.g.: /usr/share/beakerlib/xstl-templates/xunit.xsl) or it can be path to a template anywhere on the system.
 
+=head2 journal.meta
+
+Queue of journal records the XML journal is created from. By default each
+line is a record with base64 encoded values whose indentation gives the
+structure. When the test is run with variable BEAKERLIB_METAFILE_VERSION
+set to 2, the metafile consists of JSON records with explicit depth, one
+per line, and journal.meta.index holds the byte offset of each phase start,
+one per line in order of phase starts. Tools can then read a single phase
+without parsing the rest of the metafile, e.g.
+
+    beakerlib-journalling --metafile journal.meta --phase 2
+
+Both formats give the same journal.xml.
+
 =head2 TestResults
 
 Overall results of the test in a 'sourceable' form. Each line contains a pair VAR=VALUE. All variable names have 'TESTRESULT_' prefix.
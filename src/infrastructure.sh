@@ -129,6 +129,17 @@ __INTERNAL_Mount(){
     fi
 }
 
+# records resources consumed by the test, as accounted by the test watcher
+# in the test's cgroup, as metrics of the cleanup phase
+__INTERNAL_TestWatcherMetrics()
+{
+    [ -s "$TESTWATCHER_RESOURCES" ] || return 0
+    local key value
+    while read -r key value; do
+        rlLogMetricLow "testwatcher.$key" "$value"
+    done < "$TESTWATCHER_RESOURCES"
+}
+
 __INTERNAL_rlCleanupGenFinal()
 {
     local __varname=
@@ -163,6 +174,7 @@ EOF
     cat >> "$__newfinal" <<EOF
 rlJournalStart
 rlPhaseStartCleanup
+__INTERNAL_TestWatcherMetrics
 EOF
 
     # body
@@ -1914,6 +1926,11 @@ impossible to use relative paths inside cleanup reliably - certain parts of
 the cleanup might have been added under different current directories (CWDs).
 Therefore always use absolute paths in append/prepend cleanup or make sure
 you never 'cd' elsewhere (ie. to a TmpDir).
+
+When the test watcher runs the test in a cgroup (C<--cgroup> option or
+C<TESTWATCHER_CGROUP> variable), the resources consumed by the whole test are
+recorded by the cleanup script as C<testwatcher.*> metrics (C<cpu_time>,
+C<memory_peak>, C<read_bytes>, ...) of the cleanup phase.
 =cut
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
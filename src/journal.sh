@@ -124,6 +124,19 @@ rlJournalStart(){
       exit 1
     }
 
+    # metafile format is kept when the test is resumed, e.g. after a reboot
+    if [[ -s "$__INTERNAL_BEAKERLIB_METAFILE" ]]; then
+      [[ "$(head -c 1 "$__INTERNAL_BEAKERLIB_METAFILE")" == "{" ]] \
+        && export __INTERNAL_METAFILE_VERSION=2 \
+        || export __INTERNAL_METAFILE_VERSION=1
+    elif [[ "$BEAKERLIB_METAFILE_VERSION" == "2" ]]; then
+      export __INTERNAL_METAFILE_VERSION=2
+      echo '{"beakerlib_metafile": 2}' > "$__INTERNAL_BEAKERLIB_METAFILE"
+      : > "$__INTERNAL_BEAKERLIB_METAFILE.index"
+    else
+      export __INTERNAL_METAFILE_VERSION=1
+    fi
+
     # Initialization of variables holding current state of the test
     export __INTERNAL_METAFILE_INDENT_LEVEL=0
     __INTERNAL_PHASE_TYPE=()
@@ -204,7 +217,10 @@ rlStartJournal() {
 __INTERNAL_JournalParamCheck(){
     __INTERNAL_XSLT=''
     if [[ "$BEAKERLIB_JOURNAL" != "0" ]]; then
-        if [[ -r "$BEAKERLIB/xslt-templates/$BEAKERLIB_JOURNAL" ]]; then
+        if [[ "$BEAKERLIB_JOURNAL" == "xunit.xsl" ]]; then
+            # journalist writes the same as the xunit template, without the transformation
+            __INTERNAL_XSLT="--format xunit"
+        elif [[ -r "$BEAKERLIB/xslt-templates/$BEAKERLIB_JOURNAL" ]]; then
             __INTERNAL_XSLT="--xslt $BEAKERLIB/xslt-templates/$BEAKERLIB_JOURNAL"
         elif [[ -r "$BEAKERLIB_JOURNAL" ]]; then
             __INTERNAL_XSLT="--xslt $BEAKERLIB_JOURNAL"
@@ -315,7 +331,9 @@ __INTERNAL_JournalXMLCreate() {
     local res=0
     [[ "$BEAKERLIB_JOURNAL" == "0" ]] || {
       if which python &> /dev/null; then
-        $__INTERNAL_JOURNALIST $__INTERNAL_XSLT --metafile \
+        # without xsl transformation the journal can be streamed to save memory
+        # and only the metafile lines added since the previous run get parsed
+        $__INTERNAL_JOURNALIST ${__INTERNAL_XSLT:---incremental} --metafile \
           "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$__INTERNAL_BEAKERLIB_JOURNAL"
         res=$?
         if [[ $res -eq 2 ]]; then
@@ -970,6 +988,10 @@ __INTERNAL_SET_TIMESTAMP() {
 # takes [element] --attribute1 value1 --attribute2 value2 .. [-- "content"]
 __INTERNAL_WriteToMetafile(){
     __INTERNAL_SET_TIMESTAMP
+    [[ "$__INTERNAL_METAFILE_VERSION" == "2" ]] && {
+      __INTERNAL_WriteToMetafileV2 "$@"
+      return
+    }
     local indent
     local line=""
     local lineraw=''
@@ -1016,6 +1038,77 @@ __INTERNAL_WriteToMetafile(){
     echo "$line" >> "$__INTERNAL_BEAKERLIB_METAFILE"
 }
 
+# Stores the string quoted and escaped for JSON into a variable
+# $1 - variable name
+# $2 - string
+__INTERNAL_JSONString() {
+    local __s="$2" __c __h __i
+    __s="${__s//\\/\\\\}"
+    __s="${__s//\"/\\\"}"
+    __s="${__s//$'\n'/\\n}"
+    __s="${__s//$'\t'/\\t}"
+    __s="${__s//$'\r'/\\r}"
+    [[ "$__s" =~ [[:cntrl:]] ]] && for __i in {1..31}; do
+      printf -v __h '%02x' $__i
+      printf -v __c "\\x$__h"
+      __s="${__s//$__c/\\u00$__h}"
+    done
+    printf -v "$1" '"%s"' "$__s"
+}
+
+
+# Writes the same as __INTERNAL_WriteToMetafile but as a JSON record of
+# version 2 metafile, values need no encoding. Offset of the record
+# starting a phase is appended to the metafile index.
+# takes [element] --attribute1 value1 --attribute2 value2 .. [-- "content"]
+__INTERNAL_WriteToMetafileV2(){
+    local ARGS=("$@")
+    local record="{\"depth\": $__INTERNAL_METAFILE_INDENT_LEVEL"
+    local attributes=''
+    local element=''
+    local value
+
+    [[ "${1:0:2}" != "--" ]] && {
+      element="$1"
+      __INTERNAL_JSONString value "$1"
+      record+=", \"element\": $value"
+      shift
+    }
+    record+=", \"timestamp\": $__INTERNAL_TIMESTAMP"
+    local content=''
+    while [[ $# -gt 0 ]]; do
+      case $1 in
+      --)
+        __INTERNAL_JSONString value "$2"
+        content=", \"content\": $value"
+        shift 2
+        break
+        ;;
+      --*)
+        __INTERNAL_JSONString value "$2"
+        attributes+="${attributes:+, }\"${1:2}\": $value"
+        shift
+        ;;
+      *)
+        __INTERNAL_LogText "unexpected meta input format"
+        set | grep ^ARGS=
+        exit 124
+        ;;
+      esac
+      shift
+    done
+    [[ $# -gt 0 ]] && {
+      __INTERNAL_LogText "unexpected meta input format"
+      set | grep ^ARGS=
+      exit 125
+    }
+
+    record+="${attributes:+, \"attributes\": {$attributes\}}$content}"
+    [[ "$element" == "phase" ]] && \
+      stat -c %s "$__INTERNAL_BEAKERLIB_METAFILE" >> "$__INTERNAL_BEAKERLIB_METAFILE.index"
+    printf '%s\n' "$record" >> "$__INTERNAL_BEAKERLIB_METAFILE"
+}
+
 __INTERNAL_PrintHeadLog() {
     __INTERNAL_LogText "\n::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::"
     __INTERNAL_LogText "::   $1"
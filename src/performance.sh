@@ -43,6 +43,58 @@ and memory performance of programs.
 
 =cut
 
+__INTERNAL_MEMSAMPLER=beakerlib-memsampler
+__INTERNAL_PERFRUNNER=beakerlib-perfrunner
+
+# $1 - summary written by the perf runner, $2 - name of the value
+__INTERNAL_PerfValue() {
+    awk -v key="$2" '$1 == key { print $2 }' "$1"
+}
+
+# $1 - summary written by the perf runner
+__INTERNAL_PerfSummary() {
+    local failed
+    if [ ! -s "$1" ]; then
+        rlLogError "the command could not be measured"
+        return 1
+    fi
+    rlLogDebug "$(cat "$1")"
+    failed="$(__INTERNAL_PerfValue "$1" failed)"
+    [ "$failed" == "0" ] || rlLogWarning "$failed runs of the command failed"
+}
+
+# Sets __INTERNAL_PERF_USEC to $1 seconds, or to the current time when $1 is
+# not given, in microseconds. The current time is read without forking from
+# $EPOCHREALTIME, or from /proc/uptime with bash older than 5.
+__INTERNAL_PerfUsec() {
+    local time=${1:-$EPOCHREALTIME} fraction=
+    [ -n "$time" ] || read -r time fraction < /proc/uptime
+    fraction=
+    [[ "$time" == *[.,]* ]] && fraction=${time#*[.,]}
+    fraction="${fraction}000000"
+    time=${time%%[.,]*}
+    __INTERNAL_PERF_USEC=$(( ${time:-0} * 1000000 + 10#${fraction:0:6} ))
+}
+
+# $1 - command, $2 - microseconds, $3 - file the round is appended to
+# Evaluates the command in the current shell over and over for the time and
+# records the number of the runs which finished in the time and of the
+# failed ones among them.
+__INTERNAL_PerfRound() {
+    local __INTERNAL_runs=0 __INTERNAL_failed=0 __INTERNAL_status __INTERNAL_deadline
+    __INTERNAL_PerfUsec
+    __INTERNAL_deadline=$(( __INTERNAL_PERF_USEC + $2 ))
+    while true; do
+        eval "$1"
+        __INTERNAL_status=$?
+        __INTERNAL_PerfUsec
+        [ $__INTERNAL_PERF_USEC -le $__INTERNAL_deadline ] || break
+        let __INTERNAL_runs++
+        [ $__INTERNAL_status -eq 0 ] || let __INTERNAL_failed++
+    done
+    echo "$__INTERNAL_runs $__INTERNAL_failed" >> "$3"
+}
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # rlPerfTime_RunsInTime
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -57,7 +109,12 @@ Measures, how many runs of some commands can be done in specified time.
 This approach is suitable for short-time running tasks (up to few seconds),
 where averaging few runs is not precise. This is done several times, and
 the final result is the average of all runs. It prints the number on stdout,
-so it has to be captured.
+so it has to be captured. The number is stored in rl_retval variable too.
+
+The command is evaluated in the current shell, so it can use functions and
+variables which are not exported. The runs are timed by C<$EPOCHREALTIME>
+(by F</proc/uptime> with bash older than 5), a run counts when it finishes
+in the time.
 
     rlPerfTime_RunsInTime command [time] [runs]
 
@@ -82,31 +139,29 @@ rlPerfTime_RunsInTime(){
     local command=$1
     local time=${2:-"30"}
     local runs=${3:-"3"}
-    local RES=$((0))
-    local TOTAL=$((0))
-    local DONE_RUNS=$((1))
-    local PID=$$
+    local counts summary round usec
+    counts="$(mktemp)" # no-reboot
+    summary="$(mktemp)" # no-reboot
     rlLog "Measuring how much runs we'll make in $time seconds"
     rlLog "Command: '$command'"
     rlLog "The result is an average of $runs rounds"
-    trap '  TOTAL=$((TOTAL+RES));\
-            rlLog "Round $DONE_RUNS finished, made $RES runs in it";\
-            if [ "$DONE_RUNS" == "$runs" ];\
-            then\
-                rlLog "Done, the average ($TOTAL/$DONE_RUNS) is $((TOTAL/DONE_RUNS)) runs";\
-                echo $((TOTAL/DONE_RUNS));\
-                return 0;\
-            else\
-                RES=$((0));\
-                DONE_RUNS=$((DONE_RUNS+1));\
-                eval "sleep $time; kill -USR1 $PID" &
-            fi' SIGUSR1
-
-    eval "sleep $time; kill -USR1 $$" &
-    while true ; do
-        eval "$1"
-        RES=$((RES+1))
+    __INTERNAL_PerfUsec "$time"
+    usec=$__INTERNAL_PERF_USEC
+    for (( round = 1; round <= runs; round++ )); do
+        __INTERNAL_PerfRound "$command" "$usec" "$counts"
     done
+    $__INTERNAL_PERFRUNNER --duration "$time" --counts "$counts" --output "$summary"
+    rm -f "$counts"
+    if ! __INTERNAL_PerfSummary "$summary"; then
+        rm -f "$summary"
+        return 1
+    fi
+    rlLog "Runs in a round: median $(__INTERNAL_PerfValue "$summary" runs_median), stddev $(__INTERNAL_PerfValue "$summary" runs_stddev)"
+    export rl_retval="$(__INTERNAL_PerfValue "$summary" runs_mean)"
+    rl_retval="${rl_retval%.*}"
+    rlLog "Done, the average is $rl_retval runs"
+    echo "$rl_retval"
+    rm -f "$summary"
 }
 
 
@@ -125,6 +180,12 @@ measured and it's purpose is to warm up various caches.
 It prints the number on stdout, so it has to be captured.
 Or, result is then stored in special rl_retval variable.
 
+The number is the average CPU time (user and system) of the command in
+seconds. Each run is a new bash -c process, so shell functions used by
+the command have to be exported. The wall time statistics (median, 95th
+percentile and standard deviation) are logged too. Runs far from the median
+wall time are rejected as outliers.
+
     rlPerfTime_AvgFromRuns command [count] [warmup]
 
 =over
@@ -135,11 +196,13 @@ Command to run.
 
 =item count
 
-Times to run (optional, default=3).
+Times to run (optional, default=3). With "auto", the command is run until
+the mean wall time is known with 1% precision, at least 5 times.
 
 =item warmup
 
-Warm-up run, run if this option is not "warmup" (optional, default="warmup")
+Warm-up run, run if this option is "warmup", or the number of warm-up
+runs (optional, default="warmup")
 
 =back
 
@@ -149,28 +212,199 @@ rlPerfTime_AvgFromRuns(){
     local command="$1"
     local runs=${2:-"3"}
     local warmup=${3:-"warmup"}
-    local total=0
-    local IFS
+    local summary
+    local options=()
     rlLog "Measuring the average time of runnning command '$command'"
-    rlLog "The result will be an average of $runs runs"
-
+    if [ "$runs" == "auto" ]; then
+        rlLog "The result will be an average of as many runs as needed for 1% precision"
+        options+=(--runs 5 --precision 0.01)
+    else
+        rlLog "The result will be an average of $runs runs"
+        options+=(--runs "$runs")
+    fi
     if [ "$warmup" == "warmup" ]; then
         rlLog "Doing non-measured warmup run"
-        eval "$command"
+        options+=(--warmup 1)
+    elif [[ "$warmup" =~ ^[0-9]+$ ]]; then
+        rlLog "Doing $warmup non-measured warmup runs"
+        options+=(--warmup "$warmup")
+    else
+        options+=(--warmup 0)
     fi
-    local __INTERNAL_TIMER=$(mktemp) # no-reboot
-
-    local cnt
-    for cnt in $(seq $runs); do
-        /usr/bin/time -o $__INTERNAL_TIMER -f "bt=\"%U + %S\"" bash -c "$command"
-        . $__INTERNAL_TIMER
-        rlLog "Run $cnt took $bt seconds"
-        total="$(echo "scale=5; $total + $bt" | bc)"
+    summary="$(mktemp)" # no-reboot
+    $__INTERNAL_PERFRUNNER "${options[@]}" --output "$summary" "$command"
+    if ! __INTERNAL_PerfSummary "$summary"; then
+        rm -f "$summary"
+        return 1
+    fi
+    rlLog "Wall time: median $(__INTERNAL_PerfValue "$summary" wall_median) s, p95 $(__INTERNAL_PerfValue "$summary" wall_p95) s, stddev $(__INTERNAL_PerfValue "$summary" wall_stddev) s"
+    export rl_retval="$(__INTERNAL_PerfValue "$summary" cpu_mean)"
+    rlLog "The average CPU time of $(__INTERNAL_PerfValue "$summary" runs) runs was $rl_retval seconds"
+    echo "$rl_retval"
+    rm -f "$summary"
+}
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# rlPerfTime_Scaling
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+: <<'=cut'
+=pod
+
+=head3 rlPerfTime_Scaling
+
+Measures how the throughput of a command scales with the number of
+concurrent clients. For each concurrency level, the command is run over
+and over by that many workers for the specified time. The throughput (runs
+per second), latency percentiles and parallel efficiency of each level are
+logged, the efficiency is the throughput relative to the throughput of the
+first level multiplied by the ratio of the levels. Each level is logged to
+the journal as metrics NAME.throughput.LEVEL and NAME.efficiency.LEVEL,
+which should be as high as possible, and NAME.latency_p95.LEVEL, which
+should be as low as possible. The throughputs of the levels, separated by
+spaces, are stored in rl_retval variable.
+
+The command runs in a new bash, see rlPerfTime_AvgFromRuns.
+
+    rlPerfTime_Scaling [--pin] [--name NAME] command [levels] [time]
+
+=over
+
+=item --pin
+
+Pin each of the workers to one of the CPUs available.
+
+=item --name NAME
+
+Name of the metrics, it has to be unique in a phase (default=scaling).
+
+=item command
+
+Command to run.
+
+=item levels
+
+Comma separated numbers of concurrent workers, "auto" for powers of
+two up to the number of CPUs (optional, default=auto).
+
+=item time
+
+Time in seconds each level runs (optional, default=10).
+
+=back
+
+=cut
+
+rlPerfTime_Scaling(){
+    local GETOPT=$($__INTERNAL_GETOPT_CMD -o pn: -l pin,name: -- "$@" 2> >(while read -r line; do rlLogError "$FUNCNAME: $line"; done)); eval set -- "$GETOPT"
+    local pin=""
+    local name="scaling"
+    while true; do
+        case "$1" in
+            -p|--pin)  pin="--pin"; shift;;
+            -n|--name) name="$2"; shift 2;;
+            --)        shift; break;;
+            *)         shift;;
+        esac
     done
-    rlLog "The average of $runs runs was $(echo "scale=5; $total / $runs" | bc) seconds"
-    echo "$(echo "scale=5; $total / $runs" | bc)"
-    export rl_retval="$(echo "scale=5; $total / $runs" | bc)"
-    rm -f $__INTERNAL_TIMER
+    local command="$1"
+    local levels=${2:-"auto"}
+    local time=${3:-"10"}
+    local summary key level fields i
+    local -A values
+    rlLog "Measuring throughput of command '$command' at concurrency levels $levels"
+    rlLog "Each level runs for $time seconds${pin:+, workers are pinned to CPUs}"
+    summary="$(mktemp)" # no-reboot
+    $__INTERNAL_PERFRUNNER --scaling "$levels" --duration "$time" $pin --output "$summary" "$command"
+    if ! __INTERNAL_PerfSummary "$summary"; then
+        rm -f "$summary"
+        return 1
+    fi
+    rl_retval=""
+    while read -r key level fields; do
+        [ "$key" == "level" ] || continue
+        fields=( $fields )
+        for (( i = 0; i < ${#fields[@]}; i += 2 )); do
+            values[${fields[$i]}]="${fields[$((i + 1))]}"
+        done
+        rlLog "Concurrency $level: ${values[throughput]} runs/s, latency p50 ${values[latency_p50]} s, p95 ${values[latency_p95]} s, p99 ${values[latency_p99]} s, efficiency ${values[efficiency]}"
+        rljAddMetric "high" "$name.throughput.$level" "${values[throughput]}"
+        rljAddMetric "low" "$name.latency_p95.$level" "${values[latency_p95]}"
+        rljAddMetric "high" "$name.efficiency.$level" "${values[efficiency]}"
+        rl_retval="${rl_retval:+$rl_retval }${values[throughput]}"
+    done < "$summary"
+    export rl_retval
+    rm -f "$summary"
+}
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# rlPerfResources_Record
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+: <<'=cut'
+=pod
+
+=head2 Resource Usage
+
+=head3 rlPerfResources_Record
+
+Runs the command and records memory, CPU usage, IO and thread count of
+the command and all processes it starts. The time series is stored in
+F<$BEAKERLIB_DIR/resources-NAME.csv> and submitted with the test logs.
+The summary is logged to the journal as metrics which should be as low
+as possible, see rlLogMetricLow. They are named NAME.memory_peak,
+NAME.memory_mean, NAME.memory_p95 (kB), NAME.cpu_mean, NAME.cpu_peak
+(percents of one CPU), NAME.read_bytes, NAME.write_bytes and
+NAME.threads_peak. Returns the exit code of the command.
+
+    rlPerfResources_Record name command [interval]
+
+=over
+
+=item name
+
+Name of the recording. It has to be unique in a phase.
+
+=item command
+
+Command to run.
+
+=item interval
+
+Time in seconds between the samples (optional, default=0.1).
+
+=back
+
+=cut
+
+rlPerfResources_Record(){
+    local name="$1"
+    local command="$2"
+    local interval=${3:-"0.1"}
+    local record="$BEAKERLIB_DIR/resources-$name.csv"
+    local summary
+    local res key value
+    summary="$(mktemp)" # no-reboot
+    rlLog "Recording resources used by command '$command'"
+    $__INTERNAL_MEMSAMPLER --interval "$interval" --record "$record" --output "$summary" -- bash -c "$command"
+    res=$?
+    if [ ! -s "$summary" ]; then
+        rlLogError "$FUNCNAME: resources of command '$command' could not be recorded"
+        rm -f "$summary"
+        return 1
+    fi
+    while read -r key value; do
+        case "$key" in
+            peak|mean|p95)
+                rljAddMetric "low" "$name.memory_$key" "$value"
+                ;;
+            cpu_mean|cpu_peak|read_bytes|write_bytes|threads_peak)
+                rljAddMetric "low" "$name.$key" "$value"
+                ;;
+        esac
+    done < "$summary"
+    rm -f "$summary"
+    rlLog "Resources used by the command are stored in $record"
+    rlFileSubmit "$record"
+    return $res
 }
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
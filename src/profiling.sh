@@ -56,6 +56,21 @@ A file /dev/shm/beakerlib_profile will be created for later processing.
 
     /usr/share/beakerlib/profiling.sh process > profile.csv
 
+The CSV contains the number of calls, time per call, self time and
+cumulative time of each function.
+
+=head3 Analyze the profile
+
+    beakerlib-profileanalyzer [--top N] [--functions FILE] [--lines FILE] \
+        [--folded FILE] [PROFILE]
+
+Reads the profile in one pass and reports the functions and source lines
+with the most self time. It can also write per function and per line
+self and cumulative times as CSV, and folded stacks for flame graphs:
+
+    beakerlib-profileanalyzer --folded profile.folded
+    flamegraph.pl profile.folded > profile.svg
+
 =cut
 
 __INTERNAL_PROFILING_DB=/dev/shm/beakerlib_profile
@@ -83,35 +98,14 @@ fi
 return >/dev/null 2>&1
 
 
+__INTERNAL_PROFILE_ANALYZER=${__INTERNAL_PROFILE_ANALYZER:-beakerlib-profileanalyzer}
+
 __INTERNAL_profilingPrint() {
   cat $__INTERNAL_PROFILING_DB
 }
 __INTERNAL_profiling_process() {
-  local prev_func curr_func counting total_cummulative_spent prev_ts total_spent
-  declare -A hits total_cummulative_spent total_spent
-  hits[main]=1
-  local ts src func command f
   [[ -n "$1" && -f "$1" ]] && __INTERNAL_PROFILING_DB="$1"
-  echo "function,hits,spent,total spent,total cummulative spent"
-  while IFS='|' read -r ts src func command; do
-    curr_func=($func)
-    [[ "$curr_func" =~ ^[a-zA-Z0-9_]+$ ]] || continue
-    ts=${ts//[^0-9]/}
-    [[ "${curr_func}" == "${command::${#curr_func[0]}}" ]] && let hits[$curr_func]++
-    [[ -n "$prev_ts" ]] && {
-      # count func total_cummulative_spent
-      for f in "${prev_func[@]}"; do
-        let total_cummulative_spent[$f]+=$((ts-prev_ts))
-      done
-      let total_spent[$prev_func]+=$((ts-prev_ts))
-    }
-    prev_func=( "${curr_func[@]}" )
-    prev_ts=$ts
-  done < <(head -n -2 $__INTERNAL_PROFILING_DB)
-  for f in "${!hits[@]}"; do
-    echo "$f,${hits[$f]},$(echo "scale=6; ${total_spent[$f]} / ${hits[$f]} / 1000000" | bc),$(echo "scale=6; ${total_spent[$f]} / 1000000" | bc),$(echo "scale=6; ${total_cummulative_spent[$f]} / 1000000" | bc)" \
-      | sed -r 's/,\./,0./g'
-  done
+  $__INTERNAL_PROFILE_ANALYZER --top 0 --functions - "$__INTERNAL_PROFILING_DB"
 }
 
 
@@ -16,8 +16,15 @@
 # Author: Petr Muller <pmuller@redhat.com>
 
 from __future__ import print_function
-import xml.dom.minidom
 import sys
+import json
+from math import sqrt, exp, log, lgamma
+from collections import OrderedDict
+from optparse import OptionParser
+try:
+	from xml.etree.cElementTree import iterparse
+except ImportError:
+	from xml.etree.ElementTree import iterparse
 
 class Result:
 	def __init__(self):
@@ -48,11 +55,11 @@ class Metric:
 		if self.type == "low":
 			first = self.value
 			second = other.value
-			message = "First %s, second %s, toleranced first %s" % (first, second, first+first*tolerance)
+			message = "First %s, second %s, toleranced first %s" % (first, second, first+first*self.tolerance)
 		else:
 			first = other.value
 			second = self.value
-			message = "First %s, second %s, toleranced first %s" % (second, first, second+second*tolerance)
+			message = "First %s, second %s, toleranced first %s" % (second, first, second+second*self.tolerance)
 
 		result = Result()
 		result.name = self.name
@@ -60,7 +67,7 @@ class Metric:
 
 		if first >= second:
 			result.result = "PASS"
-		elif first+first*tolerance >= second:
+		elif first+first*self.tolerance >= second:
 			result.result = "WARN"
 		else:
 			result.result = "FAIL"
@@ -130,70 +137,427 @@ class TestSet:
                         self.results[name] = Test(name)
                 self.results[name].addResult(result)
 
+	# Compares the tests found in both sets
 	def compare(self, other):
 		result_list = []
 		for key in self.results.keys():
-			try:
+			if key in other.results:
 				result_list.append(self.results[key].compare(other.results[key]))
-			except KeyError:
-				print("[WARN] Could not find corresponding test for: %s" % key)
 		return result_list
 
-try:
-  old = sys.argv[1]
-  new = sys.argv[2]
-except IndexError:
-  old = "old/rcw-journal"
-  new = "new/rcw-journal"
-
-journal_old = xml.dom.minidom.parse(old)
-journal_new = xml.dom.minidom.parse(new)
-
-old_log = journal_old.getElementsByTagName("log")[0]
-new_log = journal_new.getElementsByTagName("log")[0]
-
-old_phases = old_log.getElementsByTagName("phase")
-new_phases = new_log.getElementsByTagName("phase")
-
-walk_through = range(len(new_phases))
-
-for i in walk_through:
-	old_type, old_name = old_phases[i].getAttribute("type"), old_phases[i].getAttribute("name")
-	new_type, new_name = new_phases[i].getAttribute("type"), new_phases[i].getAttribute("name")
-
-	if old_type == new_type and old_name == new_name:
-		print( "Types match, so we are comparing phase %s of type %s" % (old_type, new_type))
-		old_tests = TestSet()
-		new_tests = TestSet()
-		old_metrics = {}
-		new_metrics = {}
-
-		for phases, results, metrics in ((old_phases, old_tests, old_metrics), (new_phases, new_tests, new_metrics)):
-			for test in phases[i].getElementsByTagName("test"):
-				key = test.getAttribute("message")
-				result = test.childNodes[0].data.strip()
-				results.addTestResult(key, result)
-
-			for metric in phases[i].getElementsByTagName("metric"):
-				key = metric.getAttribute("name")
-				value = float(metric.childNodes[0].data.strip())
-				tolerance = float(metric.getAttribute("tolerance"))
-				metrics[key] = Metric(key, value, metric.getAttribute("type"), tolerance)
+	# Returns names of the tests not found in the other set
+	def missingIn(self, other):
+		return [key for key in self.results.keys() if key not in other.results]
+
+def mean(values):
+	return sum(values) / float(len(values))
+
+# Sample standard deviation
+def stdev(values):
+	if len(values) < 2:
+		return 0.0
+	average = mean(values)
+	return sqrt(sum((value - average) ** 2 for value in values) / (len(values) - 1))
+
+# Continued fraction of the regularized incomplete beta function,
+# see Numerical Recipes, betacf()
+def betaFraction(a, b, x):
+	tiny = 1e-300
+	c = 1.0
+	d = 1.0 - (a + b) * x / (a + 1.0)
+	d = 1.0 / (d if abs(d) > tiny else tiny)
+	h = d
+	for m in range(1, 201):
+		aa = m * (b - m) * x / ((a - 1.0 + 2 * m) * (a + 2 * m))
+		d = 1.0 + aa * d
+		d = 1.0 / (d if abs(d) > tiny else tiny)
+		c = 1.0 + aa / c
+		c = c if abs(c) > tiny else tiny
+		h *= d * c
+		aa = -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 1.0 + 2 * m))
+		d = 1.0 + aa * d
+		d = 1.0 / (d if abs(d) > tiny else tiny)
+		c = 1.0 + aa / c
+		c = c if abs(c) > tiny else tiny
+		h *= d * c
+		if abs(d * c - 1.0) < 3e-14:
+			break
+	return h
+
+# Regularized incomplete beta function I_x(a, b)
+def incompleteBeta(a, b, x):
+	if x <= 0.0:
+		return 0.0
+	if x >= 1.0:
+		return 1.0
+	front = exp(lgamma(a + b) - lgamma(a) - lgamma(b) + a * log(x) + b * log(1.0 - x))
+	if x < (a + 1.0) / (a + b + 2.0):
+		return front * betaFraction(a, b, x) / a
+	return 1.0 - front * betaFraction(b, a, 1.0 - x) / b
+
+# Cumulative distribution function of Student's t distribution
+def studentCdf(t, df):
+	tail = 0.5 * incompleteBeta(df / 2.0, 0.5, df / (df + t * t))
+	return 1.0 - tail if t > 0 else tail
+
+# Inverse of studentCdf(), found by bisection
+def studentQuantile(p, df):
+	low, high = -1.0, 1.0
+	while studentCdf(low, df) > p:
+		low *= 2
+	while studentCdf(high, df) < p:
+		high *= 2
+	for _ in range(100):
+		middle = (low + high) / 2.0
+		if studentCdf(middle, df) < p:
+			low = middle
+		else:
+			high = middle
+	return (low + high) / 2.0
+
+# Values of a metric in several baseline and candidate runs. The candidate is
+# compared by Welch's t-test, a regression is reported only when the candidate
+# is worse with the given confidence, FAIL when it is worse by more than
+# the tolerance, WARN otherwise. Metric of type "low" is better when lower.
+# With a single value on either side the means are compared the same way
+# as Metric does.
+class MetricSamples:
+	def __init__(self, name, type, tolerance):
+		self.name = name
+		self.type = type
+		self.tolerance = tolerance
+		self.baseline = []
+		self.candidate = []
+
+	def compare(self, confidence):
+		result = Result()
+		result.name = self.name
+		base, cand = mean(self.baseline), mean(self.candidate)
+		result.statistics = {
+			"baseline": {"n": len(self.baseline), "mean": base, "stdev": stdev(self.baseline)},
+			"candidate": {"n": len(self.candidate), "mean": cand, "stdev": stdev(self.candidate)},
+			"difference": cand - base,
+		}
+		if len(self.baseline) < 2 or len(self.candidate) < 2:
+			single = Metric(self.name, base, self.type, self.tolerance).compare(Metric(self.name, cand, self.type, self.tolerance))
+			result.result = single.result
+			result.messages = single.messages
+			return result
+
+		base_variance = stdev(self.baseline) ** 2 / len(self.baseline)
+		cand_variance = stdev(self.candidate) ** 2 / len(self.candidate)
+		error = sqrt(base_variance + cand_variance)
+		# Difference in the worse direction
+		worse = cand - base if self.type == "low" else base - cand
+		if error == 0:
+			# All the values are the same on each side
+			p_value = 0.0 if worse > 0 else 1.0
+			interval = [cand - base, cand - base]
+		else:
+			# Welch-Satterthwaite degrees of freedom
+			df = (base_variance + cand_variance) ** 2 / (base_variance ** 2 / (len(self.baseline) - 1) +
+			                                             cand_variance ** 2 / (len(self.candidate) - 1))
+			p_value = 1.0 - studentCdf(worse / error, df)
+			margin = studentQuantile(1.0 - (1.0 - confidence) / 2.0, df) * error
+			interval = [cand - base - margin, cand - base + margin]
+		result.statistics["p_value"] = p_value
+		result.statistics["confidence_interval"] = interval
+
+		if p_value >= 1.0 - confidence:
+			result.result = "PASS"
+		elif worse > abs(base) * self.tolerance:
+			result.result = "FAIL"
+		else:
+			result.result = "WARN"
+		result.addMessage("baseline %s +- %s (n %s), candidate %s +- %s (n %s), difference %s, %g%% interval [%s, %s], p %s" % (
+			base, stdev(self.baseline), len(self.baseline), cand, stdev(self.candidate), len(self.candidate),
+			cand - base, confidence * 100, interval[0], interval[1], p_value))
+		return result
+
+# Summary of a phase of the log, its tests and metrics include those
+# of the nested phases
+class Phase:
+	def __init__(self, type, name):
+		self.type = type
+		self.name = name
+		self.tests = TestSet()
+		# Type, name and number of the phase among phases of that type and name
+		self.key = None
+		# Name, value, type and tolerance of the metrics in journal order,
+		# there are just a few of them
+		self.metrics = []
+
+	# Returns value, type and tolerance of the metrics by name, the value of
+	# the last metric of a name is used
+	def metricValues(self):
+		values = OrderedDict()
+		for name, value, type, tolerance in self.metrics:
+			values[name] = (float(value.strip()), type, float(tolerance))
+		return values
+
+# Returns summaries of the phases in the first log of the journal, in the
+# order they start. The journal is parsed incrementally and every element
+# is thrown away as soon as it ends, so that the memory usage depends on the
+# number of distinct tests and metrics, not on the size of the journal.
+def readPhases(journal):
+	phases = []
+	counts = {}
+	open_phases = []
+	elements = []
+	log = None
+	in_log = False
+	for event, element in iterparse(journal, events=("start", "end")):
+		if event == "start":
+			elements.append(element)
+			if element.tag == "log" and log is None:
+				log = element
+				in_log = True
+			elif element.tag == "phase" and in_log:
+				phase = Phase(element.get("type", ""), element.get("name", ""))
+				count = counts[phase.type, phase.name] = counts.get((phase.type, phase.name), 0) + 1
+				phase.key = (phase.type, phase.name, count)
+				phases.append(phase)
+				open_phases.append(phase)
+			continue
+
+		if in_log:
+			if element.tag == "phase":
+				open_phases.pop()
+			elif element.tag == "test":
+				for phase in open_phases:
+					phase.tests.addTestResult(element.get("message", ""), (element.text or "").strip())
+			elif element.tag == "metric":
+				for phase in open_phases:
+					# Value is an attribute in current journals, content in old ones
+					phase.metrics.append((element.get("name", ""), element.get("value", element.text or ""),
+					                      element.get("type", ""), element.get("tolerance", "")))
+			elif element is log:
+				in_log = False
+		elements.pop()
+		element.clear()
+		if elements:
+			elements[-1].remove(element)
+	return phases
+
+# Pairs each phase of the new journal with a phase of the same type and name
+# in the old journal, the n-th phase of a name with the n-th such old one.
+# Returns (old, new) pairs in the order of the new journal, old is None for
+# a phase added in the new journal. They are followed by (old, None) pairs
+# of the old phases missing in the new journal.
+def alignPhases(old_phases, new_phases):
+	index = dict((phase.key, phase) for phase in old_phases)
+	pairs = [(index.pop(phase.key, None), phase) for phase in new_phases]
+	pairs.extend((phase, None) for phase in old_phases if phase.key in index)
+	return pairs
+
+RESULTS = ["PASS", "WARN", "FAIL"]
+
+def worst(results):
+	return max(results, key=RESULTS.index) if results else "PASS"
+
+def resultRecord(result):
+	record = {"name": result.name, "result": result.result, "messages": result.messages}
+	record.update(getattr(result, "statistics", {}))
+	return record
+
+# Compares candidate journals with baseline journals. Phases are aligned
+# between the first baseline and the first candidate journal, tests of these
+# two are compared. Metrics are compared using the values from all the
+# journals, see MetricSamples. Returns the report as a dictionary.
+def compareJournals(baseline, candidate, confidence=0.95):
+	baseline_phases = [readPhases(journal) for journal in baseline]
+	candidate_phases = [readPhases(journal) for journal in candidate]
+	baseline_index = [dict((phase.key, phase) for phase in phases) for phases in baseline_phases]
+	candidate_index = [dict((phase.key, phase) for phase in phases) for phases in candidate_phases]
+
+	report = {"baseline": list(baseline), "candidate": list(candidate), "confidence": confidence, "phases": []}
+	for old_phase, new_phase in alignPhases(baseline_phases[0], candidate_phases[0]):
+		phase = old_phase or new_phase
+		record = {"name": phase.name, "type": phase.type}
+		report["phases"].append(record)
+		if old_phase is None:
+			record.update(status="extra", result="WARN")
+			continue
+		if new_phase is None:
+			record.update(status="missing", result="WARN")
+			continue
+
+		samples = OrderedDict()
+		for index in baseline_index:
+			if phase.key in index:
+				for name, (value, type, tolerance) in index[phase.key].metricValues().items():
+					if name not in samples:
+						samples[name] = MetricSamples(name, type, tolerance)
+					samples[name].baseline.append(value)
+		for index in candidate_index:
+			if phase.key in index:
+				for name, (value, type, tolerance) in index[phase.key].metricValues().items():
+					if name in samples:
+						samples[name].candidate.append(value)
+		metrics = []
+		for metric in samples.values():
+			if metric.candidate:
+				metric_record = resultRecord(metric.compare(confidence))
+			else:
+				metric_record = {"name": metric.name, "result": "WARN", "messages": []}
+			metric_record.update(type=metric.type, tolerance=metric.tolerance)
+			metrics.append(metric_record)
+
+		tests = [resultRecord(test) for test in old_phase.tests.compare(new_phase.tests)]
+		missing_tests = old_phase.tests.missingIn(new_phase.tests)
+		record.update(status="compared", metrics=metrics, tests=tests, missing_tests=missing_tests,
+		              result=worst([item["result"] for item in metrics + tests] + ["WARN" for _ in missing_tests]))
+	report["result"] = worst([record["result"] for record in report["phases"]])
+	return report
 
+# Compares one (baseline, candidate) pair of journals, returns its report.
+# A pair which cannot be compared, e.g. because of a missing or malformed
+# journal, gets a report with ERROR result and the error message.
+def comparePair(pair, confidence=0.95):
+	baseline, candidate = pair
+	try:
+		return compareJournals([baseline], [candidate], confidence)
+	except Exception as e:
+		return {"baseline": [baseline], "candidate": [candidate], "confidence": confidence,
+		        "phases": [], "result": "ERROR", "error": "%s: %s" % (type(e).__name__, e)}
+
+def comparePairWithConfidence(arguments):
+	return comparePair(*arguments)
+
+# Compares many (baseline, candidate) pairs of journals in a pool of jobs
+# processes, all CPUs are used if jobs is 0. Yields the reports in the order
+# of the pairs.
+def comparePairs(pairs, confidence=0.95, jobs=0):
+	if jobs == 1:
+		for pair in pairs:
+			yield comparePair(pair, confidence)
+		return
+	import multiprocessing
+	pool = multiprocessing.Pool(jobs or None)
+	try:
+		for report in pool.imap(comparePairWithConfidence, ((pair, confidence) for pair in pairs), 8):
+			yield report
+	finally:
+		pool.terminate()
+		pool.join()
+
+# Reads the manifest of journal pairs, one pair per line, baseline and
+# candidate journal separated by whitespace. Empty lines and lines starting
+# with # are skipped.
+def readPairs(fh):
+	for number, line in enumerate(fh, 1):
+		line = line.strip()
+		if not line or line.startswith("#"):
+			continue
+		fields = line.split()
+		if len(fields) != 2:
+			raise ValueError("line %d: expected a baseline and a candidate journal, got: %s" % (number, line))
+		yield tuple(fields)
+
+def printReport(report):
+	for phase in report["phases"]:
+		if phase["status"] == "extra":
+			print("[WARN] Phase %s of type %s is not in the old journal" % (phase["name"], phase["type"]))
+			continue
+		if phase["status"] == "missing":
+			print("[WARN] Phase %s of type %s is missing in the new journal" % (phase["name"], phase["type"]))
+			continue
+
+		print("Types match, so we are comparing phase %s of type %s" % (phase["name"], phase["type"]))
 		print("==== Actual compare ====")
 		print(" * Metrics * ")
-		metric_results = []
-		for key in old_metrics.keys():
-			metric_results.append(old_metrics[key].compare(new_metrics[key]))
-		for metric in metric_results:
-			for message in metric.messages:
-				print("[%s] %s (%s)" % (metric.result, metric.name, message))
+		for metric in phase["metrics"]:
+			if not metric["messages"]:
+				print("[WARN] Could not find corresponding metric for: %s" % metric["name"])
+			for message in metric["messages"]:
+				print("[%s] %s (%s)" % (metric["result"], metric["name"], message))
 		print(" * Tests * ")
-		test_results = old_tests.compare(new_tests)
-		for test in test_results:
-			print("[%s] %s" % (test.result, test.name))
-			for message in test.messages:
+		for name in phase["missing_tests"]:
+			print("[WARN] Could not find corresponding test for: %s" % name)
+		for test in phase["tests"]:
+			print("[%s] %s" % (test["result"], test["name"]))
+			for message in test["messages"]:
 				print("\t - %s" % message)
 
+# Writes a report of each pair as a line of JSON, so the output of several
+# batches can be concatenated and aggregated line by line. A summary of the
+# results goes to standard error.
+def comparePairsMain(options):
+	try:
+		fh = sys.stdin if options.pairs_from == '-' else open(options.pairs_from)
+		pairs = list(readPairs(fh))
+	except (IOError, ValueError) as e:
+		sys.stderr.write("Failed to read list of journal pairs: %s\n" % str(e))
+		return 1
+
+	counts = dict((result, 0) for result in RESULTS + ["ERROR"])
+	for report in comparePairs(pairs, options.confidence, options.jobs):
+		counts[report["result"]] += 1
+		if "error" in report:
+			sys.stderr.write("Failed to compare %s with %s: %s\n" % (
+				report["baseline"][0], report["candidate"][0], report["error"]))
+		sys.stdout.write(json.dumps(report, separators=(",", ":")) + "\n")
+	sys.stderr.write("Compared %d pairs: %s\n" % (
+		len(pairs), ", ".join("%d %s" % (counts[result], result) for result in RESULTS + ["ERROR"])))
+	return 1 if counts["ERROR"] else 0
+
+def main():
+	usage = "%prog [options] OLD NEW\n" + \
+		"       %prog [options] --baseline OLD... --candidate NEW...\n" + \
+		"       %prog [options] --pairs-from FILE"
+	optparser = OptionParser(usage=usage, description="Compares results, tests and metrics, "
+	                         "of journals of a test. Metrics of several runs are compared statistically.")
+	optparser.add_option("-b", "--baseline", default=[], action="append", dest="baseline", metavar="JOURNAL",
+	                     help="journal of a baseline run, can be used repeatedly")
+	optparser.add_option("-B", "--baselines-from", default=None, dest="baselines_from", metavar="FILE",
+	                     help="read baseline journals from FILE, one per line, '-' for standard input, "
+	                          "e.g. those selected by beakerlib-metrichistory baseline")
+	optparser.add_option("-c", "--candidate", default=[], action="append", dest="candidate", metavar="JOURNAL",
+	                     help="journal of a candidate run, can be used repeatedly")
+	optparser.add_option("-P", "--pairs-from", default=None, dest="pairs_from", metavar="FILE",
+	                     help="compare pairs of journals listed in FILE, one 'OLD NEW' pair per line, "
+	                          "'-' for standard input, writes one JSON report per line")
+	optparser.add_option("-J", "--jobs", default=0, type="int", dest="jobs", metavar="N",
+	                     help="number of processes comparing pairs, defaults to number of CPUs")
+	optparser.add_option("--confidence", default=0.95, type="float", dest="confidence", metavar="LEVEL",
+	                     help="confidence level a metric regression must have to be reported, default 0.95")
+	optparser.add_option("-f", "--format", default="text", choices=["text", "json"], dest="format",
+	                     help="output format, text or json")
+	(options, args) = optparser.parse_args()
+	if not 0 < options.confidence < 1:
+		optparser.error("confidence level must be between 0 and 1")
+
+	if options.pairs_from:
+		if args or options.baseline or options.candidate or options.baselines_from:
+			optparser.error("--pairs-from cannot be combined with other journals")
+		return comparePairsMain(options)
+
+	if options.baselines_from:
+		try:
+			fh = sys.stdin if options.baselines_from == '-' else open(options.baselines_from)
+			options.baseline.extend(line.strip() for line in fh if line.strip())
+		except IOError as e:
+			sys.stderr.write("Failed to read list of baseline journals: %s\n" % str(e))
+			return 1
+		if not options.baseline:
+			sys.stderr.write("No baseline journals to compare with.\n")
+			return 1
+
+	if len(args) == 2:
+		options.baseline.append(args[0])
+		options.candidate.append(args[1])
+	elif args or bool(options.baseline) != bool(options.candidate):
+		optparser.error("give OLD and NEW journals or both --baseline and --candidate journals")
+	elif not options.baseline:
+		options.baseline.append("old/rcw-journal")
+		options.candidate.append("new/rcw-journal")
+
+	report = compareJournals(options.baseline, options.candidate, options.confidence)
+	if options.format == "json":
+		print(json.dumps(report, indent=2))
 	else:
-		print("We are not doing any compare, types dont match")
+		printReport(report)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
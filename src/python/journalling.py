@@ -23,53 +23,393 @@
 # TODO fix xml pretty print
 
 
+# The script runs at the end of every test, so only the modules needed by
+# every conversion are imported here. Modules used by some modes only are
+# imported when needed, lxml is needed only for XSL transformation, see
+# loadEtree().
 try:
     import os
     import re
     import sys
-    import six
     import time
     import base64
+    from itertools import chain, islice
     from optparse import OptionParser
 except ImportError as e:
     sys.stderr.write("Python ImportError: " + str(e) + "\nExiting unsuccessfully.\n")
     exit(2)
+
 try:
-    from lxml import etree
-except ImportError as e:
-    sys.stderr.write("Python ImportError: " + str(e) + "\nExiting unsuccessfully.\n")
-    exit(3)
+    text_type = unicode
+except NameError:
+    text_type = str
+
+# ElementTree implementation the journal is built with, set by loadEtree()
+etree = None
 
 
 xmlForbidden = [0, 1, 2, 3, 4, 5, 6, 7, 8, 11, 12, 14, 15, 16, 17, 18, 19, 20,
                 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 0xFFFE, 0xFFFF]
 xmlTrans = dict([(x, None) for x in xmlForbidden])
 
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S %Z"
+# Name of a regular attribute on a metafile line, '--name=base64value'
+attributeName = re.compile(r'[a-zA-Z0-9]+$')
+# Valid name of an element, the standard library does not check it
+elementName = re.compile(r'[^\W\d][\w.-]*$', re.UNICODE)
+# Number of metafile lines tokenized together by tokenizeLines()
+TOKENIZER_CHUNK_SIZE = 1024
+# Decoded values and formatted timestamps are cached by tokenizeLines(),
+# a cache is emptied when it grows over this number of entries
+TOKENIZER_CACHE_SIZE = 65536
+# Version 2 metafile starts with this record, it is followed by records
+# of elements, one JSON object per line, see tokenizeRecords()
+METAFILE_V2_HEADER = "beakerlib_metafile"
+# Sidecar file of version 2 metafile, its n-th line holds the byte offset
+# of the record which starts the n-th phase
+METAFILE_INDEX_SUFFIX = ".index"
+# Joins decoded strings of a chunk so that forbidden characters are stripped
+# from all of them at once, it is a private use character
+BATCH_SEPARATOR = u'\ue000'
+
+# Serialized content of an element opened in streaming mode is kept in memory
+# up to this size, bigger content is spooled into a temporary file
+SPOOL_MAX_SIZE = 1024 * 1024
+# Written in front of the serialized journal, it is the same one
+# lxml etree.tostring(xml_declaration=True) makes
+XML_DECLARATION = b"<?xml version='1.0' encoding='utf-8'?>\n"
+# Modules compressing outputs of --compress option, imported only when used
+COMPRESSORS = {"gzip": "gzip", "xz": "lzma"}
+# Number of text pieces XMLWriter collects before writing them out
+WRITER_CHUNK_SIZE = 4096
+
+# Version of the checkpoint format, checkpoint of other version is ignored
+CHECKPOINT_VERSION = 2
+# Size of the metafile parts at its beginning and before the checkpointed
+# offset used to recognize that the metafile has been rewritten
+FINGERPRINT_SIZE = 4096
+# Last line of the metafile written by the final rlJournalEnd
+END_OF_METAFILE = "#End of metafile"
+
+
+# Imports ElementTree implementation used to build the journal. The standard
+# library one is enough unless the journal is transformed by XSL template,
+# or unless python is older than 3.6, where it keeps attributes in a plain
+# dict and so loses their order. Then lxml is used whenever it is installed.
+def loadEtree(lxml=False):
+    global etree
+    if lxml:
+        try:
+            from lxml import etree
+        except ImportError as e:
+            sys.stderr.write("Python ImportError: " + str(e) + "\nExiting unsuccessfully.\n")
+            exit(3)
+    elif etree is None:
+        if sys.version_info < (3, 6):
+            try:
+                from lxml import etree
+                return
+            except ImportError:
+                pass
+        try:
+            import xml.etree.cElementTree as etree
+        except ImportError:
+            import xml.etree.ElementTree as etree
+
+
+def escapeText(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('\r', '&#13;')
+
+
+def escapeAttribute(value):
+    return escapeText(value).replace('"', '&quot;').replace('\n', '&#10;').replace('\t', '&#9;')
 
+
+# Serializes elements in UTF-8 byte for byte the same as lxml does, so the
+# journal does not depend on the ElementTree implementation it is built with.
+# When pretty printing, children of an element are indented unless the
+# element has some text, even an empty one, or a child with a tail.
+# The output is written into fh in chunks, or kept to be returned by flush().
+class XMLWriter:
+    def __init__(self, fh=None):
+        self.fh = fh
+        self.pieces = []
+
+    def flush(self):
+        data = u''.join(self.pieces).encode('utf-8')
+        del self.pieces[:]
+        if self.fh is not None:
+            self.fh.write(data)
+        return data
+
+    # Level is the depth of the element when pretty printing, None otherwise.
+    # Elements being written are kept on a stack together with iterators of
+    # their children, nested phases could exceed the recursion limit.
+    def element(self, element, level=None):
+        pieces = self.pieces
+        stack = []
+        while element is not None:
+            pieces.append(u'<' + element.tag)
+            for key, value in element.attrib.items():
+                pieces.append(u' %s="%s"' % (key, escapeAttribute(value)))
+            text = element.text
+            if text is None and not len(element):
+                pieces.append(u'/>')
+                if element.tail:
+                    pieces.append(escapeText(element.tail))
+            else:
+                pieces.append(u'>')
+                if text:
+                    pieces.append(escapeText(text))
+                pretty = level is not None and text is None and all(child.tail is None for child in element)
+                stack.append((element, iter(element), level if pretty else None))
+            # Next element to write is the next child of the innermost
+            # element having one, the elements without more children are ended
+            element = None
+            while stack:
+                parent, children, level = stack[-1]
+                element = next(children, None)
+                if element is not None:
+                    if level is not None:
+                        level += 1
+                        pieces.append(u'\n' + u'  ' * level)
+                    break
+                stack.pop()
+                if level is not None:
+                    pieces.append(u'\n' + u'  ' * level)
+                pieces.append(u'</' + parent.tag + u'>')
+                if parent.tail:
+                    pieces.append(escapeText(parent.tail))
+            if self.fh is not None and len(pieces) > WRITER_CHUNK_SIZE:
+                self.flush()
+
+    # Writes the whole document with the root pretty printed
+    def document(self, root):
+        self.pieces.append(XML_DECLARATION.decode('utf-8'))
+        self.element(root, 0)
+        self.pieces.append(u'\n')
+        self.flush()
+
+
+# Returns serialized element, pretty printed one ends with a new line
+def serializeElement(element, pretty_print=False):
+    writer = XMLWriter()
+    if pretty_print:
+        writer.element(element, 0)
+        writer.pieces.append(u'\n')
+    else:
+        writer.element(element)
+    return writer.flush()
+
+
+# Stack of open elements. For each element it also keeps the first and the
+# last timestamp found so far in its subtree, so the start and end time of
+# an element are known as soon as it is closed, without walking the subtree.
 class Stack:
-    def __init__(self):
+    def __init__(self, builder):
         self.items = []
+        self.times = []
+        self.builder = builder
 
-    def push(self, item):
+    def push(self, item, times):
         self.items.append(item)
+        self.times.append(times)
 
     def pop(self):
-        return self.items.pop()
+        return self.items.pop(), self.times.pop()
 
     def peek(self):  # Returns top element without popping it
         return self.items[-1]
 
+    # Checkpoint support, the builder is not stored
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['builder']
+        return state
 
-# Saves the XML journal to a file.
-def saveJournal(journal, journal_path):
-    try:
-        output = open(journal_path, 'wb')
-        output.write(etree.tostring(journal, xml_declaration=True, encoding='utf-8', pretty_print=True))
-        output.close()
-        return 0
-    except IOError as e:
-        sys.stderr.write('Failed to save journal to %s: %s' % (journal_path, str(e)))
-        return 1
+    # Appends finished element with given times of its subtree to the top element
+    def append(self, item, times):
+        starttime, endtime = getStartEndTime(item, times)
+        if starttime:
+            top_times = self.times[-1]
+            if not top_times[0]:
+                top_times[0] = starttime
+            top_times[1] = endtime
+        self.builder.append(self.items[-1], item)
+
+
+# Builds the whole journal in memory. Elements are attached to their parent
+# as soon as they are created, lxml would walk through the whole subtree of
+# a finished element again when appending it.
+class TreeBuilder:
+    def __init__(self, sinks=()):
+        self.root = etree.Element("BEAKER_TEST")
+        self.sinks = sinks
+
+    def create(self, element, attributes, content, parent):
+        new_el = createElement(element, attributes, content)
+        if parent is not None:
+            parent.append(new_el)
+        return new_el
+
+    def append(self, parent, child):
+        for sink in self.sinks:
+            sink.element(parent, child)
+
+    # Removes element which has never been finished from its parent
+    def discard(self, element, parent):
+        if parent is not None:
+            parent.remove(element)
+
+
+# Builds the journal in streaming mode, see StreamNode
+class StreamBuilder:
+    def __init__(self, spool_dir=None, sinks=()):
+        self.root = StreamRoot()
+        self.spool_dir = spool_dir
+        self.sinks = sinks
+
+    def create(self, element, attributes, content, parent):
+        return StreamNode(createElement(element, attributes, content), self.spool_dir)
+
+    def append(self, parent, child):
+        for sink in self.sinks:
+            sink.element(parent.element, child.element)
+        parent.append(child)
+
+    # Spooled content of unfinished element is simply never written out
+    def discard(self, element, parent):
+        pass
+
+
+# Builds no journal, the elements are just passed to the sinks. Only the
+# children of the root element are kept, the sinks may look at them at the end.
+class SinkBuilder:
+    def __init__(self, sinks):
+        self.root = etree.Element("BEAKER_TEST")
+        self.sinks = sinks
+
+    def create(self, element, attributes, content, parent):
+        return createElement(element, attributes, content)
+
+    def append(self, parent, child):
+        for sink in self.sinks:
+            sink.element(parent, child)
+        if parent is self.root:
+            parent.append(child)
+
+    def discard(self, element, parent):
+        pass
+
+
+# Element opened in streaming mode. Its finished children are serialized
+# into a spool right away, so they do not need to be kept in memory.
+# With spool_dir set the spool is a regular file in that directory, so that
+# it outlives the process when the parser state is checkpointed.
+class StreamNode:
+    def __init__(self, element, spool_dir=None):
+        self.element = element
+        self.attrib = element.attrib
+        self.spool = None
+        self.spool_dir = spool_dir
+        self.spool_path = None
+
+    def get(self, key, default=None):
+        return self.element.get(key, default)
+
+    def set(self, key, value):
+        self.element.set(key, value)
+
+    def write(self, data):
+        if self.spool is None:
+            import tempfile
+            if self.spool_dir:
+                fd, self.spool_path = tempfile.mkstemp(prefix='spool-', dir=self.spool_dir)
+                self.spool = os.fdopen(fd, 'w+b')
+            else:
+                self.spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        self.spool.write(data)
+
+    # Serializes finished child element right away
+    def append(self, child):
+        child.serialize(self)
+
+    # Writes the element including its spooled children into fh
+    def serialize(self, fh):
+        data = serializeElement(self.element)
+        if self.spool is None:
+            fh.write(data)
+            return
+        end_tag = ('</%s>' % self.element.tag).encode('utf-8')
+        fh.write(data[:-len(end_tag)])
+        import shutil
+        self.spool.seek(0)
+        shutil.copyfileobj(self.spool, fh)
+        if self.spool_path:
+            # Checkpointed spool is truncated back to its saved size when loaded
+            self.spool.seek(0, os.SEEK_END)
+        else:
+            self.spool.close()
+            self.spool = None
+        fh.write(end_tag)
+
+    # Checkpoint support, the element is stored as its name, attributes and
+    # text, the spool as its path and the size it has at the moment
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['attrib']
+        state['element'] = (self.element.tag, list(self.element.attrib.items()), self.element.text)
+        if self.spool is not None:
+            self.spool.flush()
+            state['spool'] = os.fstat(self.spool.fileno()).st_size
+        return state
+
+    def __setstate__(self, state):
+        tag, attributes, text = state['element']
+        self.__dict__.update(state)
+        self.element = etree.Element(tag)
+        for key, value in attributes:
+            self.element.set(key, value)
+        self.element.text = text
+        self.attrib = self.element.attrib
+        if self.spool is not None:
+            self.spool = open(self.spool_path, 'r+b')
+            self.spool.truncate(state['spool'])
+            self.spool.seek(0, os.SEEK_END)
+
+
+# Root element in streaming mode. Its children are kept until the end as
+# the test starttime and endtime are known only after the last line is read.
+class StreamRoot(StreamNode):
+    def __init__(self):
+        StreamNode.__init__(self, etree.Element("BEAKER_TEST"))
+        self.children = []
+
+    def append(self, child):
+        self.children.append(child)
+
+    def find(self, tag):
+        for child in self.children:
+            if child.element.tag == tag:
+                return child.element
+        return None
+
+    # Writes the whole journal the same way as lxml pretty printing does, children
+    # of the root element are the only ones pretty printed
+    def serialize(self, fh):
+        root = etree.Element(self.element.tag, dict(self.element.attrib))
+        if not self.children:
+            fh.write(XML_DECLARATION + serializeElement(root, pretty_print=True))
+            return
+        etree.SubElement(root, "placeholder").text = ""
+        data = XML_DECLARATION + serializeElement(root, pretty_print=True)
+        head, tail = data.split(b"  <placeholder></placeholder>\n")
+        fh.write(head)
+        for child in self.children:
+            fh.write(b"  ")
+            child.serialize(fh)
+            fh.write(b"\n")
+        fh.write(tail)
 
 
 # Adds attributes starttime and endtime to a element.
@@ -83,16 +423,12 @@ def addStartEndTime(element, starttime, endtime):
 
 
 # Find first and last timestamp to fill in starttime and endtime attributes of given element.
-def getStartEndTime(element):
-    starttime = ""
-    endtime = ""
-    for child in element.iter():
-        if child.get("timestamp"):
-            if starttime == "":
-                starttime = child.get("timestamp")
-            endtime = child.get("timestamp")
-
-    return starttime, endtime
+# "times" holds the first and last timestamp found among the element's descendants.
+def getStartEndTime(element, times):
+    timestamp = element.get("timestamp")
+    if timestamp:
+        return timestamp, times[1] or timestamp
+    return times[0], times[1]
 
 
 # Parses and decodes lines given to it
@@ -170,191 +506,1129 @@ def parseLine(line):
     return indent, element, attributes, content
 
 
-# Returns XML element created with
-# information given as parameters
+# Legacy tokenizer backend, yields parseLine() results of the lines which
+# contain an element or attributes
+def parseLines(lines):
+    for line in lines:
+        indent, element, attributes, content = parseLine(line)
+        if element == "" and attributes == {}:
+            continue
+        yield indent, element, attributes, content
+
+
+# Removes XML forbidden characters from all the strings in one pass over
+# them joined by BATCH_SEPARATOR, unless some string contains it already
+def stripForbidden(strings):
+    joined = BATCH_SEPARATOR.join(strings)
+    if joined.count(BATCH_SEPARATOR) == len(strings) - 1:
+        return joined.translate(xmlTrans).split(BATCH_SEPARATOR)
+    return [string.translate(xmlTrans) for string in strings]
+
+
+# Returns attribute name and value of a '--name=value' part of a metafile
+# line, the value of timestamp is formatted, other values are left encoded.
+# Name is None if the part is not an attribute.
+def parseAttribute(part):
+    if part[:2] != '--':
+        return None, None
+    name, equals, value = part[2:].partition('=')
+    if not equals:
+        return None, None
+    if name == 'timestamp':
+        try:
+            return name, time.strftime(TIME_FORMAT, time.localtime(int(value)))
+        except ValueError as e:
+            sys.stderr.write('Failed to convert timestamp attribute to int.\
+                    \nError: %s\nExiting unsuccessfully.\n' % (e))
+            exit(1)
+    if attributeName.match(name):
+        return name, value
+    return None, None
+
+
+# Tokenizer backend producing the same tokens as parseLines(), but the
+# attribute values and content are already decoded and stripped of XML
+# forbidden characters. Lines are processed in chunks, values not seen
+# before are decoded together once per chunk and kept in a cache together
+# with formatted timestamps, as consecutive lines share most of them.
+def tokenizeLines(lines, chunk_size=TOKENIZER_CHUNK_SIZE):
+    lines = iter(lines)
+    decoded = {}
+    # Attribute name and value for each '--name=value' part seen so far,
+    # with timestamps already formatted, name is None for ignored parts
+    known = {}
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        if len(decoded) > TOKENIZER_CACHE_SIZE:
+            decoded.clear()
+        if len(known) > TOKENIZER_CACHE_SIZE:
+            known.clear()
+
+        tokens = []
+        pending = set()
+        for line in chunk:
+            # Stripping comments
+            line = line.split('#', 1)[0]
+            splitted = line.split()
+            if not splitted:
+                continue
+            element = "" if splitted[0][:2] == '--' else splitted[0]
+            attributes = {}
+            content = ""
+            parts = iter(splitted)
+            for part in parts:
+                # Next part is the element content
+                if part == '--':
+                    content = next(parts, "")
+                    if content not in decoded:
+                        pending.add(content)
+                    break
+                attribute = known.get(part)
+                if attribute is None:
+                    attribute = known[part] = parseAttribute(part)
+                name, value = attribute
+                if name is None:
+                    continue
+                attributes[name] = value
+                if name != 'timestamp' and value not in decoded:
+                    pending.add(value)
+            if element == "" and attributes == {}:
+                continue
+            tokens.append((len(line) - len(line.lstrip()), element, attributes, content))
+
+        if pending:
+            import binascii
+            pending = list(pending)
+            texts = []
+            for value in pending:
+                try:
+                    texts.append(binascii.a2b_base64(value).decode('utf8', 'replace'))
+                except (TypeError, ValueError) as e:
+                    sys.stderr.write('Failed to decode string \'%s\' from base64.\
+                            \nError: %s\nExiting unsuccessfully.\n' % (value, e))
+                    exit(1)
+            decoded.update(zip(pending, stripForbidden(texts)))
+
+        for indent, element, attributes, content in tokens:
+            for key, value in attributes.items():
+                if key != 'timestamp':
+                    attributes[key] = decoded[value]
+            yield indent, element, attributes, decoded[content] if content else content
+
+
+# Returns version of the metafile starting with given line
+def metafileVersion(line):
+    if not line.lstrip().startswith('{'):
+        return 1
+    import json
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return 1
+    if isinstance(record, dict) and record.get(METAFILE_V2_HEADER) == 2:
+        return 2
+    return 1
+
+
+# Tokenizer of version 2 metafile, it produces the same tokens as
+# tokenizeLines() does for the same content in version 1 metafile.
+# Each line holds one record like
+#   {"depth": 1, "element": "phase", "timestamp": 1500000000,
+#    "attributes": {"name": "Setup", "type": "FAIL"}, "content": ""}
+# where depth is the indent level of the version 1 line. Closing records
+# have no element. The header record, empty lines and comments are skipped.
+def tokenizeRecords(lines, chunk_size=TOKENIZER_CHUNK_SIZE):
+    from json import loads
+    lines = iter(lines)
+    timestamps = {}
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        if len(timestamps) > TOKENIZER_CACHE_SIZE:
+            timestamps.clear()
+
+        tokens = []
+        # Attribute values and content of the whole chunk, to be stripped at once
+        texts = []
+        for line in chunk:
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            try:
+                record = loads(line)
+                depth = record.get('depth')
+            except (ValueError, AttributeError) as e:
+                sys.stderr.write('Failed to parse metafile record \'%s\'.\
+                        \nError: %s\nExiting unsuccessfully.\n' % (line, e))
+                exit(1)
+            if depth is None:
+                continue
+            attributes = {}
+            if 'timestamp' in record:
+                value = record['timestamp']
+                timestamp = timestamps.get(value)
+                if timestamp is None:
+                    try:
+                        timestamp = time.strftime(TIME_FORMAT, time.localtime(int(value)))
+                    except ValueError as e:
+                        sys.stderr.write('Failed to convert timestamp attribute to int.\
+                                \nError: %s\nExiting unsuccessfully.\n' % (e))
+                        exit(1)
+                    timestamps[value] = timestamp
+                attributes['timestamp'] = timestamp
+            for name, value in record.get('attributes', {}).items():
+                if attributeName.match(name):
+                    attributes[name] = len(texts)
+                    texts.append(text_type(value))
+            element = record.get('element', "")
+            if element == "" and attributes == {}:
+                continue
+            content = record.get('content')
+            if content is not None:
+                texts.append(text_type(content))
+                content = len(texts) - 1
+            tokens.append((depth, element, attributes, content))
+
+        texts = stripForbidden(texts)
+        for depth, element, attributes, content in tokens:
+            for key, value in attributes.items():
+                if key != 'timestamp':
+                    attributes[key] = texts[value]
+            yield depth, element, attributes, "" if content is None else texts[content]
+
+
+# Yields tokens of the journal header, that is all the tokens before the
+# first phase, followed by tokens of one phase and its subtree moved to the
+# first level. The phase is the first one after skipping "skip" phases.
+class PhaseSelector:
+    def __init__(self, tokens, skip):
+        self.tokens = tokens
+        self.skip = skip
+        self.found = False
+
+    def __iter__(self):
+        tokens = iter(self.tokens)
+        skip = self.skip
+        for token in tokens:
+            if token[1] == 'phase':
+                if skip == 0:
+                    break
+                skip -= 1
+                continue
+            # Header tokens are those before any phase
+            if skip == self.skip:
+                yield token
+        else:
+            return
+        self.found = True
+        depth = token[0]
+        yield (1,) + token[1:]
+        for token in tokens:
+            # Phase ends with a closing line on its level or with any
+            # element on its level or above
+            if token[0] < depth or (token[0] == depth and token[1] != ""):
+                return
+            yield (token[0] - depth + 1,) + token[1:]
+            if token[0] == depth:
+                return
+
+
+# Returns XML element created with information given as parameters.
+# Text values are expected to be stripped of XML forbidden characters
+# already, only bytes decoded from base64 are processed.
 def createElement(element, attributes, content):
     # In python 3 decoding from base64 causes retyping into bytes.
     if isinstance(element, bytes):
         # First bytes are decoded from utf8.
         element = element.decode('utf8', 'replace')
-    # And then retyped to string, using 'six' module which adds python 2/3 compatible methods.
+    # And then retyped to string, python 2/3 compatible.
     # XML not compatible characters are then also stripped from the string.
-    element = six.text_type(element).translate(xmlTrans)
+    element = text_type(element).translate(xmlTrans)
 
     try:
+        if not elementName.match(element):
+            raise ValueError("Invalid tag name %r" % element)
         new_el = etree.Element(element)
     except ValueError as e:
         sys.stderr.write('Failed to create element with name %s\nError: %s\nExiting unsuccessfully.\n' % (element, e))
         exit(1)
 
     if isinstance(content, bytes):
-        content = content.decode('utf8', 'replace')
-    new_el.text = six.text_type(content).translate(xmlTrans)
+        content = content.decode('utf8', 'replace').translate(xmlTrans)
+    new_el.text = content
 
     for key, value in attributes.items():
-        if isinstance(key, bytes):
-            key = key.decode('utf8', 'replace')
-        key = six.text_type(key).translate(xmlTrans)
-
         if isinstance(value, bytes):
-            value = value.decode('utf8', 'replace')
-        value = six.text_type(value).translate(xmlTrans)
+            value = value.decode('utf8', 'replace').translate(xmlTrans)
         new_el.set(key, value)
     return new_el
 
 
-# Main loop of the program
-# Reads metafile or stdin line by line and adds
-# information from them into XML document
-def createJournalXML(options):
-    # If --metafile option is used read from it, else read standard input
-    if options.metafile:
+# Applies closing line attributes to a paired element and fills in its
+# starttime and endtime, "attributes" is empty when the element is ended
+# implicitly by a line on a lower indent level.
+def closeElement(element, attributes, times):
+    # Updating start and end time
+    starttime, endtime = getStartEndTime(element, times)
+    # If the closing element has a --timestamp, this value will be used as endtime
+    if "timestamp" in attributes:
+        endtime = attributes["timestamp"]
+    # Updating attributes found on closing line
+    for key, value in attributes.items():
+        element.set(key, value)
+    # Add start/end time and remove timestamp attribute
+    addStartEndTime(element, starttime, endtime)
+
+
+# Metafile parser. It keeps its state between calls of feed(), so the
+# metafile can be processed in parts.
+class JournalParser:
+    def __init__(self, builder):
+        self.builder = builder
+        self.journal = builder.root
+        # Indent level of previous line, initialized to -1
+        self.old_indent = -1
+        self.previous_el = self.journal
+        # First and last timestamp in the subtree of previous element
+        self.previous_times = ["", ""]
+        # Stack of elements
+        self.el_stack = Stack(builder)
+        # Metafile version, recognized by the first line fed
+        self.version = None
+
+    # Tokenizes the lines according to the metafile version and feeds them
+    def feed(self, lines):
+        lines = iter(lines)
+        if self.version is None:
+            for line in lines:
+                self.version = metafileVersion(line)
+                lines = chain([line], lines)
+                break
+            else:
+                return
+        if self.version == 2:
+            self.feedTokens(tokenizeRecords(lines))
+        else:
+            self.feedTokens(tokenizeLines(lines))
+
+    # Main loop of the program
+    # Goes through tokens of metafile lines adding elements created by
+    # the builder into the journal root element
+    def feedTokens(self, tokens):
+        builder = self.builder
+        el_stack = self.el_stack
+        old_indent = self.old_indent
+        previous_el = self.previous_el
+        previous_times = self.previous_times
+
+        # Main loop, going through lines of metafile, adding elements
+        for indent, element, attributes, content in tokens:
+            if indent > old_indent:
+                # Creating new element
+                new_el = builder.create(element, attributes, content, previous_el)
+                # Putting previous element to the top of the stack
+                el_stack.push(previous_el, previous_times)
+                # New element is now current element
+                previous_el = new_el
+                previous_times = ["", ""]
+
+            elif indent == old_indent:
+                # Closing element with updates to it with no elements inside it
+                if element == "":
+                    closeElement(previous_el, attributes, previous_times)
+                # New element is on the same level as previous one
+                else:
+                    # Previous element has ended so it is appended to the element 1 level above
+                    el_stack.append(previous_el, previous_times)
+                    # Creating new element
+                    new_el = builder.create(element, attributes, content, el_stack.peek())
+                    # New element is now current element
+                    previous_el = new_el
+                    previous_times = ["", ""]
+
+            # New element is on higher level than previous one
+            elif indent < old_indent:
+                # Difference between indent levels = how many paired elements will be closed
+                indent_diff = old_indent - indent
+                for _ in range(indent_diff):
+                    el_stack.append(previous_el, previous_times)
+                    previous_el, previous_times = el_stack.pop()
+
+                # Closing element with updates to it
+                if element == "" and attributes != {}:
+                    closeElement(previous_el, attributes, previous_times)
+
+                # Ending paired element and creating new one on the same level as the paired one that just ended
+                elif element != "":
+                    closeElement(previous_el, {}, previous_times)
+                    # Appending previous element to the element 1 level above
+                    if el_stack.items:
+                        el_stack.append(previous_el, previous_times)
+
+                    new_el = builder.create(element, attributes, content,
+                                            el_stack.peek() if el_stack.items else None)
+                    previous_el = new_el
+                    previous_times = ["", ""]
+
+            # Changing indent level to new value
+            old_indent = indent
+
+        self.old_indent = old_indent
+        self.previous_el = previous_el
+        self.previous_times = previous_times
+
+    # Closes all elements left open and returns the journal root element,
+    # no more lines can be fed afterwards
+    def finish(self):
+        builder = self.builder
+        el_stack = self.el_stack
+        previous_el = self.previous_el
+        previous_times = self.previous_times
+
+        # Final appending
+        for _ in el_stack.items:
+            el_stack.append(previous_el, previous_times)
+            previous_el, previous_times = el_stack.pop()
+
+        # Updating start and end time of last opened paired element(log),
+        # it is closed before appending so that the parent gets its final times
+        closeElement(previous_el, {}, previous_times)
+        if el_stack.items:
+            el_stack.append(previous_el, previous_times)
+        # Elements still left above the root have never been appended to their
+        # parents, each of them is a child of the element below it on the stack
+        for parent, element in zip(el_stack.items, el_stack.items[1:]):
+            builder.discard(element, parent)
+
+        # Updating start/end time of the whole test, the root is either
+        # at the bottom of the stack or it is the last closed element
+        if el_stack.items:
+            starttime, endtime = getStartEndTime(self.journal, el_stack.times[0])
+        else:
+            starttime, endtime = getStartEndTime(self.journal, previous_times)
+        self.journal.find("starttime").text = starttime
+        self.journal.find("endtime").text = endtime
+        return self.journal
+
+    # Checkpoint support, the builder is not stored
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['builder']
+        return state
+
+    # Connects parser restored from a checkpoint with the builder
+    def attach(self, builder):
+        self.builder = builder
+        self.el_stack.builder = builder
+        builder.root = self.journal
+
+
+# Reads complete lines of the metafile starting at given byte offset and keeps
+# the offset of the first line not read yet. Incomplete last line is left for
+# the next run as it is probably still being written.
+class MetafileReader:
+    def __init__(self, fh, offset, limit=None):
+        self.fh = fh
+        self.offset = offset
+        # Reading stops at this offset if set
+        self.limit = limit
+        self.last = None
+
+    def __iter__(self):
+        self.fh.seek(self.offset)
+        for line in self.fh:
+            if not line.endswith(b'\n') or (self.limit is not None and self.offset >= self.limit):
+                break
+            self.offset += len(line)
+            self.last = line.decode('utf-8', 'replace')
+            yield self.last
+
+
+# Identifies the metafile and its content up to the offset, so that
+# a truncated or rewritten metafile does not match an older checkpoint
+def metafileFingerprint(fh, offset):
+    stat = os.fstat(fh.fileno())
+    import hashlib
+    digest = hashlib.sha1()
+    for start in sorted(set([0, max(0, offset - FINGERPRINT_SIZE)])):
+        fh.seek(start)
+        digest.update(fh.read(min(FINGERPRINT_SIZE, offset - start)))
+    return (stat.st_dev, stat.st_ino, offset, digest.hexdigest())
+
+
+# Streaming parser state saved in a directory next to the metafile, so that
+# the next run needs to parse only the lines appended to the metafile since
+# the previous one
+class Checkpoint:
+    def __init__(self, metafile):
+        self.path = metafile + '.checkpoint'
+        self.state_path = os.path.join(self.path, 'state')
+        self.lock_fh = None
+
+    # Only one process may use the checkpoint at a time
+    def lock(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.lock_fh = open(os.path.join(self.path, 'lock'), 'w')
+        import fcntl
+        fcntl.flock(self.lock_fh, fcntl.LOCK_EX)
+
+    def unlock(self):
+        self.lock_fh.close()
+
+    # Returns parser restored from the checkpoint together with the metafile
+    # offset to continue from. A fresh parser is returned when there is no
+    # checkpoint or it does not match the metafile anymore.
+    def load(self, fh):
+        import pickle
+        builder = StreamBuilder(self.path)
+        try:
+            with open(self.state_path, 'rb') as state_fh:
+                version, fingerprint = pickle.load(state_fh)
+                if version == CHECKPOINT_VERSION and fingerprint == metafileFingerprint(fh, fingerprint[2]):
+                    parser = pickle.load(state_fh)
+                    parser.attach(builder)
+                    return parser, fingerprint[2]
+        except Exception:
+            # Missing or unreadable checkpoint, the metafile is processed from its beginning
+            pass
+        self.removeSpools(set())
+        return JournalParser(builder), 0
+
+    # Must be called before the parser is finished
+    def save(self, fh, parser, offset):
+        import pickle
+        with open(self.state_path + '.tmp', 'wb') as state_fh:
+            pickle.dump((CHECKPOINT_VERSION, metafileFingerprint(fh, offset)), state_fh, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(parser, state_fh, pickle.HIGHEST_PROTOCOL)
+        os.rename(self.state_path + '.tmp', self.state_path)
+        # Elements finished since the last checkpoint do not need their spools anymore
+        nodes = parser.el_stack.items + [parser.previous_el] + parser.journal.children
+        self.removeSpools(set(node.spool_path for node in nodes if node.spool is not None))
+
+    # The metafile is complete, nothing is going to continue from the checkpoint
+    def remove(self):
+        import shutil
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def removeSpools(self, keep):
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if name.startswith('spool-') and path not in keep:
+                os.remove(path)
+
+
+# Output sinks, all of them are filled during a single pass over the
+# metafile. A sink gets every element together with its parent as soon as
+# the element is finished, and the finished journal root at the end.
+# Path '-' stands for the standard output.
+class Sink:
+    # The sink needs the whole journal built in memory
+    tree = False
+    # Output is compressed by this one of COMPRESSORS if set
+    compress = None
+
+    def __init__(self, path):
+        self.path = path
+        self.fh = None
+        self.raw_fh = None
+
+    # Called before the metafile is parsed, returns 1 on failure
+    def start(self):
+        return 0
+
+    def open(self):
+        if self.path == '-':
+            self.raw_fh = getattr(sys.stdout, 'buffer', sys.stdout)
+        else:
+            self.raw_fh = open(self.path, 'wb')
+        self.fh = self.raw_fh
+        if self.compress == "gzip":
+            import gzip
+            self.fh = gzip.GzipFile(filename='', mode='wb', compresslevel=6, fileobj=self.raw_fh)
+        elif self.compress == "xz":
+            import lzma
+            self.fh = lzma.LZMAFile(self.raw_fh, 'wb')
+
+    def close(self):
+        # Compressed file object does not close the file it writes into
+        if self.fh is not self.raw_fh:
+            self.fh.close()
+        if self.path == '-':
+            self.raw_fh.flush()
+        else:
+            self.raw_fh.close()
+
+    def element(self, parent, element):
+        pass
+
+    # Writes the output, returns 1 on failure
+    def finish(self, journal):
+        return 0
+
+
+# Compiled XSL templates, so that a process converting many metafiles
+# in batch mode compiles each template just once
+xsltCache = {}
+
+
+def xsltTransform(path):
+    loadEtree(lxml=True)
+    transform = xsltCache.get(path)
+    if transform is None:
+        transform = xsltCache[path] = etree.XSLT(etree.parse(path))
+    return transform
+
+
+# The XML journal, optionally transformed by an XSL template. The output is
+# opened only when the journal is finished, so a failure while parsing the
+# metafile keeps the previous journal in place.
+class XMLSink(Sink):
+    def __init__(self, path, xslt=None):
+        Sink.__init__(self, path)
+        self.xslt = xslt
+        self.tree = bool(xslt)
+
+    def finish(self, journal):
+        # XSL transformation
+        try:
+            if self.xslt:
+                journal = xsltTransform(self.xslt)(journal)
+        except etree.LxmlError as e:
+            sys.stderr.write("\nTransformation template file \'" + self.xslt +
+                    "\' could not be parsed.\nError: %s\nAborting journal creation." % (e))
+            return 1
         try:
-            fh = open(options.metafile, 'r+')
+            self.open()
+            # Written into the file in chunks as it is serialized
+            if isinstance(journal, StreamRoot):
+                journal.serialize(self.fh)
+            elif self.xslt:
+                self.fh.write(XML_DECLARATION)
+                journal.write(self.fh, encoding='utf-8', pretty_print=True)
+            else:
+                XMLWriter(self.fh).document(journal)
+            self.close()
+            return 0
         except IOError as e:
-            sys.stderr.write('Failed to open queue file with' + str(e), 'FAIL')
+            sys.stderr.write('Failed to save journal to %s: %s' % (self.path, str(e)))
             return 1
 
-        lines = fh.readlines()
-        fh.close()
-    else:
-        lines = sys.stdin.readlines()
 
-    # Indent level of previous line, initialized to -1
-    old_indent = -1
-    # Initialize root element
-    previous_el = etree.Element("BEAKER_TEST")
-    journal = previous_el
-    # Stack of elements
-    el_stack = Stack()
+# Every finished element as a JSON object on a separate line with its name,
+# the name of its parent, attributes and content. Children are written before
+# their parents. The last line describes the root element and holds start
+# and end time of the whole test, which are known only at the end.
+class JSONLinesSink(Sink):
+    def start(self):
+        try:
+            self.open()
+            return 0
+        except IOError as e:
+            sys.stderr.write('Failed to open %s: %s\n' % (self.path, str(e)))
+            return 1
 
-    # Main loop, going through lines of metafile, adding elements
-    for line in lines:
-        indent, element, attributes, content = parseLine(line)
-        # Empty line is ignored
-        if element == "" and attributes == {}:
-            continue
+    def write(self, record):
+        import json
+        self.fh.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n")
+
+    def element(self, parent, element):
+        self.write({"element": element.tag, "parent": parent.tag,
+                    "attributes": dict(element.attrib), "content": element.text or ""})
+
+    def finish(self, journal):
+        root = journal.element if isinstance(journal, StreamRoot) else journal
+        self.write({"element": root.tag, "parent": None, "attributes": dict(root.attrib), "content": "",
+                    "starttime": journal.find("starttime").text, "endtime": journal.find("endtime").text})
+        try:
+            self.close()
+            return 0
+        except IOError as e:
+            sys.stderr.write('Failed to save %s: %s\n' % (self.path, str(e)))
+            return 1
+
+
+# Overall results of the test in the 'sourceable' form of TestResults file
+class SummarySink(Sink):
+    RESULTS = ["PASS", "WARN", "FAIL"]
+    ECODES = {"PASS": 0, "WARN": 10, "FAIL": 20}
 
-        if indent > old_indent:
-            # Creating new element
-            new_el = createElement(element, attributes, content)
-            # Putting previous element to the top of the stack
-            el_stack.push(previous_el)
-            # New element is now current element
-            previous_el = new_el
-
-        elif indent == old_indent:
-            # TODO refactor
-            # Closing element with updates to it with no elements inside it
-            if element == "":
-                # Updating start and end time
-                starttime, endtime = getStartEndTime(previous_el)
-                # If the closing element has a --timestamp, this value will be used as endtime
-                if "timestamp" in attributes:
-                    endtime = attributes["timestamp"]
-                # Updating attributes found on closing line
-                for key, value in attributes.items():
-                    previous_el.set(key, value)
-                # Add start/end time and remove timestamp attribute
-                addStartEndTime(previous_el, starttime, endtime)
-            # New element is on the same level as previous one
+    def __init__(self, path):
+        Sink.__init__(self, path)
+        self.worst = "PASS"
+        self.phases_passed = 0
+        self.phases_failed = 0
+        self.asserts_passed = 0
+        self.asserts_failed = 0
+
+    def element(self, parent, element):
+        if element.tag == "phase":
+            result = element.get("result")
+            if result == "PASS":
+                self.phases_passed += 1
+            elif result is not None:
+                self.phases_failed += 1
+                if result in self.RESULTS and self.RESULTS.index(result) > self.RESULTS.index(self.worst):
+                    self.worst = result
+        elif element.tag == "test":
+            if element.text == "PASS":
+                self.asserts_passed += 1
             else:
-                # Previous element has ended so it is appended to the element 1 level above
-                el_stack.peek().append(previous_el)
-                # Creating new element
-                new_el = createElement(element, attributes, content)
-                # New element is now current element
-                previous_el = new_el
+                self.asserts_failed += 1
 
-        # New element is on higher level than previous one
-        elif indent < old_indent:
-            # Difference between indent levels = how many paired elements will be closed
-            indent_diff = old_indent - indent
-            for _ in range(indent_diff):
-                el_stack.peek().append(previous_el)
-                previous_el = el_stack.pop()
-
-            # Closing element with updates to it
-            if element == "" and attributes != {}:
-                # Updating start and end time
-                starttime, endtime = getStartEndTime(previous_el)
-                # If the closing element has a --timestamp, this value will be used as endtime
-                if "timestamp" in attributes:
-                    endtime = attributes["timestamp"]
-                # Updating attributes found on closing line
-                for key, value in attributes.items():
-                    previous_el.set(key, value)
-                # Add start/end time and remove timestamp attribute
-                addStartEndTime(previous_el, starttime, endtime)
-
-            # Ending paired element and creating new one on the same level as the paired one that just ended
-            elif element != "":
-                # Updating start and end time
-                starttime, endtime = getStartEndTime(previous_el)
-                addStartEndTime(previous_el, starttime, endtime)
-                # Appending previous element to the element 1 level above
-                if el_stack.items:
-                    el_stack.peek().append(previous_el)
-
-                new_el = createElement(element, attributes, content)
-                previous_el = new_el
+    def finish(self, journal):
+        variables = [("RESULT_STRING", self.worst),
+                     ("RESULT_ECODE", self.ECODES[self.worst]),
+                     ("PHASES_PASSED", self.phases_passed),
+                     ("PHASES_FAILED", self.phases_failed),
+                     ("ASSERTS_PASSED", self.asserts_passed),
+                     ("ASSERTS_FAILED", self.asserts_failed),
+                     ("STARTTIME", journal.find("starttime").text),
+                     ("ENDTIME", journal.find("endtime").text)]
+        import six
+        try:
+            self.open()
+            self.fh.write(b"# This is a summary of the journal in a 'sourceable' form.\n")
+            for name, value in variables:
+                line = "TESTRESULT_%s=%s\n" % (name, six.moves.shlex_quote(six.text_type(value)))
+                self.fh.write(line.encode('utf-8'))
+            self.close()
+            return 0
+        except IOError as e:
+            sys.stderr.write('Failed to save summary to %s: %s\n' % (self.path, str(e)))
+            return 1
 
-        # Changing indent level to new value
-        old_indent = indent
 
-    # Final appending
-    for _ in el_stack.items:
-        el_stack.peek().append(previous_el)
-        previous_el = el_stack.pop()
-    if el_stack.items:
-        el_stack.peek().append(previous_el)
+# The journal in xunit format, the same as xslt-templates/xunit.xsl makes of
+# it, without building the journal in memory. A testcase is serialized into
+# a spool as soon as its phase is finished, the testsuite element is written
+# at the end when its totals are known.
+class XunitSink(Sink):
+    # Header elements of the journal used as testsuite attributes
+    SUITE = {"testname": "name", "hostname": "hostname", "test_id": "id", "package": "package"}
+
+    def __init__(self, path):
+        Sink.__init__(self, path)
+        import tempfile
+        self.spool = tempfile.SpooledTemporaryFile(SPOOL_MAX_SIZE)
+        self.suite = {}
+        # Tests of phases not finished yet
+        self.tests = {}
+        self.testcases = 0
+        self.failures = 0
+        self.errors = 0
+
+    def element(self, parent, element):
+        if element.tag == "test":
+            if parent.tag == "phase":
+                self.tests.setdefault(parent, []).append(element)
+        elif element.tag == "phase":
+            tests = self.tests.pop(element, [])
+            # Only phases directly in the log are testcases
+            if parent.tag == "log":
+                self.writeTestcase(element, tests)
+        elif parent.tag == "BEAKER_TEST" and element.tag in self.SUITE and element.tag not in self.suite:
+            self.suite[element.tag] = element.text or ""
+
+    def writeTestcase(self, phase, tests):
+        phase_type = phase.get("type")
+        # Serialized inside a testsuite to get the same indentation
+        wrapper = etree.Element("testsuite")
+        testcase = etree.SubElement(wrapper, "testcase")
+        testcase.set("name", phase.get("name", ""))
+        testcase.set("assertions", str(len(tests)))
+        last = None
+        for test in tests:
+            if test.text == "FAIL" and phase_type in ("FAIL", "WARN"):
+                last = etree.SubElement(testcase, "error" if phase_type == "FAIL" else "failure")
+                last.set("message", test.get("message", ""))
+                if phase_type == "FAIL":
+                    self.failures += 1
+                else:
+                    self.errors += 1
+            elif test.text is not None and test.text != "PASS":
+                # Other results are copied by the built-in template as text,
+                # even an empty one turns off indentation of the testcase
+                if last is None:
+                    testcase.text = (testcase.text or "") + test.text
+                else:
+                    last.tail = (last.tail or "") + test.text
+        data = serializeElement(wrapper, pretty_print=True)
+        self.spool.write(data[data.index(b"\n") + 1:data.rindex(b"</testsuite>")])
+        self.testcases += 1
+
+    def finish(self, journal):
+        # Phases of the log which has been lost when closing the journal
+        if journal.find("log") is None:
+            self.spool.truncate(0)
+            self.testcases = self.failures = self.errors = 0
+        suite = etree.Element("testsuite")
+        suite.set("name", self.suite.get("testname", ""))
+        suite.set("tests", str(self.testcases))
+        suite.set("failures", str(self.failures))
+        suite.set("errors", str(self.errors))
+        for tag in ("hostname", "test_id", "package"):
+            suite.set(self.SUITE[tag], self.suite.get(tag, ""))
+        etree.SubElement(suite, "properties")
+        etree.SubElement(suite, "placeholder")
+        data = XML_DECLARATION + serializeElement(suite, pretty_print=True)
+        head, tail = data.split(b"  <placeholder/>\n")
+        try:
+            self.open()
+            self.fh.write(head)
+            import shutil
+            self.spool.seek(0)
+            shutil.copyfileobj(self.spool, self.fh)
+            self.fh.write(tail)
+            self.close()
+            return 0
+        except IOError as e:
+            sys.stderr.write('Failed to save xunit to %s: %s\n' % (self.path, str(e)))
+            return 1
+        finally:
+            self.spool.close()
 
-    # Updating start and end time of last opened paired element(log)
-    starttime, endtime = getStartEndTime(previous_el)
-    addStartEndTime(previous_el, starttime, endtime)
 
-    # Updating start/end time of the whole test
-    starttime, endtime = getStartEndTime(journal)
-    journal.xpath("starttime")[0].text = starttime
-    journal.xpath("endtime")[0].text = endtime
+# Output formats of --output and --format options
+SINKS = {
+    "xml": XMLSink,
+    "xunit": XunitSink,
+    "jsonl": JSONLinesSink,
+    "summary": SummarySink,
+}
 
-    # XSL transformation
+
+# Returns list of sinks given by the options, None if some is not valid.
+# The journal given by --journal, or on the standard output when there is
+# no other output, is written in --format, xml journal is transformed by
+# --xslt template if set.
+def createSinks(options):
+    outputs = [output.partition(':')[::2] for output in options.outputs]
+    for name, path in outputs + [(options.format, None)]:
+        if name not in SINKS:
+            sys.stderr.write("Unknown output format '%s', use one of: %s\n" % (name, ", ".join(sorted(SINKS))))
+            return None
+    if options.compress:
+        if options.compress not in COMPRESSORS:
+            sys.stderr.write("Unknown compression '%s', use one of: %s\n" % (options.compress, ", ".join(sorted(COMPRESSORS))))
+            return None
+        try:
+            __import__(COMPRESSORS[options.compress])
+        except ImportError as e:
+            sys.stderr.write("Compression '%s' is not available: %s\n" % (options.compress, str(e)))
+            return None
+    sinks = []
+    if options.journal or not options.outputs:
+        if options.format == "xml":
+            sinks.append(XMLSink(options.journal or '-', options.xslt))
+        else:
+            sinks.append(SINKS[options.format](options.journal or '-'))
+    for name, path in outputs:
+        sinks.append(SINKS[name](path or '-'))
+    for sink in sinks:
+        sink.compress = options.compress
+    return sinks
+
+
+# Builds the journal out of all the metafile lines at once
+def buildJournal(lines, builder):
+    parser = JournalParser(builder)
+    parser.feed(lines)
+    return parser.finish()
+
+
+# Returns byte offsets of phases in version 2 metafile from its index
+def readPhaseIndex(metafile):
+    try:
+        with open(metafile + METAFILE_INDEX_SUFFIX) as fh:
+            return [int(line) for line in fh]
+    except (IOError, ValueError):
+        return None
+
+
+# Builds the journal of the phase given by --phase option only. Version 2
+# metafile with an index is read only in the header and the phase itself,
+# other metafiles are searched for the phase from the beginning.
+def buildPhaseJournal(options, builder):
     try:
-        if options.xslt:
-            xslt = etree.parse(options.xslt)
-            transform = etree.XSLT(xslt)
-            journal = transform(journal)
-    except etree.LxmlError as e:
-        sys.stderr.write("\nTransformation template file \'" + options.xslt +
-                "\' could not be parsed.\nError: %s\nAborting journal creation.") % (e)
+        fh = open(options.metafile, 'rb')
+    except IOError as e:
+        sys.stderr.write('Failed to open queue file with %s\n' % str(e))
+        return None
+    parser = JournalParser(builder)
+    parser.version = metafileVersion(fh.readline().decode('utf-8', 'replace'))
+    tokenize = tokenizeRecords if parser.version == 2 else tokenizeLines
+    offsets = readPhaseIndex(options.metafile) if parser.version == 2 else None
+    if offsets and options.phase <= len(offsets):
+        lines = chain(MetafileReader(fh, 0, offsets[0]), MetafileReader(fh, offsets[options.phase - 1]))
+        selector = PhaseSelector(tokenize(lines), 0)
+    else:
+        selector = PhaseSelector(tokenize(MetafileReader(fh, 0)), options.phase - 1)
+    parser.feedTokens(selector)
+    fh.close()
+    if not selector.found:
+        sys.stderr.write('Phase %d not found in the metafile\n' % options.phase)
+        return None
+    return parser.finish()
+
+
+# Opens the metafile given by --metafile option or standard input
+def openMetafile(options):
+    if options.metafile:
+        try:
+            return open(options.metafile, 'r')
+        except IOError as e:
+            sys.stderr.write('Failed to open queue file with %s\n' % str(e))
+            return None
+    return sys.stdin
+
+
+# Continues parsing the metafile from the checkpoint left by the previous run
+# and saves the new checkpoint before the journal is finished and written.
+# Only the journal itself can be checkpointed, so no other sinks are allowed.
+def createJournalIncremental(options, sinks):
+    import pickle
+    try:
+        fh = open(options.metafile, 'rb')
+    except IOError as e:
+        sys.stderr.write('Failed to open queue file with %s\n' % str(e))
         return 1
+    checkpoint = Checkpoint(options.metafile)
+    try:
+        checkpoint.lock()
+    except (IOError, OSError) as e:
+        sys.stderr.write('Failed to use checkpoint, processing whole metafile: %s\n' % str(e))
+        journal = buildJournal(MetafileReader(fh, 0), StreamBuilder())
+        fh.close()
+        return writeOutputs(journal, sinks)
+
+    parser, offset = checkpoint.load(fh)
+    reader = MetafileReader(fh, offset)
+    parser.feed(reader)
+    # The final conversion after rlJournalEnd leaves no checkpoint behind
+    final = reader.last is not None and reader.last.rstrip('\n') == END_OF_METAFILE
+    if not final:
+        try:
+            checkpoint.save(fh, parser, reader.offset)
+        except (IOError, OSError, pickle.PicklingError) as e:
+            sys.stderr.write('Failed to save checkpoint: %s\n' % str(e))
+    fh.close()
+    # The journal is written out of the checkpointed spools, so the lock is kept till the end
+    ret = writeOutputs(parser.finish(), sinks)
+    if final:
+        checkpoint.remove()
+    checkpoint.unlock()
+    return ret
+
+
+# Parses the metafile once and fills all the sinks. The journal is streamed
+# unless some sink needs it whole in memory, e.g. for XSL transformation,
+# and it is not built at all when no sink writes it.
+# In streaming mode finished elements are serialized as soon as they are
+# closed so the memory usage depends on the depth of phase nesting only,
+# not on the size of the metafile.
+def createJournal(options, sinks):
+    stream = (options.stream or options.incremental) and not any(sink.tree for sink in sinks)
+    if stream and options.incremental and options.metafile and not options.phase \
+            and all(type(sink) is XMLSink for sink in sinks):
+        return createJournalIncremental(options, sinks)
+
+    for sink in sinks:
+        if sink.start():
+            return 1
+    if not any(isinstance(sink, XMLSink) for sink in sinks):
+        builder = SinkBuilder(sinks)
+    elif stream:
+        builder = StreamBuilder(sinks=sinks)
+    else:
+        builder = TreeBuilder(sinks)
+    if options.phase:
+        journal = buildPhaseJournal(options, builder)
+        if journal is None:
+            return 1
+    else:
+        fh = openMetafile(options)
+        if fh is None:
+            return 1
+        journal = buildJournal(fh, builder)
+        fh.close()
+    return writeOutputs(journal, sinks)
+
+
+# Finishes all the sinks, returns 1 if any of them failed
+def writeOutputs(journal, sinks):
+    ret = 0
+    for sink in sinks:
+        ret = sink.finish(journal) or ret
+    return ret
+
+
+# Options of the batch mode shared by all the metafiles, set in each worker
+batchOptions = None
+
 
-    if options.journal:
-        # Save journal to a file and return its exit code
-        return saveJournal(journal, options.journal)
+def initBatchWorker(options):
+    global batchOptions
+    batchOptions = options
+    loadEtree(bool(options.xslt))
+    if options.xslt:
+        try:
+            xsltTransform(options.xslt)
+        except etree.LxmlError:
+            # Reported for every metafile then
+            pass
+
+
+# Returns options for conversion of one metafile in batch mode, the paths
+# of --journal and --output are relative to the directory of the metafile
+def metafileOptions(options, metafile):
+    import copy
+    directory = os.path.dirname(metafile)
+    file_options = copy.copy(options)
+    file_options.metafile = metafile
+    file_options.journal = os.path.join(directory, options.journal or "journal.xml")
+    file_options.outputs = []
+    for output in options.outputs:
+        name, colon, path = output.partition(':')
+        file_options.outputs.append(name + colon + os.path.join(directory, path))
+    return file_options
+
+
+# Converts one metafile in batch mode. Returns the metafile, its size, exit
+# code and error output, a failure must not stop the whole batch.
+def convertMetafile(metafile):
+    import six
+    stderr = sys.stderr
+    sys.stderr = six.StringIO()
+    try:
+        options = metafileOptions(batchOptions, metafile)
+        sinks = createSinks(options)
+        ret = 1 if sinks is None else createJournal(options, sinks)
+    except SystemExit as e:
+        ret = e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        sys.stderr.write("%s: %s\n" % (type(e).__name__, e))
+        ret = 1
+    finally:
+        errors = sys.stderr.getvalue()
+        sys.stderr = stderr
+    try:
+        size = os.path.getsize(metafile)
+    except OSError:
+        size = 0
+    return metafile, size, ret or 0, errors.strip()
+
+
+# Converts metafiles given by glob patterns and by --files-from option
+# in a pool of worker processes, reports the failed ones and throughput
+def createJournalsBatch(options, patterns):
+    import six
+    import glob
+    import multiprocessing
+    metafiles = []
+    if options.files_from:
+        try:
+            fh = sys.stdin if options.files_from == '-' else open(options.files_from)
+            metafiles.extend(line.strip() for line in fh if line.strip())
+        except IOError as e:
+            sys.stderr.write('Failed to read list of metafiles: %s\n' % str(e))
+            return 1
+    for pattern in patterns:
+        # Nonexistent file is reported as failed
+        metafiles.extend(sorted(glob.glob(pattern)) or [pattern])
+    for output in [options.journal or ''] + [output.partition(':')[2] for output in options.outputs]:
+        if output == '-' or os.path.isabs(output):
+            sys.stderr.write('Outputs in batch mode must be file names relative to the metafiles.\n')
+            return 1
+
+    start = time.time()
+    pool = None
+    if options.jobs == 1:
+        initBatchWorker(options)
+        results = six.moves.map(convertMetafile, metafiles)
     else:
-        # Write the XML on standard output
-        return sys.stdout.write(etree.tostring(journal, xml_declaration=True, encoding='utf-8', pretty_print=True))
+        pool = multiprocessing.Pool(options.jobs or None, initBatchWorker, (options,))
+        results = pool.imap_unordered(convertMetafile, metafiles, 8)
+    converted = 0
+    converted_size = 0
+    for metafile, size, ret, errors in results:
+        if ret:
+            sys.stderr.write('Failed to convert %s: %s\n' % (metafile, " ".join(errors.split()) or "exit code %s" % ret))
+        else:
+            converted += 1
+            converted_size += size
+    if pool is not None:
+        pool.close()
+        pool.join()
+    elapsed = max(time.time() - start, 1e-6)
+    sys.stdout.write("Converted %d of %d metafiles in %.2f s, %.1f metafiles/s, %.2f MB/s, %d failed\n" % (
+        converted, len(metafiles), elapsed, len(metafiles) / elapsed,
+        converted_size / elapsed / 1024 / 1024, len(metafiles) - converted))
+    return 0 if converted == len(metafiles) else 1
 
 
 def main():
     DESCRIPTION = "Tool creating journal out of metafile."
-    usage = __file__ + " --metafile=METAFILE --journal=JOURNAL"
+    usage = __file__ + " --metafile=METAFILE --journal=JOURNAL\n" + \
+        "       " + __file__ + " --batch [--jobs=N] [--files-from=FILE] [METAFILE|PATTERN]..."
     optparser = OptionParser(description=DESCRIPTION, usage=usage)
 
     optparser.add_option("-j", "--journal", default=None, dest="journal", metavar="JOURNAL")
     optparser.add_option("-m", "--metafile", default=None, dest="metafile", metavar="METAFILE")
     optparser.add_option("-x", "--xslt", default=None, dest="xslt", metavar="XSLT")
+    optparser.add_option("-s", "--stream", default=False, action="store_true", dest="stream",
+                         help="serialize finished phases right away to keep memory usage low, "
+                              "not usable together with --xslt")
+    optparser.add_option("-i", "--incremental", default=False, action="store_true", dest="incremental",
+                         help="save parser state next to the metafile and parse only lines appended "
+                              "since the previous run, the state is removed once rlJournalEnd completes the metafile, "
+                              "implies --stream")
+    optparser.add_option("-f", "--format", default="xml", dest="format", metavar="FORMAT",
+                         help="format of the journal, see --output for the formats, default is xml")
+    optparser.add_option("-o", "--output", default=[], action="append", dest="outputs", metavar="FORMAT[:FILE]",
+                         help="write also FORMAT output into FILE or on standard output, can be used "
+                              "repeatedly, the metafile is parsed just once, formats: " + ", ".join(sorted(SINKS)))
+    optparser.add_option("-z", "--compress", default=None, dest="compress", metavar="FORMAT",
+                         help="compress the journal and all the outputs while they are written, "
+                              "formats: " + ", ".join(sorted(COMPRESSORS)))
+    optparser.add_option("-p", "--phase", default=None, type="int", dest="phase", metavar="NUMBER",
+                         help="create journal of the NUMBER-th started phase only, "
+                              "it is found by the index of version 2 metafile")
+
+    optparser.add_option("-b", "--batch", default=False, action="store_true", dest="batch",
+                         help="convert all the metafiles given as arguments or glob patterns in a pool "
+                              "of processes, --journal and --output files are relative to each metafile, "
+                              "the journal is journal.xml by default")
+    optparser.add_option("--files-from", default=None, dest="files_from", metavar="FILE",
+                         help="read metafiles to convert in batch mode from FILE, one per line, "
+                              "'-' for standard input")
+    optparser.add_option("-J", "--jobs", default=0, type="int", dest="jobs", metavar="N",
+                         help="number of worker processes in batch mode, defaults to number of CPUs")
 
     (options, args) = optparser.parse_args()
 
+    if options.batch:
+        return createJournalsBatch(options, args)
+
     # If metafile option is used, check if the value exists
     if options.metafile and not os.path.exists(options.metafile):
         sys.stderr.write("Metafile " + options.metafile + " does not exist.\nExiting unsuccessfully.\n")
         exit(1)
 
+    if options.phase is not None and (not options.metafile or options.phase < 1):
+        sys.stderr.write("Option --phase needs --metafile and a positive phase number.\nExiting unsuccessfully.\n")
+        exit(1)
+
+    sinks = createSinks(options)
+    if sinks is None:
+        exit(1)
+    loadEtree(bool(options.xslt))
+
     # Create journal
-    return createJournalXML(options)
+    return createJournal(options, sinks)
 
 
 if __name__ == "__main__":
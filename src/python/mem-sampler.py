@@ -0,0 +1,586 @@
+#!/usr/bin/env python
+
+# Description: Measures memory consumption of a command and all its descendants
+#
+# Copyright (c) 2026 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# The command is started and its process tree is sampled in regular
+# intervals until the command exits. A sample is the sum of RSS (from
+# /proc/PID/statm) or PSS (from /proc/PID/smaps_rollup) of all the processes
+# in the tree. The proc files are kept open and re-read from the start, so a
+# sample costs a few system calls per process. The sampler becomes a child
+# subreaper, so processes daemonized by the command stay in the tree.
+#
+# With --exact nothing is sampled. The command runs in a transient cgroup v2
+# when the memory controller is available to the cgroup of the sampler, or
+# to the one given by --cgroup, and memory.peak, cpu.stat and io.stat of the
+# cgroup are read once the command exits. Otherwise, the peak is ru_maxrss
+# of the command and its descendants, returned by wait4() when they are
+# reaped, which is the peak of the largest single process. The command
+# inherits the RSS of the sampler by the fork, so a peak not higher than the
+# peak of the sampler itself is only an upper bound and it is reported as
+# such. The sampling is used only when resource usage is not available at all.
+#
+# With --record, CPU usage, IO and thread count of the tree are sampled too
+# and written to a CSV file, see ResourceRecorder.
+#
+# When installed as beakerlib-rlMemAvg or beakerlib-rlMemPeak, the sampler
+# behaves like the former tools of that name and prints just the mean or the
+# peak RSS in kB. The peak is memory.peak of a transient cgroup when one can
+# be used, the sampled one otherwise, never the inflated ru_maxrss.
+
+from __future__ import print_function
+
+try:
+    import os
+    import sys
+    import time
+    import json
+    import errno
+    import subprocess
+    from optparse import OptionParser
+except ImportError as e:
+    sys.stderr.write("Python ImportError: " + str(e) + "\nExiting unsuccessfully.\n")
+    exit(2)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+PAGE_SIZE_KB = os.sysconf("SC_PAGE_SIZE") // 1024
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PR_SET_CHILD_SUBREAPER = 36
+PERCENTILES = [50, 90, 95, 99]
+
+
+def becomeSubreaper():
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) == 0
+    except (ImportError, OSError, AttributeError):
+        return False
+
+
+def exitCode(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def readChildren(pid):
+    children = []
+    try:
+        for task in os.listdir("/proc/%d/task" % pid):
+            with open("/proc/%d/task/%s/children" % (pid, task)) as fh:
+                children.extend(int(child) for child in fh.read().split())
+    except (IOError, OSError):
+        pass
+    return children
+
+
+# Returns the parent of every process, used when the kernel does not provide
+# the children files (CONFIG_PROC_CHILDREN)
+def readParents():
+    parents = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open("/proc/%s/stat" % name) as fh:
+                stat = fh.read()
+        except (IOError, OSError):
+            continue
+        # the command name in parentheses may contain spaces and parentheses
+        parents[int(name)] = int(stat[stat.rindex(")") + 2:].split(None, 2)[1])
+    return parents
+
+
+# The processes of the tree are the root and its descendants. With root None
+# they are the descendants of the sampler, which is a subreaper, so they
+# include the orphans of the command.
+class ProcessTree:
+    def __init__(self, root, pss=False):
+        self.root = root
+        self.pss = pss
+        self.files = {}
+        self.with_children = os.path.exists("/proc/%d/task/%d/children" % (os.getpid(), os.getpid()))
+        self.source = "smaps_rollup" if pss else "statm"
+        if pss and not os.path.exists("/proc/self/smaps_rollup"):
+            self.source = "smaps"
+
+    def pids(self):
+        if self.with_children:
+            pids = [self.root] if self.root else readChildren(os.getpid())
+            for pid in pids:
+                pids.extend(readChildren(pid))
+            return pids
+        children = {}
+        for pid, parent in readParents().items():
+            children.setdefault(parent, []).append(pid)
+        pids = [self.root] if self.root else children.get(os.getpid(), [])
+        for pid in pids:
+            pids.extend(children.get(pid, []))
+        return pids
+
+    # Returns the content of the proc file of the process, None if it cannot
+    # be read, e.g. because the process is gone
+    def readFile(self, pid, name):
+        files = self.files.setdefault(pid, {})
+        fd = files.get(name)
+        try:
+            if fd is None:
+                fd = files[name] = os.open("/proc/%d/%s" % (pid, name), os.O_RDONLY)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+            data = os.read(fd, 65536)
+            if name == "smaps":
+                while True:
+                    chunk = os.read(fd, 65536)
+                    if not chunk:
+                        break
+                    data += chunk
+        except OSError as e:
+            if e.errno not in (errno.ENOENT, errno.ESRCH, errno.EACCES, errno.EINVAL):
+                raise
+            return None
+        return data
+
+    # Returns the memory of the process in kB, None if the process is gone
+    def read(self, pid):
+        data = self.readFile(pid, self.source)
+        if data is None:
+            self.forget(pid)
+            return None
+        if self.source == "statm":
+            fields = data.split(None, 2)
+            return int(fields[1]) * PAGE_SIZE_KB if len(fields) > 1 else 0
+        return sum(int(line.split()[1]) for line in data.splitlines() if line.startswith(b"Pss:"))
+
+    def forget(self, pid):
+        for fd in self.files.pop(pid, {}).values():
+            os.close(fd)
+
+    def sample(self):
+        pids = self.pids()
+        total = 0
+        for pid in pids:
+            memory = self.read(pid)
+            if memory is not None:
+                total += memory
+        for pid in set(self.files) - set(pids):
+            self.forget(pid)
+        return total
+
+    def close(self):
+        for pid in list(self.files):
+            self.forget(pid)
+
+
+# Writes a CSV row of the process tree resources each time it is sampled:
+# the memory in kB, the CPU usage in percents of one CPU since the previous
+# sample, bytes read and written from and to storage since the start, and
+# the number of threads. The CPU time and IO of a process include those of
+# its children it has reaped, so the usage of a process which is gone is
+# added to the totals only when it was reaped by the sampler, see reaped.
+class ResourceRecorder:
+    COLUMNS = ["time", "memory_kb", "cpu_percent", "read_bytes", "write_bytes", "threads"]
+
+    def __init__(self, tree, fh):
+        self.tree = tree
+        self.fh = fh
+        self.start = self.previous_time = time.time()
+        self.processes = {}
+        self.reaped = set()
+        self.exited = [0, 0, 0]
+        self.previous_cpu = 0
+        self.cpu_peak = 0.0
+        self.threads_peak = 0
+        self.totals = [0, 0, 0]
+        fh.write(",".join(self.COLUMNS) + "\n")
+
+    def readProcess(self, pid):
+        stat = self.tree.readFile(pid, "stat")
+        if stat is None:
+            return None
+        # the fields after the command name, which may contain spaces
+        fields = stat[stat.rindex(b")") + 2:].split()
+        usage = [sum(int(field) for field in fields[11:15]), 0, 0]
+        for line in (self.tree.readFile(pid, "io") or b"").splitlines():
+            if line.startswith(b"read_bytes:"):
+                usage[1] = int(line.split()[1])
+            elif line.startswith(b"write_bytes:"):
+                usage[2] = int(line.split()[1])
+        return usage, int(fields[17])
+
+    def sample(self):
+        now = time.time()
+        memory = threads = 0
+        processes = {}
+        for pid in self.tree.pids():
+            process_memory = self.tree.read(pid)
+            process = self.readProcess(pid) if process_memory is not None else None
+            if process is None:
+                continue
+            memory += process_memory
+            processes[pid], process_threads = process
+            threads += process_threads
+        for pid, usage in self.processes.items():
+            if pid not in processes and pid in self.reaped:
+                self.exited = [total + value for total, value in zip(self.exited, usage)]
+        self.reaped.clear()
+        for pid in set(self.tree.files) - set(processes):
+            self.tree.forget(pid)
+        self.processes = processes
+
+        self.totals = list(self.exited)
+        for usage in processes.values():
+            self.totals = [total + value for total, value in zip(self.totals, usage)]
+        cpu = (self.totals[0] - self.previous_cpu) * 100.0 / CLOCK_TICKS / max(now - self.previous_time, 1e-6)
+        self.previous_cpu, self.previous_time = self.totals[0], now
+        self.cpu_peak = max(self.cpu_peak, cpu)
+        self.threads_peak = max(self.threads_peak, threads)
+        self.fh.write("%.3f,%d,%.1f,%d,%d,%d\n" % (now - self.start, memory, cpu, self.totals[1], self.totals[2], threads))
+        return memory
+
+    def summary(self):
+        return {
+            "cpu_mean": self.totals[0] * 100.0 / CLOCK_TICKS / max(self.previous_time - self.start, 1e-6),
+            "cpu_peak": self.cpu_peak,
+            "read_bytes": self.totals[1],
+            "write_bytes": self.totals[2],
+            "threads_peak": self.threads_peak,
+        }
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    position = (len(values) - 1) * p / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+# Runs the command and samples its process tree every interval seconds.
+# Returns the exit code of the command and the list of samples in kB. With
+# recorder, a ResourceRecorder, it records the samples.
+def sampleCommand(command, interval, pss=False, recorder=None):
+    subreaper = becomeSubreaper()
+    task = subprocess.Popen(command)
+    tree = ProcessTree(None if subreaper else task.pid, pss)
+    if recorder is not None:
+        recorder = recorder(tree)
+    sample = recorder.sample if recorder is not None else tree.sample
+    samples = []
+    returncode = None
+    try:
+        while returncode is None:
+            start = time.time()
+            samples.append(sample())
+            # reap the command and the orphans reparented to us
+            while True:
+                try:
+                    pid, status = os.waitpid(-1 if subreaper else task.pid, os.WNOHANG)
+                except OSError as e:
+                    if e.errno != errno.ECHILD:
+                        raise
+                    break
+                if pid == 0:
+                    break
+                if recorder is not None:
+                    recorder.reaped.add(pid)
+                if pid == task.pid:
+                    returncode = task.returncode = exitCode(status)
+            if returncode is None:
+                time.sleep(max(interval - (time.time() - start), 0))
+        if recorder is not None:
+            # the usage of the command is complete only once it is reaped
+            recorder.sample()
+    finally:
+        tree.close()
+    if recorder is not None:
+        return returncode, samples, recorder.summary()
+    return returncode, samples
+
+
+# Returns the directory of the cgroup v2 the sampler is in, None when the
+# unified hierarchy is not mounted
+def currentCgroup():
+    mount = None
+    with open("/proc/self/mountinfo") as fh:
+        for line in fh:
+            fields = line.split()
+            if fields[fields.index("-") + 1] == "cgroup2" and fields[3] == "/":
+                mount = fields[4]
+                break
+    if mount is None:
+        return None
+    with open("/proc/self/cgroup") as fh:
+        for line in fh:
+            if line.startswith("0::"):
+                return mount + line[3:].strip().rstrip("/")
+    return None
+
+
+class TransientCgroup:
+    def __init__(self, parent):
+        self.path = os.path.join(parent, "beakerlib-memsampler-%d" % os.getpid())
+        os.mkdir(self.path)
+
+    # Runs in the forked child before the command is executed, so all the
+    # memory of the command is charged to the cgroup
+    def enter(self):
+        with open(os.path.join(self.path, "cgroup.procs"), "w") as fh:
+            fh.write("0")
+
+    def read(self, name):
+        try:
+            with open(os.path.join(self.path, name)) as fh:
+                return fh.read()
+        except (IOError, OSError):
+            return None
+
+    def stats(self):
+        stats = {}
+        peak = self.read("memory.peak")
+        if peak is not None:
+            stats["peak"] = int(peak) // 1024
+        cpu = dict(line.split() for line in (self.read("cpu.stat") or "").splitlines())
+        if "user_usec" in cpu:
+            stats["user"] = int(cpu["user_usec"]) / 1000000.0
+            stats["system"] = int(cpu["system_usec"]) / 1000000.0
+        io = self.read("io.stat")
+        if io is not None:
+            stats["read_bytes"] = stats["write_bytes"] = 0
+            for line in io.splitlines():
+                for field in line.split()[1:]:
+                    key, value = field.split("=")
+                    if key in ("rbytes", "wbytes"):
+                        stats["read_bytes" if key == "rbytes" else "write_bytes"] += int(value)
+        return stats
+
+    def remove(self):
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            sys.stderr.write("Processes left by the command still run in %s\n" % self.path)
+
+
+def createCgroup(parent):
+    parent = parent or currentCgroup()
+    if parent is None:
+        return None
+    try:
+        with open(os.path.join(parent, "cgroup.subtree_control")) as fh:
+            if "memory" not in fh.read().split():
+                return None
+        cgroup = TransientCgroup(parent)
+    except (IOError, OSError):
+        return None
+    # memory.peak is missing before Linux 5.19
+    if not os.path.exists(os.path.join(cgroup.path, "memory.peak")):
+        cgroup.remove()
+        return None
+    return cgroup
+
+
+def sampleSummary(command, interval):
+    returncode, samples = sampleCommand(command, interval)
+    return returncode, summarize(samples, interval, "rss", PERCENTILES)
+
+
+# Runs the command and waits for it without any polling. Returns the exit
+# code of the command and the summary of its resource usage. The cgroup is
+# used when one can be created in the cgroup directory given by cgroup or in
+# the current one. Without the cgroup, the process tree is sampled in the
+# interval, if given, instead of relying on ru_maxrss.
+def measureCommand(command, cgroup=None, interval=None):
+    cgroup = createCgroup(cgroup) if resource is not None else None
+    if cgroup is None and (interval is not None or resource is None):
+        return sampleSummary(command, interval or 0.01)
+    subreaper = becomeSubreaper()
+    # the highest RSS the command can inherit from the sampler
+    floor = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        task = subprocess.Popen(command, preexec_fn=cgroup.enter if cgroup else None)
+    except (OSError, getattr(subprocess, "SubprocessError", OSError)):
+        if cgroup is None:
+            raise
+        cgroup.remove()
+        if interval is not None:
+            return sampleSummary(command, interval)
+        cgroup = None
+        task = subprocess.Popen(command)
+    returncode = None
+    # only the command and the orphans reparented to us are reaped here, the
+    # usage of the other descendants is included in the usage of their parents
+    usages = []
+    try:
+        while returncode is None:
+            pid, status, usage = os.wait4(-1 if subreaper else task.pid, 0)
+            usages.append(usage)
+            if pid == task.pid:
+                returncode = task.returncode = exitCode(status)
+        # orphans which have already exited
+        while subreaper:
+            try:
+                pid, status, usage = os.wait4(-1, os.WNOHANG)
+            except OSError:
+                break
+            if pid == 0:
+                break
+            usages.append(usage)
+        maxRss = max(usage.ru_maxrss for usage in usages)
+        summary = {
+            "source": "rusage",
+            "metric": "max_rss",
+            "unit": "kB",
+            "peak": maxRss,
+            "max_rss": maxRss,
+            "user": sum(usage.ru_utime for usage in usages),
+            "system": sum(usage.ru_stime for usage in usages),
+            "read_bytes": sum(usage.ru_inblock for usage in usages) * 512,
+            "write_bytes": sum(usage.ru_oublock for usage in usages) * 512,
+        }
+        if maxRss <= floor:
+            summary["bound"] = "upper"
+        if cgroup is not None:
+            stats = cgroup.stats()
+            if "peak" in stats:
+                summary.pop("bound", None)
+                summary.update(source="cgroup", metric="memory.peak")
+            summary.update(stats)
+    finally:
+        if cgroup is not None:
+            cgroup.remove()
+    return returncode, summary
+
+
+def summarize(samples, interval, metric, percentiles):
+    ordered = sorted(samples)
+    return {
+        "source": "sampling",
+        "metric": metric,
+        "unit": "kB",
+        "interval": interval,
+        "samples": len(samples),
+        "peak": ordered[-1] if ordered else 0,
+        "mean": float(sum(samples)) / len(samples) if samples else 0.0,
+        "percentiles": [(p, percentile(ordered, p)) for p in percentiles],
+    }
+
+
+SUMMARY_FORMATS = [("source", "%s"), ("metric", "%s"), ("bound", "%s"), ("samples", "%d"), ("interval", "%g"), ("peak", "%d"),
+                   ("mean", "%d"), ("max_rss", "%d"), ("user", "%.3f"), ("system", "%.3f"),
+                   ("cpu_mean", "%.1f"), ("cpu_peak", "%.1f"), ("read_bytes", "%d"), ("write_bytes", "%d"),
+                   ("threads_peak", "%d")]
+
+
+def printSummary(summary, fh):
+    for key, format in SUMMARY_FORMATS:
+        if key in summary:
+            print(("%s " + format) % (key, summary[key]), file=fh)
+    for p, value in summary.get("percentiles", []):
+        print("p%g %d" % (p, value), file=fh)
+
+
+def main():
+    program = os.path.basename(sys.argv[0])
+    legacy = "mean" if program.endswith("rlMemAvg") else "peak" if program.endswith("rlMemPeak") else None
+    if legacy:
+        if len(sys.argv) < 2:
+            print("syntax: %s <command>" % program)
+            return 1
+        if legacy == "peak":
+            returncode, summary = measureCommand(sys.argv[1:], interval=0.1)
+        else:
+            returncode, samples = sampleCommand(sys.argv[1:], 0.1)
+            summary = summarize(samples, 0.1, "rss", [])
+        print("%d" % summary[legacy])
+        return 0
+
+    usage = "%prog [options] [--] COMMAND [ARG]..."
+    optparser = OptionParser(usage=usage, description="Runs the command and samples memory of its whole "
+                             "process tree. Prints the peak, mean and percentiles of the samples in kB "
+                             "and exits with the exit code of the command.")
+    optparser.disable_interspersed_args()
+    optparser.add_option("-i", "--interval", default=0.01, type="float", dest="interval", metavar="SECONDS",
+                         help="time between samples, default is 0.01")
+    optparser.add_option("--pss", default=False, action="store_true", dest="pss",
+                         help="sample proportional set size instead of resident set size, "
+                              "shared memory is not counted more than once, but the sampling is more expensive")
+    optparser.add_option("-r", "--record", default=None, dest="record", metavar="FILE",
+                         help="write the time series of memory, CPU usage, IO and thread count of the process tree "
+                              "to FILE as CSV and report their summary too")
+    optparser.add_option("-e", "--exact", default=False, action="store_true", dest="exact",
+                         help="do not sample, report the exact peak of the memory charged to a transient cgroup "
+                              "of the command or the peak RSS of its largest process, which is just an upper bound "
+                              "when it does not exceed the RSS of the sampler, with CPU and IO usage")
+    optparser.add_option("--cgroup", default=None, dest="cgroup", metavar="DIR",
+                         help="with --exact, create the transient cgroup in the cgroup v2 directory DIR, "
+                              "default is the cgroup of the sampler")
+    optparser.add_option("-p", "--percentiles", default=",".join(str(p) for p in PERCENTILES), dest="percentiles",
+                         metavar="LIST", help="comma separated percentiles to report, default is %default")
+    optparser.add_option("-f", "--format", default="text", choices=["text", "json"], dest="format",
+                         help="output format, text or json")
+    optparser.add_option("-o", "--output", default=None, dest="output", metavar="FILE",
+                         help="write the report to FILE instead of standard output")
+    (options, args) = optparser.parse_args()
+
+    if not args:
+        optparser.error("command to measure is needed")
+    if options.exact and options.record:
+        optparser.error("--exact does not sample, so it cannot --record")
+    if options.interval <= 0:
+        optparser.error("interval must be positive")
+    try:
+        percentiles = [float(p) for p in options.percentiles.split(",") if p.strip()]
+    except ValueError:
+        optparser.error("percentiles must be numbers")
+    if any(not 0 <= p <= 100 for p in percentiles):
+        optparser.error("percentiles must be between 0 and 100")
+
+    try:
+        if options.exact:
+            returncode, summary = measureCommand(args, options.cgroup)
+        elif options.record:
+            with open(options.record, "w") as fh:
+                returncode, samples, resources = sampleCommand(args, options.interval, options.pss,
+                                                               lambda tree: ResourceRecorder(tree, fh))
+            summary = summarize(samples, options.interval, "pss" if options.pss else "rss", percentiles)
+            summary.update(resources)
+        else:
+            returncode, samples = sampleCommand(args, options.interval, options.pss)
+            summary = summarize(samples, options.interval, "pss" if options.pss else "rss", percentiles)
+    except (IOError, OSError) as e:
+        sys.stderr.write("Failed to run %s: %s\n" % (" ".join(args), e))
+        return 127
+
+    fh = open(options.output, "w") if options.output else sys.stdout
+    if options.format == "json":
+        if "percentiles" in summary:
+            summary["percentiles"] = dict(("p%g" % p, value) for p, value in summary["percentiles"])
+        print(json.dumps(summary, indent=2, sort_keys=True), file=fh)
+    else:
+        printSummary(summary, fh)
+    if options.output:
+        fh.close()
+    return returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
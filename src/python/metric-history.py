@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+
+# Description: Keeps history of metrics logged into journals by rlLogMetric
+#
+# Copyright (c) 2026 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# The history is an SQLite database of runs, one per ingested journal, and
+# of the metrics found in them. A run is identified by the test name, host
+# and start time of the test, so ingesting a journal again, or a copy of it,
+# changes nothing. A journal rewritten later, e.g. by a resumed test,
+# replaces the metrics of its run.
+
+from __future__ import print_function
+
+try:
+    import os
+    import sys
+    import time
+    import json
+    import sqlite3
+    import hashlib
+    import calendar
+    from optparse import OptionParser
+except ImportError as e:
+    sys.stderr.write("Python ImportError: " + str(e) + "\nExiting unsuccessfully.\n")
+    exit(2)
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    test TEXT NOT NULL,
+    hostname TEXT NOT NULL,
+    arch TEXT NOT NULL,
+    starttime INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    journal TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    UNIQUE (test, hostname, starttime)
+);
+CREATE INDEX IF NOT EXISTS runs_test ON runs (test, arch, starttime);
+CREATE TABLE IF NOT EXISTS metrics (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    test TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    name TEXT NOT NULL,
+    arch TEXT NOT NULL,
+    starttime INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    value REAL NOT NULL,
+    tolerance REAL
+);
+CREATE INDEX IF NOT EXISTS metrics_series ON metrics (test, name, phase, arch, starttime);
+CREATE INDEX IF NOT EXISTS metrics_run ON metrics (run);
+"""
+
+# Journal header elements describing the run
+HEADER = {"testname": "test", "hostname": "hostname", "arch": "arch", "starttime": "starttime"}
+RESULTS = ["PASS", "WARN", "FAIL"]
+# Number of ingested journals written in one transaction
+INGEST_BATCH = 500
+# Size of the blocks a journal is read in
+READ_SIZE = 64 * 1024
+
+
+# Journal file computing a digest of its content while it is parsed
+class DigestReader:
+    def __init__(self, fh):
+        self.fh = fh
+        self.digest = hashlib.sha1()
+
+    def read(self, size=READ_SIZE):
+        data = self.fh.read(size)
+        self.digest.update(data)
+        return data
+
+
+# Converts journal time, e.g. "2020-01-01 10:00:00 UTC", to seconds since
+# the epoch. Times in other zones are taken as local time.
+def parseTime(text):
+    parsed = time.strptime(text[:19], "%Y-%m-%d %H:%M:%S")
+    if text[20:] in ("UTC", "GMT"):
+        return calendar.timegm(parsed)
+    return int(time.mktime(parsed))
+
+
+# Returns the run described by the journal and metrics found in it. Metrics
+# belong to the innermost phase around them, the run result is the worst
+# result of its phases. The journal is parsed incrementally and thrown away
+# element by element, the digest of its content is computed on the way.
+def readJournal(path):
+    run = {"test": "unknown", "hostname": "unknown", "arch": "unknown", "starttime": None,
+           "journal": os.path.abspath(path), "result": "PASS", "metrics": []}
+    phases = []
+    elements = []
+    with open(path, 'rb') as fh:
+        reader = DigestReader(fh)
+        for event, element in iterparse(reader, events=("start", "end")):
+            if event == "start":
+                elements.append(element)
+                if element.tag == "phase":
+                    phases.append(element.get("name", ""))
+                continue
+            elements.pop()
+            if element.tag == "phase":
+                phases.pop()
+                result = element.get("result")
+                if result in RESULTS and RESULTS.index(result) > RESULTS.index(run["result"]):
+                    run["result"] = result
+            elif element.tag == "metric" and phases:
+                try:
+                    tolerance = float(element.get("tolerance"))
+                except (TypeError, ValueError):
+                    tolerance = None
+                run["metrics"].append((phases[-1], element.get("name", ""), element.get("type", ""),
+                                       float(element.get("value", element.text or "")), tolerance))
+            elif len(elements) == 1 and element.tag in HEADER:
+                run[HEADER[element.tag]] = (element.text or "").strip()
+            element.clear()
+            if elements:
+                elements[-1].remove(element)
+        # Rest of the file after the root element
+        while reader.read():
+            pass
+    if run["starttime"] is None:
+        raise ValueError("no starttime in the journal")
+    run["starttime"] = parseTime(run["starttime"])
+    run["digest"] = reader.digest.hexdigest()
+    return run
+
+
+# Reads a journal in batch ingestion, errors are returned instead of raised
+# so that a broken journal does not stop the whole batch
+def readJournalSafe(path):
+    try:
+        return path, readJournal(path), None
+    except Exception as e:
+        return path, None, "%s: %s" % (type(e).__name__, e)
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+class History:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    # Stores the run read by readJournal(), returns False when the same
+    # journal has been ingested already
+    def ingest(self, run):
+        db = self.db
+        row = db.execute("SELECT id, digest FROM runs WHERE test = ? AND hostname = ? AND starttime = ?",
+                         (run["test"], run["hostname"], run["starttime"])).fetchone()
+        if row is not None:
+            run_id, digest = row
+            if digest == run["digest"]:
+                return False
+            db.execute("DELETE FROM metrics WHERE run = ?", (run_id,))
+            db.execute("UPDATE runs SET arch = ?, result = ?, journal = ?, digest = ? WHERE id = ?",
+                       (run["arch"], run["result"], run["journal"], run["digest"], run_id))
+        else:
+            run_id = db.execute("INSERT INTO runs (test, hostname, arch, starttime, result, journal, digest) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (run["test"], run["hostname"], run["arch"], run["starttime"], run["result"],
+                                 run["journal"], run["digest"])).lastrowid
+        db.executemany("INSERT INTO metrics (run, test, phase, name, arch, starttime, type, value, tolerance) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       [(run_id, run["test"], phase, name, run["arch"], run["starttime"], type, value, tolerance)
+                        for phase, name, type, value, tolerance in run["metrics"]])
+        return True
+
+    def commit(self):
+        self.db.commit()
+
+    # Returns (starttime, value, rolling median) of the last runs of a metric
+    # in chronological order, the median is taken over the last "window"
+    # values up to the run
+    def trend(self, test, metric, phase=None, arch=None, last=10, window=5):
+        query = "SELECT starttime, value FROM metrics WHERE test = ? AND name = ?"
+        arguments = [test, metric]
+        for column, value in (("phase", phase), ("arch", arch)):
+            if value is not None:
+                query += " AND %s = ?" % column
+                arguments.append(value)
+        query += " ORDER BY starttime DESC LIMIT ?"
+        arguments.append(last + window - 1)
+        rows = self.db.execute(query, arguments).fetchall()[::-1]
+        values = [value for starttime, value in rows]
+        return [(starttime, value, median(values[max(0, i - window + 1):i + 1]))
+                for i, (starttime, value) in enumerate(rows)][-last:]
+
+    # Returns journals of the last passed runs of the test of the candidate
+    # journal on the same architecture, which started before the candidate
+    def baseline(self, candidate, last=5):
+        rows = self.db.execute("SELECT journal FROM runs WHERE test = ? AND arch = ? AND starttime < ? "
+                               "AND result = 'PASS' ORDER BY starttime DESC LIMIT ?",
+                               (candidate["test"], candidate["arch"], candidate["starttime"], last)).fetchall()
+        return [journal for journal, in rows]
+
+
+# Reads journals in a pool of processes and stores them as they come,
+# returns number of failed journals
+def ingestJournals(history, journals, jobs):
+    pool = None
+    if jobs == 1:
+        results = (readJournalSafe(journal) for journal in journals)
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs or None)
+        results = pool.imap_unordered(readJournalSafe, journals, 16)
+    ingested = skipped = failed = 0
+    start = time.time()
+    for path, run, error in results:
+        if run is None:
+            sys.stderr.write("Failed to read %s: %s\n" % (path, error))
+            failed += 1
+        elif history.ingest(run):
+            ingested += 1
+            if ingested % INGEST_BATCH == 0:
+                history.commit()
+        else:
+            skipped += 1
+    history.commit()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    sys.stderr.write("Ingested %d journals, %d already known, %d failed in %.2f s\n" % (
+        ingested, skipped, failed, time.time() - start))
+    return failed
+
+
+def main():
+    usage = "%prog [--database=FILE] ingest [--jobs=N] [--files-from=FILE] [JOURNAL]...\n" + \
+        "       %prog [--database=FILE] trend --test=TEST --metric=NAME [--phase=PHASE] [--arch=ARCH]\n" + \
+        "       %prog [--database=FILE] baseline JOURNAL"
+    optparser = OptionParser(usage=usage, description="Keeps history of metrics found in journals.")
+    optparser.add_option("-d", "--database", default="metric-history.db", dest="database", metavar="FILE",
+                         help="SQLite database holding the history, default is metric-history.db")
+    optparser.add_option("--files-from", default=None, dest="files_from", metavar="FILE",
+                         help="ingest journals listed in FILE, one per line, '-' for standard input")
+    optparser.add_option("-J", "--jobs", default=0, type="int", dest="jobs", metavar="N",
+                         help="number of processes reading journals, defaults to number of CPUs")
+    optparser.add_option("-t", "--test", default=None, dest="test", metavar="TEST",
+                         help="name of the test to show trend of")
+    optparser.add_option("-m", "--metric", default=None, dest="metric", metavar="NAME",
+                         help="name of the metric to show trend of")
+    optparser.add_option("-p", "--phase", default=None, dest="phase", metavar="PHASE",
+                         help="show trend of the metric in the phase only")
+    optparser.add_option("-a", "--arch", default=None, dest="arch", metavar="ARCH",
+                         help="show trend of the metric on the architecture only")
+    optparser.add_option("-n", "--last", default=None, type="int", dest="last", metavar="N",
+                         help="number of runs to show trend of or to use as baseline, "
+                              "default is 10 for trend and 5 for baseline")
+    optparser.add_option("-w", "--window", default=5, type="int", dest="window", metavar="N",
+                         help="number of runs the rolling median is computed of, default is 5")
+    optparser.add_option("-f", "--format", default="text", choices=["text", "json"], dest="format",
+                         help="output format of trend, text or json")
+    (options, args) = optparser.parse_args()
+
+    if not args or args[0] not in ("ingest", "trend", "baseline"):
+        optparser.error("command ingest, trend or baseline is needed")
+    command, args = args[0], args[1:]
+    history = History(options.database)
+
+    if command == "ingest":
+        journals = list(args)
+        if options.files_from:
+            try:
+                fh = sys.stdin if options.files_from == '-' else open(options.files_from)
+                journals.extend(line.strip() for line in fh if line.strip())
+            except IOError as e:
+                sys.stderr.write("Failed to read list of journals: %s\n" % str(e))
+                return 1
+        return 1 if ingestJournals(history, journals, options.jobs) else 0
+
+    if command == "trend":
+        if not options.test or not options.metric:
+            optparser.error("trend needs --test and --metric")
+        trend = history.trend(options.test, options.metric, options.phase, options.arch,
+                              options.last or 10, max(options.window, 1))
+        if options.format == "json":
+            print(json.dumps([{"starttime": starttime, "value": value, "median": rolling}
+                              for starttime, value, rolling in trend], indent=2))
+        else:
+            for starttime, value, rolling in trend:
+                print("%s\t%s\t%s" % (time.strftime("%Y-%m-%d %H:%M:%S %Z", time.localtime(starttime)), value, rolling))
+        return 0
+
+    if len(args) != 1:
+        optparser.error("baseline needs the candidate journal")
+    try:
+        candidate = readJournal(args[0])
+    except (IOError, ValueError, SyntaxError) as e:
+        sys.stderr.write("Failed to read %s: %s\n" % (args[0], e))
+        return 1
+    for journal in history.baseline(candidate, options.last or 5):
+        print(journal)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+
+# Description: Measures how long a command runs or how many times it runs in a time
+#
+# Copyright (c) 2026 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Each run of the command is a bash -c COMMAND process. Its wall time is
+# measured by the monotonic high resolution clock around the start and the
+# wait for the process, its CPU time (user and system, including children
+# it has waited for) comes from the rusage returned by wait4().
+#
+# The time mode runs the command after the warmup runs until it has run
+# --runs times and, with --precision, until the standard error of the mean
+# wall time drops below the given fraction of the mean, at most --max-runs
+# times or --max-time seconds. Runs further than 3 scaled median absolute
+# deviations from the median wall time are rejected as outliers before the
+# statistics are computed, see inliers().
+#
+# The throughput mode (--duration) runs the command over and over for the
+# given time in each of --rounds rounds and counts the runs which finished
+# in the time. With --counts, the rounds are run by the caller, e.g. when
+# the command has to run in the shell of the caller, and only the statistics
+# of the counted runs are computed.
+#
+# The scaling mode (--scaling) runs the command over and over for the given
+# time in several concurrent workers, for each of the concurrency levels. A
+# level is reported with its throughput, latency percentiles and parallel
+# efficiency, which is the throughput relative to the throughput of the
+# first level multiplied by the concurrency ratio. With --pin, the workers
+# are pinned to the CPUs available to the runner, one CPU each, round robin.
+
+from __future__ import print_function
+
+try:
+    import os
+    import sys
+    import math
+    import json
+    import threading
+    import subprocess
+    from optparse import OptionParser
+except ImportError as e:
+    sys.stderr.write("Python ImportError: " + str(e) + "\nExiting unsuccessfully.\n")
+    exit(2)
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from time import time as clock
+
+
+OUTLIER_DEVIATIONS = 3.0
+OUTLIER_FLOOR = 0.01
+
+
+def runOnce(command):
+    start = clock()
+    task = subprocess.Popen(["bash", "-c", command])
+    pid, status, usage = os.wait4(task.pid, 0)
+    wall = clock() - start
+    task.returncode = status
+    return wall, usage.ru_utime + usage.ru_stime, status
+
+
+def median(values):
+    return percentile(sorted(values), 50)
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * p / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def mean(values):
+    return float(sum(values)) / len(values) if values else 0.0
+
+
+def stddev(values):
+    if len(values) < 2:
+        return 0.0
+    average = mean(values)
+    return math.sqrt(sum((value - average) ** 2 for value in values) / (len(values) - 1))
+
+
+# Returns the indexes of the values within OUTLIER_DEVIATIONS of the median,
+# the median absolute deviation is scaled to estimate standard deviation.
+# Differences under OUTLIER_FLOOR of the median are never outliers, as very
+# stable runs have almost zero deviation.
+def inliers(values):
+    if len(values) < 3:
+        return list(range(len(values)))
+    center = median(values)
+    deviation = max(1.4826 * median([abs(value - center) for value in values]), OUTLIER_FLOOR * abs(center))
+    return [i for i, value in enumerate(values) if abs(value - center) <= OUTLIER_DEVIATIONS * deviation]
+
+
+def statistics(prefix, values):
+    ordered = sorted(values)
+    return {
+        prefix + "_min": ordered[0] if ordered else 0.0,
+        prefix + "_median": percentile(ordered, 50),
+        prefix + "_mean": mean(values),
+        prefix + "_p95": percentile(ordered, 95),
+        prefix + "_stddev": stddev(values),
+    }
+
+
+# Returns the summary of the measured runs and the number of failed runs
+def measureTime(command, warmup, runs, max_runs, precision, max_time):
+    for _ in range(warmup):
+        runOnce(command)
+    walls, cpus = [], []
+    failed = 0
+    start = clock()
+    while True:
+        wall, cpu, status = runOnce(command)
+        walls.append(wall)
+        cpus.append(cpu)
+        failed += status != 0
+        if len(walls) < runs:
+            continue
+        if len(walls) >= max_runs or clock() - start >= max_time or not precision:
+            break
+        if stddev(walls) / math.sqrt(len(walls)) <= precision * mean(walls):
+            break
+    kept = inliers(walls)
+    summary = {"runs": len(walls), "rejected": len(walls) - len(kept), "warmup": warmup}
+    summary.update(statistics("wall", [walls[i] for i in kept]))
+    summary.update(statistics("cpu", [cpus[i] for i in kept]))
+    return summary, failed
+
+
+def measureThroughput(command, warmup, duration, rounds):
+    for _ in range(warmup):
+        runOnce(command)
+    counts = []
+    failed = 0
+    for _ in range(rounds):
+        count = 0
+        start = clock()
+        while True:
+            wall, cpu, status = runOnce(command)
+            if clock() - start > duration:
+                break
+            count += 1
+            failed += status != 0
+        counts.append(count)
+    return throughputSummary(counts, duration, warmup), failed
+
+
+def throughputSummary(counts, duration, warmup):
+    summary = {"rounds": len(counts), "duration": duration, "warmup": warmup,
+               "runs_per_second": mean(counts) / duration}
+    summary.update(statistics("runs", counts))
+    return summary
+
+
+# Reads the rounds counted by the caller, a line with the number of runs
+# and the number of failed runs for each round
+def readCounts(path, duration):
+    counts = []
+    failed = 0
+    with open(path) as fh:
+        for line in fh:
+            runs, failures = [int(value) for value in line.split()]
+            counts.append(runs)
+            failed += failures
+    if not counts:
+        raise ValueError("no rounds in %s" % path)
+    return throughputSummary(counts, duration, 0), failed
+
+
+def availableCpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    import multiprocessing
+    return list(range(multiprocessing.cpu_count()))
+
+
+# Powers of two up to the number of available CPUs, and the number itself
+def defaultLevels():
+    cpus = len(availableCpus())
+    levels = [1]
+    while levels[-1] * 2 <= cpus:
+        levels.append(levels[-1] * 2)
+    if levels[-1] != cpus:
+        levels.append(cpus)
+    return levels if len(levels) > 1 else [1, 2]
+
+
+# Runs the command until the deadline, the CPU affinity of the thread is
+# inherited by the commands it starts
+def runWorker(command, deadline, cpu, latencies, failures):
+    if cpu is not None:
+        os.sched_setaffinity(0, [cpu])
+    while True:
+        wall, cpu_time, status = runOnce(command)
+        if clock() > deadline:
+            break
+        latencies.append(wall)
+        if status != 0:
+            failures.append(status)
+
+
+def measureScaling(command, warmup, duration, levels, pin):
+    for _ in range(warmup):
+        runOnce(command)
+    cpus = availableCpus()
+    results = []
+    failed = 0
+    for level in levels:
+        latencies = [[] for _ in range(level)]
+        failures = []
+        deadline = clock() + duration
+        workers = [threading.Thread(target=runWorker, args=(command, deadline, cpus[worker % len(cpus)] if pin else None,
+                                                             latencies[worker], failures))
+                   for worker in range(level)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        ordered = sorted(sum(latencies, []))
+        failed += len(failures)
+        results.append({
+            "level": level,
+            "runs": len(ordered),
+            "throughput": len(ordered) / duration,
+            "latency_p50": percentile(ordered, 50),
+            "latency_p95": percentile(ordered, 95),
+            "latency_p99": percentile(ordered, 99),
+        })
+    base = results[0]
+    for result in results:
+        expected = base["throughput"] * result["level"] / base["level"]
+        result["efficiency"] = result["throughput"] / expected if expected else 0.0
+    return {"duration": duration, "warmup": warmup, "pinned": pin, "levels": results}, failed
+
+
+SUMMARY_FORMATS = [("runs", "%d"), ("rejected", "%d"), ("rounds", "%d"), ("duration", "%g"), ("warmup", "%d"),
+                   ("wall_min", "%.6f"), ("wall_median", "%.6f"), ("wall_mean", "%.6f"), ("wall_p95", "%.6f"),
+                   ("wall_stddev", "%.6f"), ("cpu_min", "%.6f"), ("cpu_median", "%.6f"), ("cpu_mean", "%.6f"),
+                   ("cpu_p95", "%.6f"), ("cpu_stddev", "%.6f"), ("runs_min", "%d"), ("runs_median", "%g"),
+                   ("runs_mean", "%g"), ("runs_p95", "%g"), ("runs_stddev", "%.3f"), ("runs_per_second", "%.3f"),
+                   ("failed", "%d")]
+
+
+LEVEL_FORMATS = [("runs", "%d"), ("throughput", "%.3f"), ("latency_p50", "%.6f"), ("latency_p95", "%.6f"),
+                 ("latency_p99", "%.6f"), ("efficiency", "%.3f")]
+
+
+def printSummary(summary, fh):
+    for key, format in SUMMARY_FORMATS:
+        if key in summary:
+            print(("%s " + format) % (key, summary[key]), file=fh)
+    for level in summary.get("levels", []):
+        print("level %d %s" % (level["level"], " ".join(("%s " + format) % (key, level[key])
+                                                          for key, format in LEVEL_FORMATS)), file=fh)
+
+
+def main():
+    usage = "%prog [options] COMMAND\n" + \
+        "       %prog [options] --duration SECONDS COMMAND\n" + \
+        "       %prog [options] --duration SECONDS --counts FILE\n" + \
+        "       %prog [options] --scaling LEVELS [--pin] [--duration SECONDS] COMMAND"
+    optparser = OptionParser(usage=usage, description="Runs the bash COMMAND repeatedly and reports statistics "
+                             "of its wall and CPU time in seconds, or of the number of runs done in a time.")
+    optparser.add_option("-w", "--warmup", default=1, type="int", dest="warmup", metavar="N",
+                         help="number of runs which are not measured, default is 1")
+    optparser.add_option("-n", "--runs", default=5, type="int", dest="runs", metavar="N",
+                         help="number of measured runs, at least, default is 5")
+    optparser.add_option("--precision", default=0, type="float", dest="precision", metavar="FRACTION",
+                         help="run the command until the standard error of the mean wall time is at most "
+                              "FRACTION of the mean, e.g. 0.01, default is to run it --runs times only")
+    optparser.add_option("--max-runs", default=1000, type="int", dest="max_runs", metavar="N",
+                         help="maximum number of runs with --precision, default is 1000")
+    optparser.add_option("--max-time", default=300, type="float", dest="max_time", metavar="SECONDS",
+                         help="maximum time of the runs with --precision, default is 300")
+    optparser.add_option("-d", "--duration", default=None, type="float", dest="duration", metavar="SECONDS",
+                         help="count the runs done in SECONDS instead of measuring the time of the runs")
+    optparser.add_option("-r", "--rounds", default=3, type="int", dest="rounds", metavar="N",
+                         help="number of rounds the runs are counted in with --duration, default is 3")
+    optparser.add_option("-c", "--counts", default=None, dest="counts", metavar="FILE",
+                         help="with --duration, do not run any command, report the statistics of the runs counted "
+                              "by the caller in FILE, a line with the number of runs and failed runs per round")
+    optparser.add_option("-s", "--scaling", default=None, dest="scaling", metavar="LEVELS",
+                         help="run the command in as many concurrent workers as each of the comma separated LEVELS "
+                              "for --duration (10 by default) seconds, 'auto' for powers of two up to the CPU count")
+    optparser.add_option("--pin", default=False, action="store_true", dest="pin",
+                         help="pin each of the concurrent workers to one of the CPUs")
+    optparser.add_option("-f", "--format", default="text", choices=["text", "json"], dest="format",
+                         help="output format, text or json")
+    optparser.add_option("-o", "--output", default=None, dest="output", metavar="FILE",
+                         help="write the report to FILE instead of standard output")
+    (options, args) = optparser.parse_args()
+
+    if options.counts is not None:
+        if options.duration is None or options.scaling:
+            optparser.error("--counts is for --duration only")
+        if args:
+            optparser.error("no command is run with --counts")
+    elif len(args) != 1:
+        optparser.error("one command to run is needed")
+    if options.warmup < 0 or options.runs < 1 or options.rounds < 1:
+        optparser.error("number of runs and rounds must be positive")
+    if options.duration is not None and options.duration <= 0:
+        optparser.error("duration must be positive")
+    if options.scaling:
+        try:
+            levels = defaultLevels() if options.scaling == "auto" else [int(level) for level in options.scaling.split(",")]
+        except ValueError:
+            optparser.error("concurrency levels must be numbers")
+        if any(level < 1 for level in levels):
+            optparser.error("concurrency levels must be positive")
+        if options.pin and not hasattr(os, "sched_setaffinity"):
+            optparser.error("pinning workers to CPUs is not supported by this python")
+    elif options.pin:
+        optparser.error("--pin is for --scaling only")
+
+    if options.counts is not None:
+        try:
+            summary, failed = readCounts(options.counts, options.duration)
+        except (IOError, OSError, ValueError) as e:
+            sys.stderr.write("Failed to read the counted runs: %s\n" % e)
+            return 2
+    else:
+        try:
+            if options.scaling:
+                summary, failed = measureScaling(args[0], options.warmup, options.duration or 10, levels, options.pin)
+            elif options.duration is not None:
+                summary, failed = measureThroughput(args[0], options.warmup, options.duration, options.rounds)
+            else:
+                summary, failed = measureTime(args[0], options.warmup, options.runs, max(options.max_runs, options.runs),
+                                              options.precision, options.max_time)
+        except OSError as e:
+            sys.stderr.write("Failed to run bash: %s\n" % e)
+            return 2
+    summary["failed"] = failed
+
+    fh = open(options.output, "w") if options.output else sys.stdout
+    if options.format == "json":
+        print(json.dumps(summary, indent=2, sort_keys=True), file=fh)
+    else:
+        printSummary(summary, fh)
+    if options.output:
+        fh.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
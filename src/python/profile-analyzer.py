@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+# Description: Analyzes the beakerlib profile recorded with BEAKERLIB_PROFILING
+#
+# Copyright (c) 2026 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# The profile is written by the DEBUG trap set up in profiling.sh, one line
+# before each executed command:
+#
+#     TIMESTAMP|SOURCE(LINE)|FUNCTION CALLER ... main|COMMAND
+#
+# The time until the next line is the time spent in the command, it is
+# charged to the line and to the innermost function (self time) and to all
+# the functions on the stack (cumulative time). The lines the functions on
+# the stack were called from are tracked as the stack grows and shrinks, so
+# that the cumulative time of a line includes the time of the functions it
+# called. A function call is counted when a new function appears on the top
+# of the stack with its own name as the command.
+#
+# The profile is read in one pass. Only the time and the number of the
+# executions are kept for each distinct combination of the line, the stack
+# and the lines on the stack, so the memory used depends on the size of the
+# profiled code, not on the size of the profile. The per function, per line
+# and folded stack (for flamegraph.pl and compatible tools) results are
+# computed from these at the end. Times are kept in integer microseconds.
+
+from __future__ import print_function
+
+try:
+    import sys
+    from optparse import OptionParser
+except ImportError as e:
+    sys.stderr.write("Python ImportError: " + str(e) + "\nExiting unsuccessfully.\n")
+    exit(2)
+
+
+DEFAULT_PROFILE = "/dev/shm/beakerlib_profile"
+UNKNOWN = b"?"
+
+
+def parseTime(timestamp):
+    seconds, dot, fraction = timestamp.partition(b".")
+    return int(seconds) * 1000000 + int((fraction + b"000000")[:6])
+
+
+class Profile:
+    def __init__(self):
+        # (context, line, stack) -> [microseconds, executions]
+        self.entries = {}
+        # function -> calls
+        self.calls = {}
+        # stack as in the profile -> (functions from main, innermost function)
+        self.stacks = {}
+        # lines the functions on the stack were called from -> context
+        self.contexts = {}
+        self.contextLines = []
+        self.read = 0
+        self.skipped = 0
+
+    def context(self, lines):
+        context = self.contexts.get(lines)
+        if context is None:
+            context = self.contexts[lines] = len(self.contextLines)
+            self.contextLines.append(lines)
+        return context
+
+    def parseStack(self, stack):
+        frames = tuple(reversed(stack.split()))
+        if not frames:
+            return None
+        return frames, frames[-1]
+
+    def feed(self, stream):
+        entries = self.entries
+        stacks = self.stacks
+        frames = ()
+        lines = []
+        previousStack = None
+        previousKey = None
+        previousTime = None
+        context = top = None
+        for line in stream:
+            self.read += 1
+            fields = line.split(b"|", 3)
+            if len(fields) != 4:
+                self.skipped += 1
+                continue
+            timestamp, source, stack, command = fields
+            try:
+                now = parseTime(timestamp)
+            except ValueError:
+                self.skipped += 1
+                continue
+
+            if stack != previousStack:
+                parsed = stacks.get(stack)
+                if parsed is None:
+                    parsed = stacks[stack] = self.parseStack(stack)
+                if parsed is None:
+                    self.skipped += 1
+                    continue
+                newFrames, top = parsed
+                common = 0
+                limit = min(len(frames), len(newFrames))
+                while common < limit and frames[common] == newFrames[common]:
+                    common += 1
+                # the functions kept on the stack keep their current lines,
+                # which are the lines the new functions were called from
+                del lines[common:]
+                lines.extend([UNKNOWN] * (len(newFrames) - common))
+                frames = newFrames
+                context = self.context(tuple(lines[:-1]))
+                if len(newFrames) > common and command.rstrip(b"\n").split(b"\\ ", 1)[0] == top:
+                    self.calls[top] = self.calls.get(top, 0) + 1
+                previousStack = stack
+            lines[-1] = source
+
+            if previousKey is not None:
+                elapsed = max(now - previousTime, 0)
+                entry = entries.get(previousKey)
+                if entry is None:
+                    entries[previousKey] = [elapsed, 1]
+                else:
+                    entry[0] += elapsed
+                    entry[1] += 1
+            previousKey = (context, source, stack)
+            previousTime = now
+
+        # the last command, its time is unknown
+        if previousKey is not None:
+            entries.setdefault(previousKey, [0, 0])[1] += 1
+
+    def total(self):
+        return sum(elapsed for elapsed, executions in self.entries.values())
+
+    # [(function, calls, self, cumulative)]
+    def functions(self):
+        selfTime = {}
+        cumulative = {}
+        for (context, source, stack), (elapsed, executions) in self.entries.items():
+            frames, top = self.stacks[stack]
+            selfTime[top] = selfTime.get(top, 0) + elapsed
+            for function in set(frames):
+                cumulative[function] = cumulative.get(function, 0) + elapsed
+        # functions already running when the profile starts (main) were called once
+        return [(function, max(self.calls.get(function, 0), 1), selfTime.get(function, 0), cumulative[function])
+                for function in cumulative]
+
+    # [(line, executions, self, cumulative)]
+    def lines(self):
+        selfTime = {}
+        executed = {}
+        cumulative = {}
+        for (context, source, stack), (elapsed, executions) in self.entries.items():
+            selfTime[source] = selfTime.get(source, 0) + elapsed
+            executed[source] = executed.get(source, 0) + executions
+            for line in set(self.contextLines[context] + (source,)):
+                if line != UNKNOWN:
+                    cumulative[line] = cumulative.get(line, 0) + elapsed
+        return [(line, executed.get(line, 0), selfTime.get(line, 0), cumulative[line]) for line in cumulative]
+
+    # {"main;function;...": self microseconds}
+    def folded(self):
+        folded = {}
+        for (context, source, stack), (elapsed, executions) in self.entries.items():
+            key = b";".join(self.stacks[stack][0])
+            folded[key] = folded.get(key, 0) + elapsed
+        return folded
+
+
+def text(name):
+    return name.decode("utf-8", "replace")
+
+
+def seconds(microseconds):
+    return "%.6f" % (microseconds / 1000000.0)
+
+
+def percent(part, total):
+    return "%5.1f%%" % (100.0 * part / total if total else 0.0)
+
+
+def bySelfTime(rows):
+    return sorted(rows, key=lambda row: (-row[2], row[0]))
+
+
+def writeFunctions(out, functions):
+    out.write("function,hits,spent,total spent,total cummulative spent\n")
+    for function, calls, selfTime, cumulative in bySelfTime(functions):
+        out.write("%s,%d,%.6f,%s,%s\n" % (text(function), calls, selfTime / 1000000.0 / calls,
+                                         seconds(selfTime), seconds(cumulative)))
+
+
+def writeLines(out, lines):
+    out.write("line,hits,self,cumulative\n")
+    for line, executions, selfTime, cumulative in bySelfTime(lines):
+        out.write("%s,%d,%s,%s\n" % (text(line), executions, seconds(selfTime), seconds(cumulative)))
+
+
+def writeFolded(out, folded):
+    for stack, elapsed in sorted(folded.items()):
+        if elapsed:
+            out.write("%s %d\n" % (text(stack), elapsed))
+
+
+def writeReport(out, profile, functions, lines, top):
+    total = profile.total()
+    out.write("Total time %s s in %d profile lines (%d skipped)\n" % (seconds(total), profile.read, profile.skipped))
+    out.write("\nTop %d functions by self time:\n" % top)
+    out.write("%12s %6s %12s %6s %8s  %s\n" % ("self", "", "cumulative", "", "calls", "function"))
+    for function, calls, selfTime, cumulative in bySelfTime(functions)[:top]:
+        out.write("%12s %6s %12s %6s %8d  %s\n" % (seconds(selfTime), percent(selfTime, total), seconds(cumulative),
+                                                 percent(cumulative, total), calls, text(function)))
+    out.write("\nTop %d lines by self time:\n" % top)
+    out.write("%12s %6s %12s %6s %8s  %s\n" % ("self", "", "cumulative", "", "hits", "line"))
+    for line, executions, selfTime, cumulative in bySelfTime(lines)[:top]:
+        out.write("%12s %6s %12s %6s %8d  %s\n" % (seconds(selfTime), percent(selfTime, total), seconds(cumulative),
+                                                 percent(cumulative, total), executions, text(line)))
+
+
+def openOutput(name):
+    return sys.stdout if name == "-" else open(name, "w")
+
+
+def main():
+    usage = "usage: %prog [options] [PROFILE]"
+    optparser = OptionParser(usage=usage, description="Analyzes the beakerlib profile recorded with "
+                             "BEAKERLIB_PROFILING (%s by default, '-' for standard input) and reports "
+                             "the functions and lines the most time is spent in." % DEFAULT_PROFILE)
+    optparser.add_option("-n", "--top", default=20, type="int", dest="top", metavar="N",
+                         help="number of functions and lines in the report, 0 for no report, default is 20")
+    optparser.add_option("-o", "--output", default="-", dest="output", metavar="FILE",
+                         help="write the report to FILE instead of standard output")
+    optparser.add_option("--functions", default=None, dest="functions", metavar="FILE",
+                         help="write calls, self and cumulative time of each function as CSV to FILE")
+    optparser.add_option("--lines", default=None, dest="lines", metavar="FILE",
+                         help="write executions, self and cumulative time of each line as CSV to FILE")
+    optparser.add_option("--folded", default=None, dest="folded", metavar="FILE",
+                         help="write folded stacks with their self time in microseconds to FILE, "
+                              "the input format of flamegraph.pl")
+    (options, args) = optparser.parse_args()
+
+    if len(args) > 1:
+        optparser.error("one profile at most is expected")
+    if options.top < 0:
+        optparser.error("number of functions and lines must not be negative")
+
+    name = args[0] if args else DEFAULT_PROFILE
+    profile = Profile()
+    try:
+        if name == "-":
+            profile.feed(getattr(sys.stdin, "buffer", sys.stdin))
+        else:
+            with open(name, "rb", 1024 * 1024) as stream:
+                profile.feed(stream)
+    except (IOError, OSError) as e:
+        sys.stderr.write("Cannot read the profile: %s\n" % e)
+        return 2
+
+    functions = profile.functions()
+    lines = profile.lines() if options.lines or options.top else []
+    outputs = [(options.functions, lambda out: writeFunctions(out, functions)),
+               (options.lines, lambda out: writeLines(out, lines)),
+               (options.folded, lambda out: writeFolded(out, profile.folded()))]
+    if options.top:
+        outputs.append((options.output, lambda out: writeReport(out, profile, functions, lines, options.top)))
+    for output, write in outputs:
+        if output is None:
+            continue
+        out = openOutput(output)
+        try:
+            write(out)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -29,29 +29,44 @@
 # - hook LWD when run from Beaker
 #   - this hook will send SIGHUP to the watcher on LWD expire and block
 #     until the watcher process exits
-# - set up SIGHUP handling, which
-#   - sends SIGKILL to test if running
-#   - sets up SIGALRM handler for EWD and schedules alarm(2)
-#     - EWD handler SIGKILLs cleanup (if running)
+# - set up a single event loop, which dispatches signals, child exits
+#   and timers (see EVENT LOOP below)
+# - on SIGHUP
+#   - send SIGKILL to test if running
+#   - schedule an EWD timer in ewd_maxsecs seconds
+#     - EWD timer SIGKILLs cleanup (if running)
 # - run test
-#   - if it finishes in time, do nothing (unset pid)
-#   - if INT is received while it is running, SIGKILL the test, unset pid
+#   - if it finishes in time, do nothing
+#   - if INT is received while it is running, SIGKILL the test
 # - execute possible cleanup
-#   - if it still finishes in time (no HUP so far), do nothing (unset pid)
-#   - if INT is received while it is running, SIGKILL cleanup, unset pid
+#   - if it still finishes in time (no HUP so far), do nothing
+#   - if INT is received while it is running, SIGKILL cleanup
 # - exit cleanly
 #
 # Some considerations taken into account / tested:
 #
 # - SIGHUP is received while running cleanup (TestTime expired after test exit)
-#   - testpid is already 0, only SIGALRM (cleanup kill) is scheduled, giving
-#     the cleanup another ewd_maxsecs seconds to finish
+#   - test is already finished, only the EWD timer (cleanup kill) is scheduled,
+#     giving the cleanup another ewd_maxsecs seconds to finish
 # - SIGTERM is received at any time
 #   - the only reasonable case is system reboot/poweroff, which we cannot
 #     delay anyway (to allow cleanup execution), so just exit (SIG_DFL)
 #     - this doesn't really damage anything, the test can be easily re-run and
 #       continue creating the cleanup, if the previous cleanup state was saved
 #       and the test sends the cleanup path to the watcher again
+#
+# parallel mode (--parallel N LISTFILE)
+#
+# - every line of LISTFILE is one test, an executable with arguments,
+#   executed in the directory it resides in (like runtest.sh in Beaker)
+# - each test is a separate job with its own cleanup path file,
+#   BEAKERLIB_DIR and output log under the --output directory,
+#   the test/cleanup pair of each job behaves as described above
+# - at most N jobs run at once, longest first according to durations
+#   recorded in the --history file (tests never seen before go first,
+#   as nothing is known about them)
+# - SIGHUP / SIGINT apply to all running jobs and no further jobs are
+#   started, the EWD timer applies to cleanups of all jobs
 
 
 from __future__ import print_function
@@ -60,6 +75,14 @@ import sys
 import signal
 import errno
 import tempfile
+import heapq
+import itertools
+import selectors
+import time
+import json
+import re
+import shlex
+from optparse import OptionParser
 
 
 ### CONFIG
@@ -73,16 +96,23 @@ if 'TESTWATCHER_EWD_SECS' in os.environ:
 else:
     ewd_maxsecs = 1500
 
+# hang detection, kill the test if it neither writes any output nor consumes
+# any CPU time for this many seconds (disabled by default, configurable
+# via env or --hang-timeout)
+hang_secs = 0
+if 'TESTWATCHER_HANG_SECS' in os.environ:
+    hang_secs = float(os.environ['TESTWATCHER_HANG_SECS'])
+    if hang_secs <= 0:
+        raise Exception("invalid TESTWATCHER_HANG_SECS env var value")
+
+# cgroup v2 containment and accounting, run the test and its cleanup in
+# a dedicated cgroup subtree created in this parent cgroup directory
+# ('auto' for the cgroup of the watcher, disabled by default, configurable
+# via env or --cgroup)
+cgroup_parent = os.environ.get('TESTWATCHER_CGROUP')
+
 # beah LWD hook
 lwd_guard_file = '/usr/share/rhts/hooks/watchdog/testwatcher-cleanup-guard'
-
-# file descriptor and file path (name) used for cleanup filename transfer
-# via temporary file from test to watcher, the watcher expects the test
-# to write path to cleanup executable into it, it's checked just before
-# cleanup execution
-clfd, clpath = tempfile.mkstemp(prefix='testwatcher-', dir='/var/tmp') # no-reboot
-# env var containing the path, so the test can write to it
-os.environ['TESTWATCHER_CLPATH'] = clpath
 #
 ###
 
@@ -90,8 +120,11 @@ os.environ['TESTWATCHER_CLPATH'] = clpath
 #
 selfname = os.path.basename(__file__)
 
-testpid = 0
-cleanuppid = 0
+# event loop and job scheduler, created in MAIN
+loop = None
+scheduler = None
+
+lwd_expired = False
 
 if os.environ.get('TASKID'):
     beah = True
@@ -126,6 +159,276 @@ def sigpgkill_safe(pid):
 def beah_warn(part):
     # python "subprocess" not on RHEL4
     os.system(f"rhts-report-result \"TESTWATCHER ({part})\" WARN /dev/null")
+
+
+# fields of /proc/pid/stat following comm, None if pid is gone
+def proc_stat(pid):
+    try:
+        with open(f"/proc/{pid}/stat", 'r') as f:
+            stat = f.read()
+    except (IOError, OSError):
+        return None
+    # comm may contain spaces and parentheses
+    return stat[stat.rindex(')') + 2:].split()
+
+
+def group_processes(pgid):
+    procs = []
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        fields = proc_stat(pid)
+        if fields and int(fields[2]) == pgid:
+            procs.append((int(pid), fields))
+    return procs
+
+
+def exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+#
+###
+
+### EVENT LOOP
+#
+# all control flow of the watcher happens here, in one place:
+# - signals only write their number to a non-blocking wakeup pipe
+#   (signal.set_wakeup_fd), the python-level handler does nothing and
+#   the real action is dispatched from the loop, so no watcher state is
+#   ever modified asynchronously
+# - child exit is signalled by a pidfd becoming readable (Linux 5.3+),
+#   falling back to SIGCHLD + non-blocking waitpid where pidfd_open is
+#   not available
+# - timers are kept in a heap of monotonic deadlines, the nearest one
+#   bounds the select() timeout, so there is no polling and no alarm(2)
+def signal_noop(signum, frame):
+    pass
+
+
+class EventLoop(object):
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.timers = []
+        self.sequence = itertools.count()
+        self.signals = {}
+        self.children = {}
+
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(self.wakeup_w, False)
+        signal.set_wakeup_fd(self.wakeup_w)
+        self.add_reader(self.wakeup_r, self.read_signals)
+
+        self.use_pidfd = self.probe_pidfd()
+        if not self.use_pidfd:
+            self.add_signal(signal.SIGCHLD, self.reap_children)
+
+    @staticmethod
+    def probe_pidfd():
+        if not hasattr(os, 'pidfd_open'):
+            return False
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+        except OSError:
+            # ENOSYS on kernels older than 5.3
+            return False
+        return True
+
+    def add_reader(self, fd, callback):
+        self.selector.register(fd, selectors.EVENT_READ, callback)
+
+    def remove_reader(self, fd):
+        self.selector.unregister(fd)
+
+    # run callback() in delay seconds, returns a handle for cancel()
+    def call_later(self, delay, callback):
+        timer = [time.monotonic() + delay, next(self.sequence), callback]
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def cancel(self, timer):
+        timer[2] = None
+
+    # run callback(signum) from the loop whenever signum is received
+    def add_signal(self, signum, callback):
+        self.signals[signum] = callback
+        signal.signal(signum, signal_noop)
+
+    def read_signals(self):
+        try:
+            data = os.read(self.wakeup_r, 512)
+        except BlockingIOError:
+            return
+        for signum in bytearray(data):
+            callback = self.signals.get(signum)
+            if callback:
+                callback(signum)
+
+    # run callback(status) from the loop once pid exits, reaping it
+    def watch_child(self, pid, callback):
+        self.children[pid] = callback
+        if self.use_pidfd:
+            pidfd = os.pidfd_open(pid)
+            self.add_reader(pidfd, lambda: self.pidfd_ready(pid, pidfd))
+        else:
+            # the child may have exited before we started watching it
+            self.reap_children()
+
+    def pidfd_ready(self, pid, pidfd):
+        if not self.reap(pid):
+            return
+        self.remove_reader(pidfd)
+        os.close(pidfd)
+
+    def reap_children(self, signum=None):
+        for pid in list(self.children):
+            self.reap(pid)
+
+    def reap(self, pid):
+        try:
+            wpid, status = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            # safety measure, shouldn't happen
+            wpid, status = pid, 0
+        if wpid == 0:
+            return False
+        callback = self.children.pop(pid)
+        callback(status)
+        return True
+
+    def run_once(self):
+        while self.timers and self.timers[0][2] is None:
+            heapq.heappop(self.timers)
+        timeout = None
+        if self.timers:
+            timeout = max(0, self.timers[0][0] - time.monotonic())
+
+        for key, mask in self.selector.select(timeout):
+            key.data()
+
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            callback = heapq.heappop(self.timers)[2]
+            if callback:
+                callback()
+
+    def run_until(self, done):
+        while not done():
+            self.run_once()
+
+
+# a test or cleanup executable, run as its own process group leader,
+# on_exit(watched) is called from the loop once it exits
+class Watched(object):
+    def __init__(self, name, argv, on_exit, env=None, cwd=None, output=None,
+                 on_output=None, cgroup=None):
+        self.name = name
+        self.argv = argv
+        self.on_exit = on_exit
+        self.env = env
+        self.cwd = cwd
+        self.output = output
+        self.cgroup = cgroup
+        # if set, stdout/stderr are passed through the loop via pipes and
+        # on_output() is called whenever the watched process writes anything
+        self.on_output = on_output
+        self.pipes = {}
+        self.pid = 0
+        self.status = None
+        self.interrupted = False
+
+    def spawn(self, prefix=''):
+        # NOTE: the signal wakeup fd must be detached in the child, so that
+        # signals received before execvp don't show up in the watcher's loop
+        if self.on_output:
+            self.pipes = {1: os.pipe(), 2: os.pipe()}
+        self.pid = os.fork()
+        if self.pid == 0:
+            signal.set_wakeup_fd(-1)
+            # become process group leader, so we can kill all related
+            # processes (from the parent) when interrupted
+            os.setpgrp()
+            # processes escaping the process group are still in the cgroup
+            if self.cgroup:
+                try:
+                    self.cgroup.enter()
+                except OSError as e:
+                    print(f"TESTWATCHER: cannot enter cgroup {self.cgroup.path}: {e}",
+                          file=sys.stderr)
+            if self.cwd:
+                os.chdir(self.cwd)
+            if self.output:
+                fd = os.open(self.output, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                os.dup2(fd, 1)
+                os.dup2(fd, 2)
+                os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+            for target, (pipe_r, pipe_w) in self.pipes.items():
+                os.dup2(pipe_w, target)
+            debug(f"executing {self.name} at {self.argv}")
+            try:
+                os.execvpe(self.argv[0], self.argv, self.env or os.environ)
+            except OSError as e:
+                print(f"TESTWATCHER: cannot execute {self.name}: {e}",
+                      file=sys.stderr)
+            os._exit(127)
+
+        for target, (pipe_r, pipe_w) in self.pipes.items():
+            os.close(pipe_w)
+            if self.output:
+                target = os.open(self.output, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            loop.add_reader(pipe_r, lambda r=pipe_r, w=target: self.forward(r, w))
+
+        debug(f"{prefix}parent waiting for {self.name} {self.pid}")
+        loop.watch_child(self.pid, self.exited)
+
+    # pass output of the watched process to where it would have gone,
+    # until all its writers (possibly background processes) close the pipe
+    def forward(self, pipe_r, target):
+        data = os.read(pipe_r, 65536)
+        if not data:
+            loop.remove_reader(pipe_r)
+            os.close(pipe_r)
+            if target > 2:
+                os.close(target)
+            return
+        try:
+            while data:
+                data = data[os.write(target, data):]
+        except OSError:
+            # nobody reads watcher output anymore, the activity still counts
+            pass
+        self.on_output()
+
+    def exited(self, status):
+        self.status = status
+        self.on_exit(self)
+
+    def running(self):
+        return self.pid != 0 and self.status is None
+
+    def kill(self):
+        if self.running():
+            sigpgkill_safe(self.pid)
+        if self.cgroup:
+            self.cgroup.kill()
+
+    # processes of the watched process (group) as (pid, /proc/pid/stat fields)
+    def processes(self):
+        if self.cgroup:
+            procs = ((pid, proc_stat(pid)) for pid in self.cgroup.pids())
+            return [(pid, fields) for pid, fields in procs if fields]
+        return group_processes(self.pid)
+
+    # CPU time in seconds consumed by the watched process (group),
+    # including its already finished children
+    def cpu_time(self):
+        if self.cgroup:
+            usage = self.cgroup.cpu_stat().get('usage_usec')
+            if usage is not None:
+                return usage / 1000000.0
+        ticks = sum(sum(int(x) for x in fields[11:15]) for pid, fields in self.processes())
+        return ticks / float(os.sysconf('SC_CLK_TCK'))
 #
 ###
 
@@ -162,165 +465,610 @@ def beah_lwd_hook():
 
 
 # called when EWD (external watchdog) is about to expire
-def beah_ewd_action(signum, frame):
+def beah_ewd_action():
     debug('beah EWD is about to strike')
-    global cleanuppid
-    if cleanuppid != 0:
-        sigpgkill_safe(cleanuppid)
+    for job in scheduler.running:
+        job.ewd()
     if beah:
         beah_warn('external watchdog')
 
 
 # called when LWD expires
-def beah_lwd_action(signum, frame):
+def beah_lwd_action(signum):
+    global lwd_expired
+    # ignore future HUP
+    if lwd_expired:
+        return
+    lwd_expired = True
     debug('beah LWD expired')
-    global testpid
-    signal.signal(signal.SIGHUP, signal.SIG_IGN)
-    if testpid != 0:
-        sigpgkill_safe(testpid)
-        testpid = 0
-    signal.signal(signal.SIGALRM, beah_ewd_action)
-    signal.alarm(ewd_maxsecs)
+    scheduler.stop()
+    for job in scheduler.running:
+        job.lwd()
+    loop.call_later(ewd_maxsecs, beah_ewd_action)
     if beah:
         beah_warn('local watchdog')
 #
 ###
 
 
-### CLEANUP WATCHER
+### CGROUP CONTAINMENT
 #
-# executed by INT sent to the test watcher process
-def cleanup_interrupt(signum, frame):
-    debug('cleanup interrupted')
-    global cleanuppid
+# each job gets its own subtree <parent>/testwatcher-<pid>-<n> with the test
+# and cleanup cgroups in it, children escaping the process group via setsid
+# or double-fork still belong to them, so they can be reliably killed when
+# the test/cleanup is killed and when the job finishes, cgroup accounting
+# of the test is logged and passed to the cleanup via TESTWATCHER_RESOURCES
+# (the beakerlib generated cleanup records it in the journal)
+cgroup_ids = itertools.count(1)
 
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-    if cleanuppid != 0:
-        sigpgkill_safe(cleanuppid)
+def current_cgroup():
+    mount = None
+    with open('/proc/self/mountinfo', 'r') as f:
+        for line in f:
+            fields = line.split()
+            if fields[fields.index('-') + 1] == 'cgroup2' and fields[3] == '/':
+                mount = fields[4]
+                break
+    if mount is None:
+        return None
+    with open('/proc/self/cgroup', 'r') as f:
+        for line in f:
+            if line.startswith('0::'):
+                return mount + line[3:].strip().rstrip('/')
+    return None
 
-    if beah:
-        beah_warn('cleanup interrupt')
 
+class Cgroup(object):
+    def __init__(self, path, create=True):
+        self.path = path
+        if create:
+            os.mkdir(path)
 
-def exec_cleanup():
-    global cleanuppid
+    def read(self, name):
+        try:
+            with open(os.path.join(self.path, name), 'r') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
 
-    # no os.SEEK_SET on RHEL4
-    with open(clpath, 'r') as f:
-        filename = f.readline().strip()
+    def write(self, name, value):
+        with open(os.path.join(self.path, name), 'w') as f:
+            f.write(value)
 
-    # no cleanup
-    if not filename:
-        debug('no cleanup set')
-        return
+    # delegate available controllers to the child cgroups, so that memory
+    # and io get accounted, cpu.stat is available even without them
+    def enable_controllers(self):
+        for controller in (self.read('cgroup.controllers') or '').split():
+            try:
+                self.write('cgroup.subtree_control', f"+{controller}")
+            except OSError as e:
+                debug(f"cannot enable {controller} controller in {self.path}: {e}")
 
-    if not os.path.isfile(filename) or not os.access(filename, os.X_OK):
-        debug('cleanup file not found / not executable, skipping')
-        return
+    def child(self, name):
+        return Cgroup(os.path.join(self.path, name))
+
+    # runs in the forked child before executing the test/cleanup
+    def enter(self):
+        self.write('cgroup.procs', '0')
+
+    def pids(self):
+        return [int(pid) for pid in (self.read('cgroup.procs') or '').split()]
+
+    def kill(self):
+        try:
+            # Linux 5.14+
+            self.write('cgroup.kill', '1')
+            return
+        except OSError:
+            pass
+        # new processes may be forked while killing the old ones
+        for attempt in range(10):
+            pids = self.pids()
+            if not pids:
+                break
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
 
-    signal.signal(signal.SIGINT, cleanup_interrupt)
+    def cpu_stat(self):
+        return dict((key, int(value)) for key, value in
+                    (line.split() for line in (self.read('cpu.stat') or '').splitlines()))
 
-    cleanuppid = os.fork()
-    if cleanuppid == 0:
-        os.setpgrp()
-        debug(f"executing cleanup at {filename}")
-        os.execvp(filename, [filename])
-    else:
-        debug(f"parent waiting for cleanup {cleanuppid}")
-        while cleanuppid != 0:
+    # resources consumed by all processes ever run in the cgroup
+    def stats(self):
+        stats = {}
+        cpu = self.cpu_stat()
+        if 'usage_usec' in cpu:
+            stats['cpu_time'] = cpu['usage_usec'] / 1000000.0
+            stats['cpu_user'] = cpu['user_usec'] / 1000000.0
+            stats['cpu_system'] = cpu['system_usec'] / 1000000.0
+        peak = self.read('memory.peak')
+        if peak is not None:
+            stats['memory_peak'] = int(peak) // 1024
+        io = self.read('io.stat')
+        if io is not None:
+            stats['read_bytes'] = stats['write_bytes'] = 0
+            for line in io.splitlines():
+                for field in line.split()[1:]:
+                    key, value = field.split('=')
+                    if key == 'rbytes':
+                        stats['read_bytes'] += int(value)
+                    elif key == 'wbytes':
+                        stats['write_bytes'] += int(value)
+        return stats
+
+    # killed processes disappear asynchronously, rmdir fails until then
+    def remove(self):
+        for attempt in range(20):
             try:
-                os.waitpid(cleanuppid, 0)
-                cleanuppid = 0
+                os.rmdir(self.path)
+                return True
             except OSError as e:
-                if e.errno == errno.EINTR:
-                    pass
-                if e.errno == errno.ECHILD:
-                    cleanuppid = 0
+                if e.errno != errno.EBUSY:
+                    return False
+            time.sleep(0.05)
+        return False
+
+
+# controllers can be delegated to the job cgroups only when the parent has
+# no processes of its own (except the root cgroup, which has no cgroup.type),
+# the watcher is there with --cgroup auto, so it moves into a leaf first
+def delegate_controllers(path):
+    parent = Cgroup(path, create=False)
+    if os.getpid() in parent.pids() and parent.read('cgroup.type') is not None:
+        leaf = os.path.join(path, 'testwatcher')
+        try:
+            if not os.path.isdir(leaf):
+                os.mkdir(leaf)
+            Cgroup(leaf, create=False).enter()
+        except OSError as e:
+            debug(f"cannot move the watcher to {leaf}: {e}")
+    parent.enable_controllers()
+
+
+def format_stats(stats):
+    return ' '.join(f"{key} {value}" for key, value in sorted(stats.items()))
 #
 ###
 
+### HANG DETECTION
+#
+# a test is considered hung when none of its processes writes anything
+# to stdout/stderr and none of them consumes any CPU time for hang_secs,
+# it is then killed (after dumping state of its processes into the logs)
+# and its cleanup is executed as usual
+def read_proc(pid, name):
+    try:
+        with open(f"/proc/{pid}/{name}", 'r') as f:
+            return f.read().replace('\0', ' ').strip()
+    except (IOError, OSError):
+        return '(unavailable)'
+
+
+def processes_dump(procs):
+    lines = []
+    for pid, fields in procs:
+        lines.append(f"pid {pid} ppid {fields[1]} state {fields[0]} "
+                     f"wchan {read_proc(pid, 'wchan')}: {read_proc(pid, 'cmdline')}")
+        lines.append(f"  syscall: {read_proc(pid, 'syscall')}")
+        # kernel stacks are readable by root only
+        for frame in read_proc(pid, 'stack').splitlines():
+            lines.append(f"  {frame}")
+    return lines
+
 
-### TEST WATCHER
+class HangDetector(object):
+    def __init__(self, job, timeout):
+        self.job = job
+        self.timeout = timeout
+        # check often enough to react well within the timeout,
+        # yet cheaply for long timeouts
+        self.interval = min(timeout / 10.0, 5.0)
+        self.last_activity = None
+        self.cpu_time = None
+        self.timer = None
+
+    def start(self):
+        self.last_activity = time.monotonic()
+        self.timer = loop.call_later(self.interval, self.check)
+
+    def stop(self):
+        if self.timer:
+            loop.cancel(self.timer)
+            self.timer = None
+
+    def activity(self):
+        self.last_activity = time.monotonic()
+
+    def check(self):
+        self.timer = None
+        test = self.job.test
+        if not test.running():
+            return
+        cpu_time = test.cpu_time()
+        if cpu_time != self.cpu_time:
+            self.cpu_time = cpu_time
+            self.activity()
+        idle = time.monotonic() - self.last_activity
+        if idle >= self.timeout:
+            self.job.hang(idle)
+            return
+        self.timer = loop.call_later(min(self.interval, self.timeout - idle), self.check)
 #
-# executed by INT sent to the test watcher process
-def test_interrupt(signum, frame):
-    debug('test interrupted')
-    global testpid
+###
 
-    # ignore future INT
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-    # kill frozen test + its process group
-    if testpid != 0:
-        sigpgkill_safe(testpid)
+### TEST / CLEANUP WATCHER
+#
+# one test and its cleanup, driven by the event loop:
+# test exits -> cleanup (if set up) is executed -> on_finish(job)
+class Job(object):
+    def __init__(self, name, argv, env=None, cwd=None, output=None, prefix=''):
+        self.name = name
+        self.argv = argv
+        self.cwd = cwd
+        self.output = output
+        self.prefix = prefix
+        self.env = dict(os.environ if env is None else env)
+        self.on_finish = None
 
-    # log warn
-    if beah:
-        beah_warn('test interrupt')
-
-
-def exec_test():
-    # NOTE: signal handling can be set up before fork, it won't make it
-    # past execve/execvp and it's safer this way
-    # (the child can be killed via SIGINT received right after pid is available
-    #  to the parent, ie. right after fork)
-
-    # beaker LWD
-    signal.signal(signal.SIGHUP, beah_lwd_action)
-    # user interrupt
-    signal.signal(signal.SIGINT, test_interrupt)
-
-    # fork and exec the test, wait for it in the parent process
-    global testpid
-    testpid = os.fork()
-    if testpid == 0:
-        # become process group leader, so we can kill all related
-        # processes (from the parent) when interrupted
-        os.setpgrp()
-
-        debug(f"executing test at {sys.argv[1:]}")
-        os.execvp(sys.argv[1], sys.argv[1:])
-
-    else:
-        debug(f"parent waiting for test {testpid}")
-        while testpid != 0:
+        self.test = None
+        self.cleanup = None
+        self.current = None
+        self.detector = None
+        self.hung = False
+        self.cgroup = None
+        self.resources = None
+        self.started = None
+        self.duration = None
+
+    def debug(self, msg):
+        debug(self.prefix + msg)
+
+    def spawn(self, name, argv, on_exit, on_output=None):
+        cgroup = None
+        if self.cgroup:
             try:
-                # wait for entire process group
-                os.waitpid(testpid, 0)
-                testpid = 0
+                cgroup = self.cgroup.child(name)
             except OSError as e:
-                # no traceback if interrupted by a signal
-                if e.errno == errno.EINTR:
-                    pass
-                # safety measure, shouldn't happen
-                if e.errno == errno.ECHILD:
-                    testpid = 0
+                self.debug(f"cannot create {name} cgroup: {e}")
+        self.current = Watched(name, argv, on_exit, self.env, self.cwd, self.output,
+                               on_output, cgroup)
+        self.current.spawn(self.prefix)
+        return self.current
+
+    def start(self):
+        # file descriptor and file path (name) used for cleanup filename
+        # transfer via temporary file from test to watcher, the watcher
+        # expects the test to write path to cleanup executable into it,
+        # it's checked just before cleanup execution
+        self.clfd, self.clpath = tempfile.mkstemp(prefix='testwatcher-', dir='/var/tmp') # no-reboot
+        # env var containing the path, so the test can write to it
+        self.env['TESTWATCHER_CLPATH'] = self.clpath
+
+        if cgroup_parent:
+            self.start_cgroup()
+
+        self.started = time.monotonic()
+        if hang_secs:
+            self.detector = HangDetector(self, hang_secs)
+            self.test = self.spawn('test', self.argv, self.test_exited,
+                                   self.detector.activity)
+            self.detector.start()
+        else:
+            self.test = self.spawn('test', self.argv, self.test_exited)
+
+    def start_cgroup(self):
+        try:
+            self.cgroup = Cgroup(os.path.join(cgroup_parent,
+                                              f"testwatcher-{os.getpid()}-{next(cgroup_ids)}"))
+        except OSError as e:
+            self.debug(f"cannot create cgroup in {cgroup_parent}: {e}, not using cgroups")
+            return
+        self.cgroup.enable_controllers()
+        # file the test accounting is passed to the cleanup in
+        self.resfd, self.respath = tempfile.mkstemp(prefix='testwatcher-resources-', dir='/var/tmp') # no-reboot
+        self.env['TESTWATCHER_RESOURCES'] = self.respath
+
+    def test_exited(self, watched):
+        if self.detector:
+            self.detector.stop()
+        self.debug('parent done waiting for test')
+        if self.test.cgroup:
+            self.resources = self.test.cgroup.stats()
+            self.debug(f"test resources: {format_stats(self.resources)}")
+            with open(self.respath, 'w') as f:
+                f.writelines(f"{key} {value}\n" for key, value in sorted(self.resources.items()))
+        self.exec_cleanup()
+
+    def exec_cleanup(self):
+        # no os.SEEK_SET on RHEL4
+        with open(self.clpath, 'r') as f:
+            filename = f.readline().strip()
+
+        # no cleanup
+        if not filename:
+            self.debug('no cleanup set')
+            self.finish()
+            return
+
+        if not os.path.isfile(filename) or not os.access(filename, os.X_OK):
+            self.debug('cleanup file not found / not executable, skipping')
+            self.finish()
+            return
+
+        self.cleanup = self.spawn('cleanup', [filename], self.cleanup_exited)
+
+    def cleanup_exited(self, watched):
+        self.debug('parent done waiting for cleanup')
+        self.finish()
+
+    def finish(self):
+        self.current = None
+        self.duration = time.monotonic() - self.started
+        # remove temporary (mkstemp'ed) file # no-reboot
+        os.close(self.clfd)
+        try:
+            os.remove(self.clpath)
+        except OSError:
+            pass
+        if self.cgroup:
+            self.finish_cgroup()
+        self.on_finish(self)
+
+    # nothing started by the test/cleanup outlives the job
+    def finish_cgroup(self):
+        for watched in (self.test, self.cleanup):
+            if watched is None or watched.cgroup is None:
+                continue
+            left = watched.cgroup.pids()
+            if left:
+                self.debug(f"killing {len(left)} processes left by {watched.name}: {left}")
+                watched.cgroup.kill()
+            if not watched.cgroup.remove():
+                self.debug(f"cannot remove cgroup {watched.cgroup.path}")
+        self.cgroup.remove()
+        os.close(self.resfd)
+        try:
+            os.remove(self.respath)
+        except OSError:
+            pass
+
+    # executed by INT sent to the test watcher process
+    def interrupt(self):
+        current = self.current
+        # ignore future INT for the same test / cleanup
+        if current is None or current.interrupted:
+            return
+        current.interrupted = True
+        self.debug(f"{current.name} interrupted")
+
+        # kill frozen test / cleanup + its process group (and cgroup)
+        current.kill()
+
+        # log warn
+        if beah:
+            beah_warn(f"{current.name} interrupt")
+
+    # called by the hang detector
+    def hang(self, idle):
+        self.hung = True
+        self.debug(f"test hung, no output and no CPU time for {idle:.1f}s, "
+                   "killing it, state of its processes:")
+        lines = processes_dump(self.test.processes())
+        for line in lines:
+            self.debug(f"  {line}")
+        if self.output:
+            with open(self.output, 'a') as f:
+                f.write("TESTWATCHER: test hung, state of its processes:\n")
+                f.writelines(f"TESTWATCHER:   {line}\n" for line in lines)
+        self.test.kill()
+        if beah:
+            beah_warn('test hang')
+
+    def lwd(self):
+        if self.test is not None:
+            self.test.kill()
+
+    def ewd(self):
+        if self.cleanup is not None:
+            self.cleanup.kill()
+
+    # whether the test ran to its end, so its duration is meaningful
+    def completed(self):
+        return self.test.status is not None and not self.test.interrupted \
+            and not self.hung and not lwd_expired
+
+
+# runs jobs, at most `workers` of them at once, longest first
+# according to the durations recorded in the history file
+class Scheduler(object):
+    def __init__(self, jobs, workers=1, history=None):
+        self.workers = workers
+        self.history = history
+        self.durations = {}
+        if history and os.path.exists(history):
+            try:
+                with open(history, 'r') as f:
+                    self.durations = json.load(f)
+            except (OSError, ValueError) as e:
+                debug(f"ignoring unreadable history {history}: {e}")
+            if not isinstance(self.durations, dict):
+                debug(f"ignoring history {history}, not a JSON object")
+                self.durations = {}
+        self.pending = sorted(jobs, key=self.expected, reverse=True)
+        self.running = []
+        self.stopped = False
+        for job in jobs:
+            job.on_finish = self.finished
+
+    def expected(self, job):
+        return self.durations.get(job.name, float('inf'))
+
+    def fill(self):
+        while not self.stopped and self.pending and len(self.running) < self.workers:
+            job = self.pending.pop(0)
+            self.running.append(job)
+            job.start()
+
+    def finished(self, job):
+        self.running.remove(job)
+        if self.history and job.completed():
+            self.durations[job.name] = round(job.duration, 3)
+            self.save()
+        self.fill()
+
+    def save(self):
+        tmp = f"{self.history}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.durations, f, indent=1, sort_keys=True)
+        os.rename(tmp, self.history)
+
+    # do not start any more jobs
+    def stop(self):
+        self.stopped = True
+
+    def done(self):
+        return not self.running and (self.stopped or not self.pending)
+
+
+# executed by INT sent to the test watcher process
+def user_interrupt(signum):
+    scheduler.stop()
+    for job in scheduler.running:
+        job.interrupt()
+#
+###
+
+
+### PARALLEL MODE
+#
+def read_tests(listfile):
+    tests = []
+    try:
+        f = sys.stdin if listfile == '-' else open(listfile, 'r')
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                tests.append(line)
+    except (OSError, UnicodeDecodeError) as e:
+        fatal(f"cannot read test list {listfile}: {e}")
+    if f is not sys.stdin:
+        f.close()
+    return tests
+
+
+def parallel_jobs(tests, outdir):
+    # all the tests are checked before anything is created in outdir
+    commands = []
+    for index, line in enumerate(tests, 1):
+        try:
+            argv = shlex.split(line)
+        except ValueError as e:
+            fatal(f"cannot parse test '{line}': {e}")
+        slug = re.sub(r'[^A-Za-z0-9._-]+', '_', line).strip('._')[:60]
+        jobdir = os.path.join(outdir, f"{index:03d}-{slug}")
+        # beakerlib would continue the journal of a previous run
+        if os.path.exists(jobdir):
+            fatal(f"{jobdir} exists, --output {outdir} already has results of a previous run")
+        commands.append((line, argv, jobdir))
+    jobs = []
+    for line, argv, jobdir in commands:
+        cwd = None
+        if os.sep in argv[0]:
+            argv[0] = os.path.abspath(argv[0])
+            cwd = os.path.dirname(argv[0])
+        os.makedirs(os.path.join(jobdir, 'beakerlib'))
+        env = dict(os.environ, BEAKERLIB_DIR=os.path.join(jobdir, 'beakerlib'))
+        jobs.append(Job(line, argv, env, cwd, os.path.join(jobdir, 'output.log'),
+                        prefix=f"{line}: "))
+    return jobs
 #
 ###
 
 
 ### MAIN
 #
+usage = f"""usage: {selfname} [--hang-timeout SECS] [--cgroup DIR] <command> [args]
+       {selfname} --parallel N [--history FILE] [--output DIR]
+                  [--hang-timeout SECS] [--cgroup DIR] LISTFILE..."""
+optparser = OptionParser(usage=usage, description="Runs the test command, or tests "
+                         "listed in LISTFILEs (one per line, '-' for stdin), and "
+                         "their cleanups under the watch of Beaker watchdogs.")
+optparser.disable_interspersed_args()
+optparser.add_option("-p", "--parallel", default=0, type="int", dest="parallel", metavar="N",
+                     help="run the listed tests, at most N at once")
+optparser.add_option("--history", default=None, dest="history", metavar="FILE",
+                     help="JSON file with recorded test durations, used for scheduling "
+                     "the longest tests first and updated after each test")
+optparser.add_option("--output", default=None, dest="output", metavar="DIR",
+                     help="directory for per-test BEAKERLIB_DIR and output.log, results "
+                     "of a previous run there are not overwritten (new directory in "
+                     "/var/tmp by default)")
+optparser.add_option("--hang-timeout", default=hang_secs, type="float", dest="hang_timeout",
+                     metavar="SECS", help="kill a test which neither writes any output nor "
+                     "consumes any CPU time for SECS seconds, its stdout/stderr are "
+                     "passed through the watcher then (default: $TESTWATCHER_HANG_SECS "
+                     "or disabled)")
+optparser.add_option("--cgroup", default=cgroup_parent, dest="cgroup", metavar="DIR",
+                     help="run each test and its cleanup in a new cgroup v2 subtree of DIR "
+                     "('auto' for the watcher's own cgroup), kill everything left there "
+                     "and report the test's resource usage (default: $TESTWATCHER_CGROUP "
+                     "or disabled)")
+(options, args) = optparser.parse_args()
+
 # sanity check
-if len(sys.argv) < 2:
-    fatal(f"usage: {selfname} <command> [args]")
+if len(args) < 1:
+    fatal(usage)
+if options.parallel < 0:
+    fatal("--parallel needs a positive number of tests")
+if options.hang_timeout < 0:
+    fatal("--hang-timeout needs a positive number of seconds")
+hang_secs = options.hang_timeout
+cgroup_parent = options.cgroup
+if cgroup_parent == 'auto':
+    cgroup_parent = current_cgroup()
+    if cgroup_parent is None:
+        debug('no cgroup v2 hierarchy found, not using cgroups')
+if cgroup_parent:
+    delegate_controllers(cgroup_parent)
 
 if beah:
     beah_lwd_hook()
 
-exec_test()
-debug('parent done waiting for test')
+if options.parallel:
+    tests = [test for listfile in args for test in read_tests(listfile)]
+    # absolute, tests are executed in their own directories
+    outdir = os.path.abspath(options.output or tempfile.mkdtemp(prefix='testwatcher-', dir='/var/tmp')) # no-reboot
+    jobs = parallel_jobs(tests, outdir)
+    debug(f"running {len(jobs)} tests, {options.parallel} at once, output in {outdir}")
+else:
+    jobs = [Job(' '.join(args), args)]
+
+# NOTE: signal handling is set up before fork, signals received right after
+# the pid is available are queued in the wakeup pipe and handled by the loop
+loop = EventLoop()
+# beaker LWD
+loop.add_signal(signal.SIGHUP, beah_lwd_action)
+# user interrupt
+loop.add_signal(signal.SIGINT, user_interrupt)
 
-exec_cleanup()
-debug('parent done waiting for cleanup')
+scheduler = Scheduler(jobs, max(options.parallel, 1), options.history)
+scheduler.fill()
+loop.run_until(scheduler.done)
 
-# remove temporary (mkstemp'ed) file # no-reboot
-os.close(clfd)
-try:
-    os.remove(clpath)
-except OSError:
-    pass
+if options.parallel:
+    for job in jobs:
+        if job.test is None:
+            debug(f"{job.name}: not started")
+            continue
+        debug(f"{job.name}: test exit code {exit_code(job.test.status)}, "
+              f"{job.duration:.1f}s, log {job.output}")
+        if job.resources:
+            debug(f"{job.name}: test resources: {format_stats(job.resources)}")
 
 debug('all done, finishing watcher')
 sys.exit(0)
@@ -0,0 +1,54 @@
+#!/usr/bin/bash
+#
+# Measures how the metafile to journal conversion time grows with the number
+# of records. Metafiles are generated in two shapes:
+#   wide   - phases with ten asserts each, all of them next to each other
+#   nested - every phase contains ten asserts and the next phase
+# The time per record should stay about the same as the record count grows.
+#
+# usage: ./benchmark-journalling.sh [journalling options]
+#   e.g. ./benchmark-journalling.sh --stream
+
+JOURNALIST="${JOURNALIST:-$PWD/../python/journalling.py}"
+METAFILE=$( mktemp ) # no-reboot
+JOURNAL=$( mktemp ) # no-reboot
+export TIMEFORMAT="%R"
+
+# $1 - shape, $2 - number of asserts
+generate() {
+  awk -v shape="$1" -v count="$2" 'BEGIN {
+    print "starttime --timestamp=1500000000"
+    print "endtime --timestamp=1500000000"
+    print "log --timestamp=1500000000"
+    depth = 1
+    for (i = 0; i < count; i++) {
+      if (i % 10 == 0) {
+        if (shape == "wide" && i > 0)
+          printf " --timestamp=%d --result=UEFTUw== --score=MA==\n", 1500000000 + i
+        indent = sprintf("%*s", depth, "")
+        printf "%sphase --timestamp=%d --name=cGhhc2U= --type=RkFJTA==\n", indent, 1500000000 + i
+        if (shape == "nested") depth++
+        indent = sprintf("%*s", shape == "wide" ? 2 : depth, "")
+      }
+      printf "%stest --timestamp=%d --message=bWVzc2FnZQ== -- UEFTUw==\n", indent, 1500000000 + i
+    }
+    if (shape == "wide") depth = 2
+    while (depth > 1) {
+      depth--
+      printf "%*s--timestamp=%d --result=UEFTUw== --score=MA==\n", depth, "", 1500000000 + count
+    }
+  }' > "$METAFILE"
+}
+
+for shape in wide nested
+do
+  for count in 1000 2000 4000 8000 16000
+  do
+    generate $shape $count
+    elapsed=$( { time "$JOURNALIST" "$@" --metafile "$METAFILE" --journal "$JOURNAL"; } 2>&1 )
+    printf "%-6s %6d records: %6s seconds, %s us per record\n" $shape $count $elapsed \
+      $( awk -v t="$elapsed" -v c="$count" 'BEGIN { printf "%.1f", t * 1000000 / c }' )
+  done
+done
+
+rm -f "$METAFILE" "$JOURNAL"
@@ -0,0 +1,48 @@
+#!/usr/bin/bash
+#
+# Measures how long journalling.py takes to convert the metafile of a short
+# test, which is what happens on every rlJournalEnd and rlJournalPrint. The
+# time is dominated by the interpreter start and module imports. The bare
+# interpreter start is measured too, for comparison.
+#
+# usage: ./benchmark-startup.sh [number of runs]
+
+JOURNALIST="${JOURNALIST:-$PWD/../python/journalling.py}"
+XSLT="${XSLT:-$PWD/../xslt-templates/xunit.xsl}"
+RUNS="${1:-20}"
+WORKDIR=$( mktemp -d ) # no-reboot
+METAFILE="$WORKDIR/journal.meta"
+
+awk 'BEGIN {
+  print "starttime --timestamp=1500000000"
+  print "endtime --timestamp=1500000000"
+  print "log --timestamp=1500000000"
+  for (i = 0; i < 3; i++) {
+    print " phase --timestamp=1500000000 --name=cGhhc2U= --type=RkFJTA=="
+    for (j = 0; j < 5; j++)
+      print "  test --timestamp=1500000000 --message=bWVzc2FnZQ== -- UEFTUw=="
+    print " --timestamp=1500000001 --result=UEFTUw== --score=MA=="
+  }
+}' > "$METAFILE"
+
+# $1 - description, rest - command to run
+measure() {
+  local description="$1" start end
+  shift
+  start=$( date +%s%N )
+  for (( i = 0; i < RUNS; i++ ))
+  do
+    "$@" > /dev/null
+  done
+  end=$( date +%s%N )
+  printf "%-26s %6.1f ms per run\n" "$description:" \
+    $( awk -v t=$(( end - start )) -v r="$RUNS" 'BEGIN { printf "%.1f", t / r / 1000000 }' )
+}
+
+measure "python interpreter" python -c pass
+measure "journal" python "$JOURNALIST" --metafile "$METAFILE" --journal "$WORKDIR/journal.xml"
+measure "incremental journal" python "$JOURNALIST" --incremental --metafile "$METAFILE" --journal "$WORKDIR/journal.xml"
+measure "xunit journal" python "$JOURNALIST" --format xunit --metafile "$METAFILE" --journal "$WORKDIR/journal.xunit"
+measure "xslt transformed journal" python "$JOURNALIST" --xslt "$XSLT" --metafile "$METAFILE" --journal "$WORKDIR/journal.xunit"
+
+rm -rf "$WORKDIR"
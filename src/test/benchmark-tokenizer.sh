@@ -0,0 +1,70 @@
+#!/usr/bin/bash
+#
+# Compares the speed of the metafile tokenizers in journalling.py, the line
+# by line parseLine() and the batched tokenizeLines(), and reports how many
+# metafile lines per second each of them handles. The generated metafile
+# resembles a real one: phases full of asserts and log messages, most of
+# them logged within the same second.
+#
+# usage: ./benchmark-tokenizer.sh [number of lines]
+
+PYTHON_DIR="${PYTHON_DIR:-$PWD/../python}"
+
+python - "${1:-100000}" "$PYTHON_DIR" <<'EOF'
+import sys
+import time
+import base64
+
+sys.path.insert(0, sys.argv[2])
+import journalling
+
+
+def b64(text):
+    return base64.b64encode(text.encode('utf8')).decode('ascii')
+
+
+def generate(count):
+    lines = ["starttime --timestamp=1500000000", "endtime --timestamp=1500000000",
+             "log --timestamp=1500000000"]
+    for i in range(count - 3):
+        timestamp = 1500000000 + i // 50
+        if i % 100 == 0:
+            lines.append(" phase --timestamp=%d --name=%s --type=%s" % (timestamp, b64("phase %d" % i), b64("FAIL")))
+        elif i % 100 == 99:
+            lines.append(" --timestamp=%d --result=%s --score=%s" % (timestamp, b64("PASS"), b64("0")))
+        elif i % 2:
+            lines.append("  test --timestamp=%d --message=%s -- %s" % (timestamp, b64("Command 'true' (Expected 0, got 0)"), b64("PASS")))
+        else:
+            lines.append("  message --timestamp=%d --severity=%s -- %s" % (timestamp, b64("LOG"), b64("step %d of the test ščř" % i)))
+    return [line + "\n" for line in lines]
+
+
+# parseLine() leaves base64 decoded values as bytes, they are turned into
+# text by createElement(), so this is done here too to compare the same work
+def parseLines(lines):
+    for indent, element, attributes, content in journalling.parseLines(lines):
+        for key, value in attributes.items():
+            if isinstance(value, bytes):
+                attributes[key] = value.decode('utf8', 'replace').translate(journalling.xmlTrans)
+        if isinstance(content, bytes):
+            content = content.decode('utf8', 'replace').translate(journalling.xmlTrans)
+        yield indent, element, attributes, content
+
+
+def measure(tokenize, lines):
+    best = None
+    for _ in range(3):
+        start = time.time()
+        for _ in tokenize(lines):
+            pass
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(lines) / best
+
+
+lines = generate(int(sys.argv[1]))
+legacy = measure(parseLines, lines)
+batched = measure(journalling.tokenizeLines, lines)
+print("parseLine:     %10.0f lines per second" % legacy)
+print("tokenizeLines: %10.0f lines per second, %.1fx faster" % (batched, batched / legacy))
+EOF
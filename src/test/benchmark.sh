@@ -27,3 +27,12 @@ do
     cp $TIMEFILE.$benchmark $OLDFILE
   done
 done
+
+echo "Running journalling benchmark:"
+./benchmark-journalling.sh
+
+echo "Running tokenizer benchmark:"
+./benchmark-tokenizer.sh
+
+echo "Running startup benchmark:"
+./benchmark-startup.sh
@@ -370,3 +370,364 @@ test_phaseNameIn_rlReport(){
     silentIfNotDebug "rlPhaseStartTest '\$so\$me<->phase?!*na--me/-'"
     assertTrue "Phase name with special chars is correctly converted when passing value to rlReport in rlPhaseEnd" "rlPhaseEnd | grep '^so-me-phase-na-me '"
 }
+
+test_journalStream(){
+    silentIfNotDebug 'rlPhaseStartSetup'
+    silentIfNotDebug 'rlLog "setup ščř <&>"'
+    silentIfNotDebug 'rlPass "passed"'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug 'rlPhaseStartTest outer'
+    silentIfNotDebug 'rlLogMetricLow metric 1.5'
+    silentIfNotDebug 'rlPhaseStartTest inner'
+    silentIfNotDebug 'rlFail "failed"'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug 'rlPhaseStartCleanup'
+    silentIfNotDebug 'rlLog "still open"'
+    local tree="$BEAKERLIB_DIR/tree.xml" stream="$BEAKERLIB_DIR/stream.xml"
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $tree"
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --stream --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $stream"
+    assertTrue "streamed journal with open phase is the same as the built one" "cmp $tree $stream"
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $tree"
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --stream --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $stream"
+    assertTrue "streamed journal is the same as the built one" "cmp $tree $stream"
+    assertTrue "streamed journal is well-formed XML" "xmllint $stream >/dev/null"
+    rm -rf $BEAKERLIB_DIR
+}
+
+test_journalIncremental(){
+    local meta="$BEAKERLIB_DIR/meta" incremental="$BEAKERLIB_DIR/incremental.xml" stream="$BEAKERLIB_DIR/stream.xml"
+    silentIfNotDebug 'rlPhaseStartSetup'
+    silentIfNotDebug 'rlPass "passed"'
+    cp $__INTERNAL_BEAKERLIB_METAFILE $meta
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --incremental --metafile $meta --journal $incremental"
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --stream --metafile $meta --journal $stream"
+    assertTrue "incremental journal with open phase is the same as the streamed one" "cmp $incremental $stream"
+    assertTrue "checkpoint is saved next to the metafile" "[[ -f $meta.checkpoint/state ]]"
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug 'rlPhaseStartTest outer'
+    silentIfNotDebug 'rlPhaseStartTest inner'
+    silentIfNotDebug 'rlFail "failed"'
+    silentIfNotDebug 'rlPhaseEnd'
+    # a partial last line is left for the next run
+    cp $__INTERNAL_BEAKERLIB_METAFILE $meta
+    printf "  test --timestamp=1" >> $meta
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --incremental --metafile $meta --journal $incremental"
+    cp $__INTERNAL_BEAKERLIB_METAFILE $meta
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --incremental --metafile $meta --journal $incremental"
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --stream --metafile $meta --journal $stream"
+    assertTrue "incremental journal with nested phases is the same as the streamed one" "cmp $incremental $stream"
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug 'rlPhaseStartCleanup'
+    silentIfNotDebug 'rlPass "passed"'
+    silentIfNotDebug 'rlPhaseEnd'
+    # a rewritten metafile invalidates the checkpoint
+    sed -n '1,3p' $__INTERNAL_BEAKERLIB_METAFILE > $meta
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --incremental --metafile $meta --journal $incremental"
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --stream --metafile $meta --journal $stream"
+    assertTrue "rewritten metafile is processed from the beginning" "cmp $incremental $stream"
+    cp $__INTERNAL_BEAKERLIB_METAFILE $meta
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --incremental --metafile $meta --journal $incremental"
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --stream --metafile $meta --journal $stream"
+    assertTrue "incremental journal is the same as the streamed one" "cmp $incremental $stream"
+    assertTrue "incremental journal is well-formed XML" "xmllint $incremental >/dev/null"
+    assertTrue "checkpoint is kept while the metafile is open" "[[ -d $meta.checkpoint ]]"
+    # the final conversion removes the checkpoint
+    echo "#End of metafile" >> $meta
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --incremental --metafile $meta --journal $incremental"
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --stream --metafile $meta --journal $stream"
+    assertTrue "final incremental journal is the same as the streamed one" "cmp $incremental $stream"
+    assertFalse "checkpoint is removed by the final conversion" "[[ -e $meta.checkpoint ]]"
+    rm -rf $BEAKERLIB_DIR
+}
+
+test_journalMetafileV2(){
+    local version tmp=$(mktemp -d) # no-reboot
+    for version in 1 2; do
+      export BEAKERLIB_METAFILE_VERSION=$version
+      silentIfNotDebug 'journalReset'
+      silentIfNotDebug 'rlPhaseStartSetup'
+      silentIfNotDebug 'rlLog "quote \" backslash \\ ščř <&>"'
+      silentIfNotDebug 'rlPass "passed"'
+      silentIfNotDebug 'rlPhaseEnd'
+      silentIfNotDebug 'rlPhaseStartTest outer'
+      silentIfNotDebug 'rlLogMetricLow metric 1.5'
+      silentIfNotDebug 'rlPhaseStartTest inner'
+      silentIfNotDebug 'rlFail "failed"'
+      silentIfNotDebug 'rlPhaseEnd'
+      silentIfNotDebug 'rlPhaseEnd'
+      silentIfNotDebug 'rlPhaseStartCleanup'
+      silentIfNotDebug 'rlPass "passed"'
+      # times may differ between the runs
+      for phase in '' 1 2 3; do
+        $__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE ${phase:+--phase $phase} \
+          | sed -E 's/ (starttime|endtime|timestamp)="[^"]*"//g; s#<(starttime|endtime)>[^<]*#<\1>#g' \
+          > $tmp/journal-$version-${phase:-all}.xml
+      done
+    done
+    unset BEAKERLIB_METAFILE_VERSION
+    assertTrue "version 2 metafile starts with its header" "head -n 1 $__INTERNAL_BEAKERLIB_METAFILE | grep -q beakerlib_metafile"
+    assertTrue "all phases are in the index" "[[ \$(wc -l < $__INTERNAL_BEAKERLIB_METAFILE.index) -eq 4 ]]"
+    assertTrue "journal from version 2 metafile is the same as from version 1" "cmp $tmp/journal-1-all.xml $tmp/journal-2-all.xml"
+    assertTrue "phase from version 2 metafile is the same as from version 1" "cmp $tmp/journal-1-3.xml $tmp/journal-2-3.xml"
+    assertTrue "phase journal contains the phase only" "grep -q 'name=\"inner\"' $tmp/journal-2-3.xml && ! grep -q 'name=\"outer\"' $tmp/journal-2-3.xml"
+    assertTrue "nested phase is part of the phase journal" "grep -q 'name=\"inner\"' $tmp/journal-2-2.xml"
+    assertFalse "missing phase is reported" "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --phase 5"
+    rm -rf $tmp $BEAKERLIB_DIR
+}
+
+test_journalOutputs(){
+    local out="$BEAKERLIB_DIR/out"
+    silentIfNotDebug 'rlPhaseStartSetup'
+    silentIfNotDebug 'rlPass "passed"'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug 'rlPhaseStartTest'
+    silentIfNotDebug 'rlFail "failed"'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.xml \
+      --output xunit:$out.xunit --output jsonl:$out.jsonl --output summary:$out.summary"
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.ref.xml"
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.ref.xunit \
+      --xslt $BEAKERLIB/xslt-templates/xunit.xsl"
+    assertTrue "journal is the same with other outputs" "cmp $out.xml $out.ref.xml"
+    assertTrue "xunit output is the same as the transformed journal" "cmp $out.xunit $out.ref.xunit"
+    assertTrue "every element is a JSON line" \
+      "[[ \$(python -c 'import json, sys; print(len([json.loads(l) for l in sys.stdin]))' < $out.jsonl) -gt 6 ]]"
+    assertTrue "summary is sourceable" "( . $out.summary )"
+    assertTrue "summary holds phase results" \
+      "( . $out.summary; [[ \$TESTRESULT_PHASES_PASSED == 1 && \$TESTRESULT_PHASES_FAILED == 1 ]] )"
+    assertTrue "summary holds test result" \
+      "( . $out.summary; [[ \$TESTRESULT_RESULT_STRING == FAIL && \$TESTRESULT_ASSERTS_FAILED == 1 ]] )"
+    assertFalse "unknown output format is refused" "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --output bogus"
+    rm -rf $BEAKERLIB_DIR
+}
+
+test_journalCompress(){
+    local out="$BEAKERLIB_DIR/out"
+    silentIfNotDebug 'rlPhaseStartTest'
+    silentIfNotDebug 'rlPass "passed"'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.xml"
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.xml.gz \
+      --compress gzip --output summary:$out.summary.gz"
+    assertTrue "gzip compressed journal is the same" "gzip -dc $out.xml.gz | cmp - $out.xml"
+    assertTrue "other outputs are compressed too" "gzip -dc $out.summary.gz | grep -q TESTRESULT_RESULT_STRING=PASS"
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.stream.xml.gz \
+      --compress gzip --stream"
+    assertTrue "streamed journal is compressed" "gzip -dc $out.stream.xml.gz | cmp - $out.xml"
+    assertFalse "unknown compression is refused" \
+      "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --compress bogus"
+    rm -rf $BEAKERLIB_DIR
+}
+
+test_journalAttributeOrder(){
+    local journal="$BEAKERLIB_DIR/journal.xml"
+    silentIfNotDebug 'rlPhaseStartTest'
+    silentIfNotDebug 'rlPass "passed"'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $journal"
+    # attributes are written in the order they are set, also by python 2
+    assertTrue "log start time precedes end time" "grep -q '<log starttime=\"[^\"]*\" endtime=\"[^\"]*\">' $journal"
+    assertTrue "phase start time precedes end time" "grep -q '<phase [^>]*starttime=\"[^\"]*\" endtime=\"[^\"]*\"' $journal"
+    rm -rf $BEAKERLIB_DIR
+}
+
+test_journalWithoutLxml(){
+    local out="$BEAKERLIB_DIR/out"
+    # lxml module which cannot be imported
+    mkdir -p $BEAKERLIB_DIR/nolxml/lxml
+    echo 'raise ImportError("No module named lxml")' > $BEAKERLIB_DIR/nolxml/lxml/__init__.py
+    silentIfNotDebug 'rlPhaseStartTest'
+    silentIfNotDebug 'rlPass "passed"'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.xml"
+    assertTrue "journal is created without lxml" \
+      "PYTHONPATH=$BEAKERLIB_DIR/nolxml $__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.nolxml.xml"
+    assertTrue "journal is the same without lxml" "cmp $out.xml $out.nolxml.xml"
+    PYTHONPATH=$BEAKERLIB_DIR/nolxml $__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE \
+      --xslt $BEAKERLIB/xslt-templates/xunit.xsl &> /dev/null
+    assertTrue "xsl transformation needs lxml" "[[ $? -eq 3 ]]"
+    rm -rf $BEAKERLIB_DIR
+}
+
+test_journalCompare(){
+    local out="$BEAKERLIB_DIR/out"
+    silentIfNotDebug 'rlPhaseStartTest "compared"'
+    silentIfNotDebug 'rlPass "first"'
+    silentIfNotDebug 'rlPass "second"'
+    silentIfNotDebug 'rlLogMetricLow "metric" 10 0.2'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.old.xml"
+    sed -e 's/\(message="second *">\)PASS/\1FAIL/' -e 's/value="10"/value="11"/' $out.old.xml > $out.new.xml
+    python $BEAKERLIB/python/journal-compare.py $out.old.xml $out.old.xml > $out.same
+    python $BEAKERLIB/python/journal-compare.py $out.old.xml $out.new.xml > $out.diff
+    assertTrue "phases are compared" "grep -q 'comparing phase compared of type FAIL' $out.same"
+    assertTrue "same tests pass" "grep -q '^\[PASS\] second *$' $out.same"
+    assertTrue "same metric passes" "grep -q '^\[PASS\] metric' $out.same"
+    assertTrue "unchanged test passes" "grep -q '^\[PASS\] first *$' $out.diff"
+    assertTrue "failing test is reported" "grep -q '^\[FAIL\] second *$' $out.diff"
+    assertTrue "metric within tolerance warns" "grep -q '^\[WARN\] metric' $out.diff"
+    rm -rf $BEAKERLIB_DIR
+}
+
+test_journalCompareAlign(){
+    local out="$BEAKERLIB_DIR/out"
+    silentIfNotDebug 'rlPhaseStartSetup "first"'
+    silentIfNotDebug 'rlPass "setup"'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug 'rlPhaseStartTest "second"'
+    silentIfNotDebug 'rlPass "test"'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug 'rlPhaseStartTest "second"'
+    silentIfNotDebug 'rlFail "test"'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.old.xml"
+    # the first phase is renamed, the new journal has no "first" but has "third"
+    sed -e 's/name="first"/name="third"/' $out.old.xml > $out.new.xml
+    python $BEAKERLIB/python/journal-compare.py $out.old.xml $out.new.xml > $out.diff
+    assertTrue "phase missing in the new journal is reported" \
+      "grep -q 'Phase first of type WARN is missing in the new journal' $out.diff"
+    assertTrue "phase added in the new journal is reported" \
+      "grep -q 'Phase third of type WARN is not in the old journal' $out.diff"
+    assertTrue "phases of the same name are compared in order" \
+      "[[ \$(grep -c 'comparing phase second of type FAIL' $out.diff) -eq 2 ]]"
+    assertFalse "phases of the same name are not mixed up" "grep -q '^\[FAIL\]' $out.diff"
+    rm -rf $BEAKERLIB_DIR
+}
+
+test_journalCompareRuns(){
+    local out="$BEAKERLIB_DIR/out" value
+    silentIfNotDebug 'rlPhaseStartTest "measured"'
+    silentIfNotDebug 'rlPass "passed"'
+    silentIfNotDebug 'rlLogMetricLow "duration" 10 0.05'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.xml"
+    for value in 10 10.1 9.9 12 12.2 11.9 10.05 9.95 10.1; do
+      sed -e "s/value=\"10\"/value=\"$value\"/" $out.xml > $out.$value.xml
+    done
+    local baseline="-b $out.10.xml -b $out.10.1.xml -b $out.9.9.xml"
+    python $BEAKERLIB/python/journal-compare.py $baseline -c $out.12.xml -c $out.12.2.xml -c $out.11.9.xml > $out.worse
+    python $BEAKERLIB/python/journal-compare.py $baseline -c $out.10.05.xml -c $out.9.95.xml -c $out.10.1.xml > $out.same
+    python $BEAKERLIB/python/journal-compare.py --format json $baseline -c $out.12.xml -c $out.12.2.xml > $out.json
+    assertTrue "significant regression fails" "grep -q '^\[FAIL\] duration (baseline 10' $out.worse"
+    assertTrue "noise does not fail" "grep -q '^\[PASS\] duration' $out.same"
+    assertTrue "json output is valid" "python -m json.tool $out.json > /dev/null"
+    assertTrue "json output holds the statistics" \
+      "python -c 'import json, sys; m = json.load(sys.stdin)[\"phases\"][0][\"metrics\"][0]; assert m[\"result\"] == \"FAIL\" and m[\"baseline\"][\"n\"] == 3 and m[\"candidate\"][\"n\"] == 2' < $out.json"
+    assertTrue "single runs are compared by tolerance" \
+      "python $BEAKERLIB/python/journal-compare.py $out.10.xml $out.10.05.xml | grep -q '^\[WARN\] duration (First 10.0, second 10.05, toleranced first 10.5)'"
+    rm -rf $BEAKERLIB_DIR
+}
+
+test_journalCompareBatch(){
+    local out="$BEAKERLIB_DIR/out"
+    silentIfNotDebug 'rlPhaseStartTest "measured"'
+    silentIfNotDebug 'rlPass "passed"'
+    silentIfNotDebug 'rlLogMetricLow "duration" 10 0.05'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.xml"
+    sed -e 's/value="10"/value="12"/' $out.xml > $out.slow.xml
+    cat > $out.pairs <<EOF
+# baseline candidate
+$out.xml $out.xml
+$out.xml $out.slow.xml
+
+$out.xml $out.missing.xml
+EOF
+    python $BEAKERLIB/python/journal-compare.py --pairs-from $out.pairs --jobs 2 > $out.jsonl 2> $out.err
+    assertFalse "failure to compare a pair is reported" "[[ $? -eq 0 ]]"
+    assertTrue "a report is written for each pair" "[[ \$(wc -l < $out.jsonl) -eq 3 ]]"
+    assertTrue "reports are in order of pairs" \
+      "[[ \"\$(python -c 'import json, sys; print(\" \".join(json.loads(line)[\"result\"] for line in sys.stdin))' < $out.jsonl)\" == 'PASS FAIL ERROR' ]]"
+    assertTrue "summary is printed" "grep -q '^Compared 3 pairs: 1 PASS, 0 WARN, 1 FAIL, 1 ERROR' $out.err"
+    assertTrue "report of a pair matches the single compare" \
+      "diff <(sed -n 2p $out.jsonl | python -m json.tool) <(python $BEAKERLIB/python/journal-compare.py --format json $out.xml $out.slow.xml | python -m json.tool)"
+    assertFalse "malformed list of pairs is refused" \
+      "echo $out.xml | python $BEAKERLIB/python/journal-compare.py --pairs-from - 2> /dev/null"
+    rm -rf $BEAKERLIB_DIR
+}
+
+test_journalMetricHistory(){
+    local out="$BEAKERLIB_DIR/out" day history="python $BEAKERLIB/python/metric-history.py --database $BEAKERLIB_DIR/history.db"
+    silentIfNotDebug 'rlPhaseStartTest "measured"'
+    silentIfNotDebug 'rlLogMetricLow "duration" 10 0.05'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.xml"
+    # runs of the test on several days, the last one is slower
+    for day in 1 2 3 4; do
+      sed -e "s/value=\"10\"/value=\"$(( day == 4 ? 20 : 10 + day ))\"/" \
+        -e "s/<starttime\([^>]*\)>[^<]*</<starttime\1>2020-01-0$day 00:00:00 UTC</" $out.xml > $out.$day.xml
+    done
+    assertTrue "journals are ingested" "$history ingest $out.[123].xml $out.4.xml"
+    assertTrue "ingestion is idempotent" "$history ingest $out.[1234].xml 2>&1 | grep -q 'Ingested 0 journals, 4 already known'"
+    assertTrue "trend shows last values" \
+      "[[ \"\$($history trend --test \"$TEST\" --metric duration --last 2 | cut -f 2 | xargs)\" == '13.0 20.0' ]]"
+    assertTrue "trend shows rolling median" \
+      "[[ \"\$($history trend --test \"$TEST\" --metric duration --window 3 | cut -f 3 | xargs)\" == '11.0 11.5 12.0 13.0' ]]"
+    assertTrue "baseline holds runs before the candidate" \
+      "[[ \$($history baseline $out.4.xml | wc -l) -eq 3 ]]"
+    assertTrue "baseline is used to compare" \
+      "$history baseline $out.4.xml | python $BEAKERLIB/python/journal-compare.py --baselines-from - -c $out.4.xml | grep -q '^\[FAIL\] duration (First 12.0, second 20.0'"
+    rm -rf $BEAKERLIB_DIR
+}
+
+test_journalXunit(){
+    local out="$BEAKERLIB_DIR/out"
+    silentIfNotDebug 'rlPhaseStartSetup'
+    silentIfNotDebug 'rlPass "passed"'
+    silentIfNotDebug 'rlFail "failed in WARN phase"'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug 'rlPhaseStartTest "quotes \" <&>"'
+    silentIfNotDebug 'rlFail "failed <&> \" ščř"'
+    silentIfNotDebug 'rlPhaseStartTest nested'
+    silentIfNotDebug 'rlFail "failed in nested phase"'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug 'rlPass "passed"'
+    silentIfNotDebug 'rlPhaseEnd'
+    silentIfNotDebug 'rlPhaseStartCleanup'
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.xsl \
+      --xslt $BEAKERLIB/xslt-templates/xunit.xsl"
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.xunit --format xunit"
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.stream \
+      --stream --output xunit:$out.stream.xunit"
+    assertTrue "xunit output is the same as the transformed journal" "cmp $out.xsl $out.xunit"
+    assertTrue "xunit output with streamed journal is the same as the transformed journal" "cmp $out.xsl $out.stream.xunit"
+    assertTrue "xunit output contains failures" "grep -q '<failure message=\"failed in WARN phase *\"/>' $out.xunit"
+    assertTrue "xunit output contains errors" "grep -q '<error message=\"failed &lt;&amp;&gt; &quot; ščř *\"/>' $out.xunit"
+    assertFalse "nested phase is not a testcase" "grep -q 'failed in nested phase' $out.xunit"
+    silentIfNotDebug 'rlPhaseEnd'
+    BEAKERLIB_JOURNAL=xunit.xsl
+    silentIfNotDebug '__INTERNAL_JournalParamCheck'
+    silentIfNotDebug '__INTERNAL_JournalXMLCreate'
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $out.xsl \
+      --xslt $BEAKERLIB/xslt-templates/xunit.xsl"
+    assertTrue "xunit journal is created without the transformation" "[[ '$__INTERNAL_XSLT' == '--format xunit' ]]"
+    assertTrue "xunit journal is the same as the transformed journal" "cmp $out.xsl $__INTERNAL_BEAKERLIB_JOURNAL"
+    BEAKERLIB_JOURNAL=''
+    __INTERNAL_XSLT=''
+    rm -rf $BEAKERLIB_DIR
+}
+
+test_journalBatch(){
+    local dir="$BEAKERLIB_DIR/batch" out
+    silentIfNotDebug 'rlPhaseStartTest'
+    silentIfNotDebug 'rlPass "passed"'
+    silentIfNotDebug 'rlPhaseEnd'
+    mkdir -p $dir/first $dir/second $dir/broken
+    cp $__INTERNAL_BEAKERLIB_METAFILE $dir/first/journal.meta
+    cp $__INTERNAL_BEAKERLIB_METAFILE $dir/second/journal.meta
+    sed 's/--timestamp=[0-9]*/--timestamp=broken/' $__INTERNAL_BEAKERLIB_METAFILE > $dir/broken/journal.meta
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $dir/journal.xml"
+    out=$($__INTERNAL_JOURNALIST --batch --jobs 2 --output summary:summary "$dir/*/journal.meta" 2>&1)
+    assertFalse "batch with a broken metafile fails" "$__INTERNAL_JOURNALIST --batch '$dir/*/journal.meta'"
+    assertTrue "throughput is reported" "grep -q 'Converted 2 of 3 metafiles in .* metafiles/s' <<< '$out'"
+    assertTrue "broken metafile is reported" "grep -q 'Failed to convert $dir/broken/journal.meta' <<< '$out'"
+    assertTrue "journal is created next to the metafile" "cmp $dir/journal.xml $dir/first/journal.xml"
+    assertTrue "all the journals are created" "cmp $dir/journal.xml $dir/second/journal.xml"
+    assertTrue "other outputs are created next to the metafile" "[[ -s $dir/second/summary ]]"
+    echo "$dir/first/journal.meta" > $dir/list
+    assertTrue "metafiles are read from a file" "$__INTERNAL_JOURNALIST --batch --files-from $dir/list --journal list.xml"
+    assertTrue "journal of listed metafile is created" "cmp $dir/journal.xml $dir/first/list.xml"
+    rm -rf $BEAKERLIB_DIR
+}
@@ -2,16 +2,135 @@
 . ../beakerlib.sh
 test_rlPerfTime_AvgFromRuns(){
     rlPerfTime_AvgFromRuns "sleep 0.1" 5
-    assertTrue "Test for coverage test_rlPerfTime_AvgFromRuns" ' [  "$rl_retval" = "0" ]'
+    assertTrue "Sleeping does not take CPU time" "awk 'BEGIN { exit !(\$rl_retval < 0.05) }'"
 
     rlPerfTime_AvgFromRuns "(for ((i=0; i<500000; i++)); do true; done)" 4
     assertTrue "Average time for a CPU loop should be > 0" ' [ "$(echo "$rl_retval > 0" | bc)" = "1" ]'    
 
+    local out="$(mktemp)" # no-reboot
+    rlPerfTime_AvgFromRuns "true" 3 nowarmup > $out 2> /dev/null
+    assertTrue "Result is printed" "[ \"\$(cat $out)\" == '$rl_retval' ] && [ -n '$rl_retval' ]"
+    rm -f $out
+    assertTrue "Runs are repeated for precision" \
+      'rlPerfTime_AvgFromRuns "sleep 0.01" auto 2 2>&1 | grep -q "CPU time of [0-9]* runs"'
 }
 
 test_rlPerfTime_RunsInTime(){
-    
-    assertTrue "Filler test for coverage test_rlPerfTime_AvgFromRuns" 'echo ""'
+    local runs
+    runs="$(rlPerfTime_RunsInTime "sleep 0.1" 1 2)"
+    assertTrue "Runs done in time are counted" "[ '$runs' -ge 5 -a '$runs' -le 10 ]"
+    assertTrue "Result is stored in rl_retval" "[ '$runs' == '$rl_retval' ] || rlPerfTime_RunsInTime true 0.2 1 > /dev/null && [ \$rl_retval -gt 0 ]"
+    # the command runs in the current shell, without starting a new bash each time
+    local counted=0
+    counter() { let counted++; }
+    rlPerfTime_RunsInTime counter 0.2 2 > /dev/null
+    assertTrue "Functions and variables which are not exported are usable" "[ $counted -ge $(( 2 * rl_retval )) ]"
+    assertTrue "Runs are not slowed down by starting bash" "[ $rl_retval -gt 1000 ]"
+    unset -f counter
+}
+
 
+test_rlPerfTime_Scaling(){
+    silentIfNotDebug 'rlPhaseStartTest "scaling"'
+    silentIfNotDebug 'rlPerfTime_Scaling --pin --name sleeper "sleep 0.05" 1,2 1'
+    assertTrue "throughput of each level is stored" "[[ '$rl_retval' =~ ^[0-9.]+\ [0-9.]+$ ]]"
+    assertTrue "throughput of sleeping clients scales" "awk 'BEGIN { exit !($(echo $rl_retval | cut -d ' ' -f 2) > 1.5 * $(echo $rl_retval | cut -d ' ' -f 1)) }'"
+    silentIfNotDebug 'rlPhaseEnd'
+    local journal="$BEAKERLIB_DIR/journal.xml" metric
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $journal"
+    for metric in throughput.1 throughput.2 latency_p95.2 efficiency.2; do
+      assertTrue "metric $metric is in the journal" "grep -q '<metric [^>]*name=\"sleeper.$metric\"' $journal"
+    done
+    assertTrue "throughput is higher the better" "grep -q '<metric [^>]*type=\"high\"[^>]*name=\"sleeper.throughput.2\"\|<metric [^>]*name=\"sleeper.throughput.2\"[^>]*type=\"high\"' $journal"
+    rm -rf $BEAKERLIB_DIR
 }
 
+test_rlPerfResources_Record(){
+    silentIfNotDebug 'rlPhaseStartTest "recorded"'
+    rlPerfResources_Record "workload" "python -c 'memory = bytearray(32 * 1024 * 1024); import time; time.sleep(0.3)'; exit 3" 0.05 &> /dev/null
+    assertTrue "exit code of the command is returned" "[ $? -eq 3 ]"
+    silentIfNotDebug 'rlPhaseEnd'
+    assertTrue "time series is stored" \
+      "head -n 1 $BEAKERLIB_DIR/resources-workload.csv | grep -q '^time,memory_kb,cpu_percent,read_bytes,write_bytes,threads$'"
+    assertTrue "time series has the samples" "[ \$(wc -l < $BEAKERLIB_DIR/resources-workload.csv) -gt 4 ]"
+    local metric journal="$BEAKERLIB_DIR/journal.xml"
+    silentIfNotDebug "$__INTERNAL_JOURNALIST --metafile $__INTERNAL_BEAKERLIB_METAFILE --journal $journal"
+    for metric in memory_peak memory_mean memory_p95 cpu_mean cpu_peak read_bytes write_bytes threads_peak; do
+      assertTrue "metric $metric is in the journal" "grep -q '<metric [^>]*name=\"workload.$metric\"' $journal"
+    done
+    assertTrue "memory peak is measured" \
+      "[ \$(xmllint --xpath 'string(//metric[@name=\"workload.memory_peak\"]/@value)' $journal) -gt \$(( 32 * 1024 )) ]"
+    rm -rf $BEAKERLIB_DIR
+}
+
+test_memSampler(){
+    local sampler="python $BEAKERLIB/python/mem-sampler.py" out="$(mktemp)" # no-reboot
+    # the memory is allocated by a daemonized grandchild
+    $sampler -f json -o $out -- python -c '
+import os, time
+if os.fork() == 0:
+    if os.fork():
+        os._exit(0)
+    memory = bytearray(64 * 1024 * 1024)
+    time.sleep(0.5)
+    os._exit(0)
+time.sleep(1)
+os._exit(3)'
+    assertTrue "exit code of the command is kept" "[ $? -eq 3 ]"
+    assertTrue "memory of the whole process tree is measured" \
+      "python -c 'import json, sys; r = json.load(sys.stdin); assert r[\"peak\"] > 64 * 1024, r' < $out"
+    assertTrue "peak, mean and percentiles are reported" \
+      "python -c 'import json, sys; r = json.load(sys.stdin); assert r[\"peak\"] >= r[\"percentiles\"][\"p99\"] >= r[\"percentiles\"][\"p50\"] > 0 and r[\"mean\"] > 0' < $out"
+    assertTrue "pss is sampled" "$sampler --pss -p 50 -- sleep 0.1 | grep -q '^p50 [1-9]'"
+    ln -s $BEAKERLIB/python/mem-sampler.py $out.rlMemPeak
+    assertTrue "works as rlMemPeak" "[[ \"\$(python $out.rlMemPeak sleep 0.2)\" =~ ^[1-9][0-9]*$ ]]"
+    assertTrue "rlMemPeak does not include the RSS of the sampler" \
+      "[ \$(python $out.rlMemPeak sleep 0.2) -lt \$(python $out.rlMemPeak python -c 'import time; time.sleep(0.3)') ]"
+    rm -f $out $out.rlMemPeak
+}
+
+test_profileAnalyzer(){
+    local analyzer="python $BEAKERLIB/python/profile-analyzer.py" profile="$(mktemp)" # no-reboot
+    cat > $profile <<'EOF'
+1000.000000|t.sh(10)|main|f
+1000.000100|t.sh(2)|f main|f
+1000.000200|t.sh(2)|f main|sleep\ 1
+1001.000200|t.sh(3)|f main|g
+1001.000300|t.sh(6)|g f main|g
+1001.000400|t.sh(6)|g f main|sleep\ 2
+1003.000400|t.sh(11)|main|echo\ done
+1003.000500|t.sh(12)|main|exit
+EOF
+    assertTrue "self and cumulative time of functions" \
+      "$analyzer --top 0 --functions - $profile | grep -q '^f,1,1.000200,1.000200,3.000300$'"
+    assertTrue "callee time is included in the calling line" \
+      "$analyzer --top 0 --lines - $profile | grep -q '^t.sh(10),1,0.000100,3.000400$'"
+    assertTrue "folded stacks for flame graphs" \
+      "$analyzer --top 0 --folded - $profile | grep -q '^main;f;g 2000100$'"
+    assertTrue "hotspots are reported" "$analyzer --top 1 $profile | grep -A2 'functions' | grep -q ' g$'"
+    assertTrue "profiling.sh process uses the analyzer" \
+      "bash $BEAKERLIB/profiling.sh process $profile | grep -q '^g,1,2.000100,2.000100,2.000100$'"
+    rm -f $profile
+}
+
+test_memSamplerExact(){
+    local sampler="python $BEAKERLIB/python/mem-sampler.py" out="$(mktemp)" # no-reboot
+    $sampler --exact -f json -o $out -- python -c '
+import os
+if os.fork() == 0:
+    memory = bytearray(96 * 1024 * 1024)
+    for i in range(0, len(memory), 4096):
+        memory[i] = 1
+    os._exit(0)
+os.wait()
+os._exit(3)'
+    assertTrue "exit code of the command is kept" "[ $? -eq 3 ]"
+    assertTrue "peak of the descendants is measured" \
+      "python -c 'import json, sys; r = json.load(sys.stdin); assert r[\"peak\"] > 96 * 1024 and r[\"source\"] in (\"cgroup\", \"rusage\"), r' < $out"
+    assertTrue "cpu and io usage are reported" "$sampler --exact -- true | grep -q '^user [0-9.]*$'"
+    assertTrue "missing cgroup is not used" "$sampler --exact --cgroup /nonexistent -- true | grep -q '^source rusage$'"
+    assertTrue "peak inherited from the sampler is an upper bound" \
+      "$sampler --exact --cgroup /nonexistent -- true | grep -q '^bound upper$'"
+    assertFalse "peak above the sampler is exact" "grep -q '\"bound\"' $out"
+    rm -f $out
+}
@@ -275,6 +275,9 @@ export TESTID='123456'
 export TEST='beakerlib-unit-tests'
 . ../beakerlib.sh
 export __INTERNAL_JOURNALIST="$BEAKERLIB/python/journalling.py"
+export __INTERNAL_MEMSAMPLER="$BEAKERLIB/python/mem-sampler.py"
+export __INTERNAL_PERFRUNNER="$BEAKERLIB/python/perf-runner.py"
+export __INTERNAL_PROFILE_ANALYZER="$BEAKERLIB/python/profile-analyzer.py"
 export OUTPUTFILE=$(mktemp) # no-reboot
 export SCOREFILE=$(mktemp) # no-reboot
 rlJournalStart
@@ -129,6 +129,23 @@ mktest test.sh 'while [ $# -gt 0 ]; do echo "> $1" >> test.log; shift; done;'
 + grep '^> second argument' test.log || fail
 rm -f test.sh test.log
 
+########
+testcase "sanity: watcher reacts to test exit and EWD without delay"
+mktest test.sh 'echo ./cleanup.sh > "$TESTWATCHER_CLPATH"' \
+               'sleep 0.2; echo end > test.log'
+mktest cleanup.sh 'echo start > cleanup.log; sleep 10; echo end >> cleanup.log'
+start=$(date +%s%N)
+TESTWATCHER_EWD_SECS=1 + ./testwatcher.py ./test.sh &
+sleep 0.5
++ pkill -HUP -P $!
+wait
+elapsed=$(( ($(date +%s%N) - start) / 1000000 ))
+echo "elapsed: $elapsed ms"
++ grep 'end' test.log || fail
++ grep 'end' cleanup.log && fail
+[ $elapsed -lt 2500 ] || fail  # 0.5s + 1s EWD, no whole-second polling
+rm -f test.sh test.log cleanup.sh cleanup.log
+
 #
 # user-controlled (no beah) scenarios (SIGINT):
 # - test interrupted, cleanup not set up
@@ -268,6 +285,174 @@ wait
 + grep 'end' cleanup.log && fail
 rm -f test.sh test.log cleanup.sh cleanup.log
 
+#
+# hang detection (--hang-timeout):
+# - test without output and CPU activity killed, cleanup executed
+# - test writing output or consuming CPU time left alone
+########
+testcase "hang: idle test killed, cleanup successful"
+mktest test.sh 'echo ./cleanup.sh > "$TESTWATCHER_CLPATH"' \
+               'echo start > test.log; sleep 10; echo end >> test.log'
+mktest cleanup.sh 'echo end > cleanup.log'
++ ./testwatcher.py --hang-timeout 1 ./test.sh > watcher.log
++ cat watcher.log
++ grep 'start' test.log || fail
++ grep 'end' test.log && fail
++ grep 'end' cleanup.log || fail
++ grep 'test hung' watcher.log || fail
++ grep 'sleep 10' watcher.log || fail  # process state dumped
+rm -f test.sh test.log cleanup.sh cleanup.log watcher.log
+
+########
+testcase "hang: test writing output or using CPU not killed"
+mktest test.sh 'for i in 1 2 3 4 5 6; do echo $i; sleep 0.4; done' \
+               'end=$(( SECONDS + 2 )); while [ $SECONDS -lt $end ]; do :; done' \
+               'echo end > test.log'
+TESTWATCHER_HANG_SECS=1 + ./testwatcher.py ./test.sh > watcher.log
++ cat watcher.log
++ grep '^6$' watcher.log || fail  # output passed through
++ grep 'end' test.log || fail
++ grep 'test hung' watcher.log && fail
+rm -f test.sh test.log watcher.log
+
+#
+# cgroup containment (--cgroup), only where a cgroup v2 hierarchy is writable:
+# - processes escaping the process group killed with the test
+# - test resource usage passed to the cleanup
+cgroup=$(awk '{ for (i = 1; i <= NF; i++) if ($i == "-") break }
+              $(i + 1) == "cgroup2" && $4 == "/" { print $5; exit }' /proc/self/mountinfo)
+cgroup="$cgroup$(sed -n 's/^0:://p' /proc/self/cgroup)"
+cgroup="${cgroup%/}"
+if [ -n "$cgroup" ] && mkdir "$cgroup/testwatcher-probe-$$" 2>/dev/null; then
+rmdir "$cgroup/testwatcher-probe-$$"
+########
+testcase "cgroup: escaped processes killed with test (LWD), cleanup successful"
+mktest test.sh 'echo ./cleanup.sh > "$TESTWATCHER_CLPATH"' \
+               'setsid sleep 1234 &' \
+               'echo start > test.log; sleep 10; echo end >> test.log'
+mktest cleanup.sh 'cat "$TESTWATCHER_RESOURCES" > cleanup.log'
++ ./testwatcher.py --cgroup auto ./test.sh &
+sleep 1
++ pkill -HUP -P $!
+wait
++ grep 'start' test.log || fail
++ grep 'end' test.log && fail
++ pgrep -f 'sleep 1234' && fail
++ grep '^cpu_time ' cleanup.log || fail
++ ls -d "$cgroup"/testwatcher-* && fail  # removed
+rm -f test.sh test.log cleanup.sh cleanup.log
+
+########
+testcase "cgroup: processes left by a successful test killed at the end"
+mktest test.sh 'setsid sleep 1234 &' 'echo end > test.log'
+TESTWATCHER_CGROUP=auto + ./testwatcher.py ./test.sh
++ grep 'end' test.log || fail
++ pgrep -f 'sleep 1234' && fail
+rm -f test.sh test.log
+
+# the watcher alone in its cgroup, as in a dedicated service
+sub="$cgroup/testwatcher-memory-$$"
+mkdir "$sub"
+if grep -qw memory "$sub/cgroup.controllers"; then
+########
+testcase "cgroup: watcher moved to a leaf, test memory peak reported"
+mktest test.sh 'echo ./cleanup.sh > "$TESTWATCHER_CLPATH"' \
+               'python3 -c "memory = bytearray(64 * 1024 * 1024)"'
+mktest cleanup.sh 'cat "$TESTWATCHER_RESOURCES" > cleanup.log'
++ bash -c "echo 0 > $sub/cgroup.procs; exec ./testwatcher.py --cgroup auto ./test.sh"
++ grep -w memory "$sub/cgroup.subtree_control" || fail
++ awk '$1 == "memory_peak" && $2 > 65536 { found = 1 } END { exit !found }' cleanup.log || fail
+rm -f test.sh cleanup.sh cleanup.log
+fi
+rmdir "$sub/testwatcher" "$sub" 2>/dev/null || rmdir "$sub"
+fi
+
+#
+# parallel mode (--parallel):
+# - tests run concurrently, each with its own BEAKERLIB_DIR / CLPATH / cleanup
+# - tests are scheduled longest-first by recorded durations
+# - LWD kills running tests, runs their cleanups, starts no more tests
+########
+testcase "parallel: tests run concurrently, each with its own environment"
+for t in a b c; do
+    mktest $t.sh "echo ./cleanup-$t.sh > \"\$TESTWATCHER_CLPATH\"" \
+                 "echo \"\$BEAKERLIB_DIR \$TESTWATCHER_CLPATH\" > $t.log; sleep 1"
+    mktest cleanup-$t.sh "echo end > cleanup-$t.log"
+    echo "./$t.sh" >> tests.list
+done
+start=$(date +%s%N)
++ ./testwatcher.py --parallel 3 --output out tests.list
+elapsed=$(( ($(date +%s%N) - start) / 1000000 ))
+echo "elapsed: $elapsed ms"
+[ $elapsed -lt 2500 ] || fail
++ cat a.log b.log c.log
+[ "$(cat a.log b.log c.log | cut -d' ' -f1 | sort -u | wc -l)" -eq 3 ] || fail
+[ "$(cat a.log b.log c.log | cut -d' ' -f2 | sort -u | wc -l)" -eq 3 ] || fail
++ grep 'out/.*/beakerlib' a.log || fail
+for t in a b c; do
+    + grep 'end' cleanup-$t.log || fail
+done
++ ls out/*/output.log || fail
+rm -rf ./*.sh ./*.log tests.list out
+
+########
+testcase "parallel: longest tests first, durations recorded"
+for t in short long middle new; do
+    mktest $t.sh "echo $t >> order.log"
+    echo "./$t.sh" >> tests.list
+done
+echo '{"./short.sh": 1, "./long.sh": 30, "./middle.sh": 10}' > history.json
++ ./testwatcher.py --parallel 1 --history history.json --output out tests.list
++ cat order.log
+[ "$(echo $(cat order.log))" == "new long middle short" ] || fail
++ grep '"./new.sh"' history.json || fail
++ grep '"./long.sh": 30' history.json && fail  # updated by this run
+rm -rf ./*.sh ./*.log tests.list history.json out
+
+########
+testcase "parallel: malformed history ignored, previous output not overwritten"
+mktest a.sh "echo a >> a.log"
+echo "./a.sh" > tests.list
+echo '{"./a.sh": 1' > history.json
++ ./testwatcher.py --parallel 1 --history history.json --output out tests.list || fail
++ grep 'a' a.log || fail
++ grep '"./a.sh"' history.json || fail  # rewritten
++ ./testwatcher.py --parallel 1 --output out tests.list 2>error.log && fail
++ grep 'previous run' error.log || fail
+[ "$(cat a.log)" == "a" ] || fail  # not started again
+rm -rf ./*.sh ./*.log tests.list history.json out
+
+########
+testcase "parallel: missing or malformed test list reported, nothing created"
+mktest a.sh "echo a >> a.log"
++ ./testwatcher.py --parallel 1 --output out missing.list 2>error.log && fail
++ grep 'cannot read test list missing.list' error.log || fail
+printf '%s\n' './a.sh' "./a.sh 'unbalanced" > tests.list
++ ./testwatcher.py --parallel 1 --output out tests.list 2>error.log && fail
++ grep 'cannot parse test' error.log || fail
++ grep 'Traceback' error.log && fail
+[ -e a.log ] && fail  # never started
+[ -e out ] && fail  # nothing left behind
+rm -rf ./*.sh ./*.log tests.list out
+
+########
+testcase "parallel(SIGHUP): running tests killed, cleanups run, no more tests"
+for t in a b; do
+    mktest $t.sh "echo ./cleanup-$t.sh > \"\$TESTWATCHER_CLPATH\"" \
+                 "echo start > $t.log; sleep 10; echo end >> $t.log"
+    mktest cleanup-$t.sh "echo end > cleanup-$t.log"
+    echo "./$t.sh" >> tests.list
+done
++ ./testwatcher.py --parallel 1 --output out tests.list &
+sleep 1
++ pkill -HUP -P $!
+wait
++ grep 'start' a.log || fail
++ grep 'end' a.log && fail
++ grep 'end' cleanup-a.log || fail
+[ -e b.log ] && fail  # never started
+rm -rf ./*.sh ./*.log tests.list out
+
 
 
 ################################################################################